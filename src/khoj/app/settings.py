@@ -188,6 +188,52 @@ DATABASES = {
     }
 }
 
+# Set the search results cache configuration
+# Use database or file backed cache to share cached search results across server workers.
+# Use local cache for single worker deployments. It is fastest but each worker has its own cache.
+SEARCH_CACHE_BACKENDS = {
+    "database": "django.core.cache.backends.db.DatabaseCache",
+    "file": "django.core.cache.backends.filebased.FileBasedCache",
+    "local": "django.core.cache.backends.locmem.LocMemCache",
+}
+SEARCH_CACHE_BACKEND = os.getenv("KHOJ_SEARCH_CACHE_BACKEND", "database")
+SEARCH_CACHE_LOCATION = {
+    "database": "khoj_search_cache",
+    "file": os.path.expanduser(os.getenv("KHOJ_SEARCH_CACHE_DIR", "~/.khoj/cache/search")),
+    "local": "khoj_search_cache",
+}
+
+# Set the chat actor responses cache configuration
+# Cache responses of chat model calls with deterministic prompts, like search query inference, to skip repeat calls.
+LLM_CACHE_BACKEND = os.getenv("KHOJ_LLM_CACHE_BACKEND", SEARCH_CACHE_BACKEND)
+LLM_CACHE_LOCATION = {
+    "database": "khoj_llm_cache",
+    "file": os.path.expanduser(os.getenv("KHOJ_LLM_CACHE_DIR", "~/.khoj/cache/llm")),
+    "local": "khoj_llm_cache",
+}
+
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "search": {
+        "BACKEND": SEARCH_CACHE_BACKENDS.get(SEARCH_CACHE_BACKEND, SEARCH_CACHE_BACKENDS["database"]),
+        "LOCATION": SEARCH_CACHE_LOCATION.get(SEARCH_CACHE_BACKEND, SEARCH_CACHE_LOCATION["database"]),
+        "TIMEOUT": int(os.getenv("KHOJ_SEARCH_CACHE_TTL", 60 * 60)),  # 1 hour
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("KHOJ_SEARCH_CACHE_MAX_ENTRIES", 10000)),
+        },
+    },
+    "llm": {
+        "BACKEND": SEARCH_CACHE_BACKENDS.get(LLM_CACHE_BACKEND, SEARCH_CACHE_BACKENDS["database"]),
+        "LOCATION": LLM_CACHE_LOCATION.get(LLM_CACHE_BACKEND, LLM_CACHE_LOCATION["database"]),
+        "TIMEOUT": int(os.getenv("KHOJ_LLM_CACHE_TTL", 24 * 60 * 60)),  # 1 day
+        "OPTIONS": {
+            "MAX_ENTRIES": int(os.getenv("KHOJ_LLM_CACHE_MAX_ENTRIES", 10000)),
+        },
+    },
+}
+
 # User Settings
 AUTH_USER_MODEL = "database.KhojUser"
 
@@ -1,10 +1,11 @@
 import json
 import logging
 import os
+import threading
 from datetime import datetime
 from enum import Enum
 from functools import wraps
-from typing import Optional
+from typing import List, Optional
 
 import openai
 import requests
@@ -39,6 +40,7 @@ from khoj.database.adapters import (
     AgentAdapters,
     ClientApplicationAdapters,
     ConversationAdapters,
+    EntryAdapters,
     ProcessLockAdapters,
     aget_or_create_user_by_phone_number,
     aget_user_by_phone_number,
@@ -48,7 +50,7 @@ from khoj.database.adapters import (
     get_all_users,
     get_or_create_search_models,
 )
-from khoj.database.models import ClientApplication, KhojUser, ProcessLock, Subscription
+from khoj.database.models import ClientApplication, KhojUser, ProcessLock, SearchModelConfig, Subscription
 from khoj.processor.embeddings import CrossEncoderModel, EmbeddingsModel
 from khoj.routers.api_content import configure_content
 from khoj.routers.twilio import is_twilio_enabled
@@ -272,6 +274,8 @@ def initialize_server():
                         query_encode_kwargs=model.bi_encoder_query_encode_config,
                         docs_encode_kwargs=model.bi_encoder_docs_encode_config,
                         model_kwargs=model.bi_encoder_model_config,
+                        inference_backend=model.inference_backend,
+                        inference_threads=model.inference_threads,
                     )
                 }
             )
@@ -282,10 +286,15 @@ def initialize_server():
                         model.cross_encoder_inference_endpoint,
                         model.cross_encoder_inference_endpoint_api_key,
                         model_kwargs=model.cross_encoder_model_config,
+                        inference_backend=model.inference_backend,
+                        inference_threads=model.inference_threads,
                     )
                 }
             )
 
+        # Re-embed entries of search models with changed settings in the background, to not block server startup
+        threading.Thread(target=regenerate_stale_embeddings, args=(search_models,), daemon=True).start()
+
         state.SearchType = configure_search_types()
         setup_default_agent()
 
@@ -296,6 +305,17 @@ def initialize_server():
         logger.error(f"Failed to load some search models: {e}", exc_info=True)
 
 
+@clean_connections
+def regenerate_stale_embeddings(search_models: List[SearchModelConfig]):
+    for model in search_models:
+        try:
+            num_entries = EntryAdapters.regenerate_stale_embeddings(model)
+            if num_entries:
+                logger.info(f"🔁 Re-embedded {num_entries} entries with current settings of search model {model.name}")
+        except Exception as e:
+            logger.error(f"Failed to re-embed entries of search model {model.name}: {e}", exc_info=True)
+
+
 def setup_default_agent():
     AgentAdapters.create_default_agent()
 
@@ -420,6 +440,27 @@ def update_content_index_regularly():
     )
 
 
+@schedule.repeat(schedule.every(22).to(25).hours)
+@clean_connections
+def prune_stored_embeddings_regularly():
+    def prune_stored_embeddings():
+        num_pruned = EntryAdapters.prune_stored_embeddings()
+        logger.info(f"🗑️ Pruned {num_pruned} stored embeddings of content no longer indexed")
+
+    ProcessLockAdapters.run_with_lock(
+        prune_stored_embeddings, ProcessLock.Operation.INDEX_CONTENT, max_duration_in_seconds=60 * 30
+    )
+
+
+@schedule.repeat(schedule.every(15).minutes)
+def log_inference_stats():
+    "Log inference batching and query cache stats of search models. Used to tune batch window and cache size"
+    for name, embeddings_model in (state.embeddings_model or {}).items():
+        logger.info(f"📊 Inference stats of embeddings model {name}: {embeddings_model.stats()}")
+    for name, cross_encoder_model in (state.cross_encoder_model or {}).items():
+        logger.info(f"📊 Inference stats of cross-encoder model {name}: {cross_encoder_model.stats()}")
+
+
 def configure_search_types():
     # Extract core search types
     core_search_types = {e.name: e.value for e in SearchType}
@@ -6,6 +6,8 @@ import random
 import re
 import secrets
 import sys
+import time
+from contextlib import contextmanager
 from datetime import date, datetime, timedelta, timezone
 from enum import Enum
 from functools import wraps
@@ -13,10 +15,12 @@ from typing import (
     Any,
     Callable,
     Coroutine,
+    Dict,
     Iterable,
     List,
     Optional,
     ParamSpec,
+    Tuple,
     TypeVar,
 )
 
@@ -24,15 +28,17 @@ import cron_descriptor
 from apscheduler.job import Job
 from asgiref.sync import sync_to_async
 from django.contrib.sessions.backends.db import SessionStore
-from django.db import transaction
-from django.db.models import Prefetch, Q
+from django.db import connection, transaction
+from django.db.models import BinaryField, Exists, Func, IntegerField, OuterRef, Prefetch, Q, Value
+from django.db.models.expressions import RawSQL
+from django.db.models.functions import Cast, Coalesce
 from django.db.models.manager import BaseManager
 from django.db.utils import IntegrityError
 from django.utils import timezone as django_timezone
 from django_apscheduler import util
 from django_apscheduler.models import DjangoJob, DjangoJobExecution
 from fastapi import HTTPException
-from pgvector.django import CosineDistance
+from pgvector.django import CosineDistance, VectorField
 from torch import Tensor
 
 from khoj.database.models import (
@@ -41,6 +47,7 @@ from khoj.database.models import (
     ChatMessageModel,
     ChatModel,
     ClientApplication,
+    ContentEmbeddings,
     Conversation,
     Entry,
     FileObject,
@@ -73,14 +80,18 @@ from khoj.search_filter.file_filter import FileFilter
 from khoj.search_filter.word_filter import WordFilter
 from khoj.utils import state
 from khoj.utils.helpers import (
+    LINE_OFFSET_SIZE,
+    binary_quantize,
     clean_object_for_db,
     clean_text_for_db,
     generate_random_internal_agent_name,
     generate_random_name,
+    get_line_offsets,
     in_debug_mode,
     is_none_or_empty,
     normalize_email,
     timer,
+    unpack_line_offsets,
 )
 
 logger = logging.getLogger(__name__)
@@ -97,6 +108,42 @@ class SubscriptionState(Enum):
     INVALID = "invalid"
 
 
+class HammingDistance(Func):
+    "Number of differing bits between a bit string field and a query bit string of the same length"
+
+    arg_joiner = " # "
+    template = "bit_count(%(expressions)s::varbit)"
+    output_field = IntegerField()
+
+    def __init__(self, expression, bit_string: str, **extra):
+        super().__init__(expression, Value(bit_string), **extra)
+
+
+class OctetLength(Func):
+    "Size in bytes of a text or binary field. Read from the header of the stored value, without reading the value itself"
+
+    function = "octet_length"
+    output_field = IntegerField()
+
+
+class TextBytes(Func):
+    "UTF-8 encoding of a text field"
+
+    function = "convert_to"
+    template = "%(function)s(%(expressions)s, 'UTF8')"
+    output_field = BinaryField()
+
+
+class ByteSubstr(Func):
+    "Range of bytes of a binary field, from the 1-based byte position"
+
+    function = "substring"
+    output_field = BinaryField()
+
+    def __init__(self, expression, position: int, length: int, **extra):
+        super().__init__(expression, Value(position), Value(length), **extra)
+
+
 P = ParamSpec("P")
 T = TypeVar("T")
 
@@ -887,7 +934,15 @@ class AgentAdapters:
         new_file_objects = []
         reference_files_qs = FileObject.objects.filter(file_name__in=files, user=agent.creator, agent=None)
         for ref_file in reference_files_qs:
-            new_file_objects.append(FileObject(file_name=ref_file.file_name, agent=agent, raw_text=ref_file.raw_text))
+            new_file_objects.append(
+                FileObject(
+                    file_name=ref_file.file_name,
+                    agent=agent,
+                    raw_text=ref_file.raw_text,
+                    raw_text_bytes=ref_file.raw_text_bytes,
+                    line_offsets=ref_file.line_offsets,
+                )
+            )
 
         if new_file_objects:
             FileObject.objects.bulk_create(new_file_objects, batch_size=100)
@@ -1015,22 +1070,89 @@ class ConversationAdapters:
     @staticmethod
     @require_valid_user
     def get_conversation_by_user(
-        user: KhojUser, client_application: ClientApplication = None, conversation_id: str = None
+        user: KhojUser,
+        client_application: ClientApplication = None,
+        conversation_id: str = None,
+        load_messages: bool = True,
     ) -> Optional[Conversation]:
+        conversations = Conversation.objects.filter(user=user, client=client_application)
+        if not load_messages:
+            conversations = conversations.defer("conversation_log")
+
         if conversation_id:
-            conversation = (
-                Conversation.objects.filter(user=user, client=client_application, id=conversation_id)
-                .order_by("-updated_at")
-                .first()
-            )
+            conversation = conversations.filter(id=conversation_id).order_by("-updated_at").first()
         else:
             agent = AgentAdapters.get_default_agent()
-            conversation = (
-                Conversation.objects.filter(user=user, client=client_application).order_by("-updated_at").first()
-            ) or Conversation.objects.create(user=user, client=client_application, agent=agent)
+            conversation = conversations.order_by("-updated_at").first() or Conversation.objects.create(
+                user=user, client=client_application, agent=agent
+            )
 
         return conversation
 
+    @staticmethod
+    def get_conversation_messages(
+        conversation: Conversation,
+        before: Optional[str] = None,
+        after: Optional[str] = None,
+        limit: Optional[int] = None,
+        n: Optional[int] = None,
+        exclude_fields: Optional[List[str]] = None,
+    ) -> Tuple[List[dict], bool]:
+        """
+        Get a window of messages from the conversation log, without loading the full conversation log.
+
+        Select messages before or after the turn with the given turn id. Get the latest messages in the window, up to
+        the limit, unless paging forward with after. Get all messages except the latest -n messages if n is negative.
+        Drop the excluded fields, like heavy context fields, from the messages in the database.
+
+        Returns the messages in conversation order and whether there are more messages beyond the window.
+        """
+        conditions = []
+        params: Dict[str, Any] = {"conversation_id": conversation.id, "exclude_fields": exclude_fields or []}
+        if before:
+            conditions.append(
+                "message_index < (SELECT MIN(message_index) FROM messages WHERE message->>'turnId' = %(before)s)"
+            )
+            params["before"] = before
+        if after:
+            conditions.append(
+                "message_index > (SELECT MAX(message_index) FROM messages WHERE message->>'turnId' = %(after)s)"
+            )
+            params["after"] = after
+        if n and n < 0:
+            conditions.append("message_index <= (SELECT COUNT(*) FROM messages) + %(n)s")
+            params["n"] = n
+        elif n and n > 0:
+            limit = limit or n
+
+        # Fetch one more message than the limit to know if there are more messages beyond the window
+        params["limit"] = limit + 1 if limit else None
+        order = "ASC" if after else "DESC"
+        where_clause = f"WHERE {' AND '.join(conditions)}" if conditions else ""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"""
+                WITH messages AS (
+                    SELECT chat.message, chat.message_index
+                    FROM {conversation._meta.db_table},
+                        jsonb_array_elements(conversation_log->'chat') WITH ORDINALITY AS chat(message, message_index)
+                    WHERE id = %(conversation_id)s
+                )
+                SELECT (message - %(exclude_fields)s::text[])::text FROM messages
+                {where_clause}
+                ORDER BY message_index {order}
+                LIMIT %(limit)s
+                """,
+                params,
+            )
+            messages = [json.loads(row[0]) for row in cursor.fetchall()]
+
+        has_more = bool(limit) and len(messages) > limit
+        messages = messages[:limit] if limit else messages
+        if order == "DESC":
+            messages.reverse()
+        return messages, has_more
+
     @staticmethod
     @require_valid_user
     def get_all_conversations_for_export(user: KhojUser, page: Optional[int] = 0):
@@ -1072,7 +1194,7 @@ class ConversationAdapters:
         ).afirst()
         if conversation:
             conversation.title = clean_text_for_db(title)
-            await conversation.asave()
+            await conversation.asave(update_fields=["title", "updated_at"])
             return conversation
         return None
 
@@ -1508,27 +1630,35 @@ class ConversationAdapters:
         conversation_id: str = None,
         user_message: str = None,
     ):
+        """
+        Append new messages to the conversation. Create the conversation if it does not exist.
+        The conversation log of an existing conversation is not loaded, so the returned conversation defers it.
+        """
         slug = user_message.strip()[:200] if user_message else None
+        conversations = Conversation.objects.filter(user=user, client=client_application).defer("conversation_log")
         if conversation_id:
-            conversation = await Conversation.objects.filter(
-                user=user, client=client_application, id=conversation_id
-            ).afirst()
+            conversation = await conversations.filter(id=conversation_id).afirst()
         else:
-            conversation = (
-                await Conversation.objects.filter(user=user, client=client_application).order_by("-updated_at").afirst()
-            )
+            conversation = await conversations.order_by("-updated_at").afirst()
 
-        existing_messages = conversation.messages if conversation else []
-        conversation_log = {"chat": [msg.model_dump() for msg in existing_messages + new_messages]}
-        cleaned_conversation_log = clean_object_for_db(conversation_log)
+        new_log_messages = clean_object_for_db([msg.model_dump() for msg in new_messages])
         if conversation:
-            conversation.conversation_log = cleaned_conversation_log
+            # Append new messages to the conversation log in the database.
+            # Avoids validating and rewriting all the existing messages on every chat turn
             conversation.slug = slug
             conversation.updated_at = django_timezone.now()
-            await conversation.asave()
+            await Conversation.objects.filter(id=conversation.id).aupdate(
+                conversation_log=RawSQL(
+                    "jsonb_set(COALESCE(conversation_log, '{}'::jsonb), '{chat}', "
+                    "COALESCE(conversation_log->'chat', '[]'::jsonb) || %s::jsonb)",
+                    [json.dumps(new_log_messages)],
+                ),
+                slug=slug,
+                updated_at=conversation.updated_at,
+            )
         else:
             conversation = await Conversation.objects.acreate(
-                user=user, conversation_log=cleaned_conversation_log, client=client_application, slug=slug
+                user=user, conversation_log={"chat": new_log_messages}, client=client_application, slug=slug
             )
         return conversation
 
@@ -1697,18 +1827,54 @@ class ConversationAdapters:
         return True
 
 
+def get_path_filter(field: str, glob: str, full_match: bool = False, char_classes: bool = False) -> Q:
+    """
+    Compile glob pattern on file paths into a query predicate served by the file path indexes.
+    Globs without wildcards become substring or exact lookups. Full match globs use their literal prefix for prefix lookups.
+    Other globs become regex lookups served by the trigram index on file paths.
+    """
+    if not FileFilter.has_wildcards(glob, char_classes):
+        return Q(**{field: glob}) if full_match else Q(**{f"{field}__contains": glob})
+
+    regex = FileFilter.glob_to_regex(glob, char_classes)
+    if not full_match:
+        return Q(**{f"{field}__regex": regex})
+
+    path_filter = Q(**{f"{field}__regex": f"^{regex}$"})
+    literal_prefix = re.split(r"[*?\[]" if char_classes else r"[*?]", glob, maxsplit=1)[0]
+    if literal_prefix:
+        path_filter &= Q(**{f"{field}__startswith": literal_prefix})
+    return path_filter
+
+
+# Minimum size in bytes of file text to store its UTF-8 encoding separately. Smaller files are read whole
+FILE_TEXT_BYTES_MIN_SIZE = 1024 * 1024
+
+
 class FileObjectAdapters:
+    @staticmethod
+    def get_raw_text_fields(raw_text: str) -> Dict[str, Any]:
+        "Get cleaned file text with the fields derived from it, to store on a file object"
+        cleaned_raw_text = clean_text_for_db(raw_text)
+        raw_text_bytes = cleaned_raw_text.encode("utf-8")
+        return {
+            "raw_text": cleaned_raw_text,
+            "raw_text_bytes": raw_text_bytes if len(raw_text_bytes) >= FILE_TEXT_BYTES_MIN_SIZE else None,
+            "line_offsets": get_line_offsets(raw_text_bytes),
+        }
+
     @staticmethod
     def update_raw_text(file_object: FileObject, new_raw_text: str):
-        cleaned_raw_text = clean_text_for_db(new_raw_text)
-        file_object.raw_text = cleaned_raw_text
+        for field, value in FileObjectAdapters.get_raw_text_fields(new_raw_text).items():
+            setattr(file_object, field, value)
         file_object.save()
 
     @staticmethod
     @require_valid_user
     def create_file_object(user: KhojUser, file_name: str, raw_text: str):
-        cleaned_raw_text = clean_text_for_db(raw_text)
-        return FileObject.objects.create(user=user, file_name=file_name, raw_text=cleaned_raw_text)
+        return FileObject.objects.create(
+            user=user, file_name=file_name, **FileObjectAdapters.get_raw_text_fields(raw_text)
+        )
 
     @staticmethod
     @require_valid_user
@@ -1725,6 +1891,11 @@ class FileObjectAdapters:
     def delete_file_object_by_name(user: KhojUser, file_name: str):
         return FileObject.objects.filter(user=user, file_name=file_name).delete()
 
+    @staticmethod
+    @require_valid_user
+    def delete_file_objects_by_names(user: KhojUser, file_names: List[str]):
+        return FileObject.objects.filter(user=user, file_name__in=file_names).delete()
+
     @staticmethod
     @require_valid_user
     def delete_all_file_objects(user: KhojUser):
@@ -1732,21 +1903,62 @@ class FileObjectAdapters:
 
     @staticmethod
     async def aupdate_raw_text(file_object: FileObject, new_raw_text: str):
-        cleaned_raw_text = clean_text_for_db(new_raw_text)
-        file_object.raw_text = cleaned_raw_text
+        for field, value in FileObjectAdapters.get_raw_text_fields(new_raw_text).items():
+            setattr(file_object, field, value)
         await file_object.asave()
 
     @staticmethod
     @arequire_valid_user
     async def acreate_file_object(user: KhojUser, file_name: str, raw_text: str):
-        cleaned_raw_text = clean_text_for_db(raw_text)
-        return await FileObject.objects.acreate(user=user, file_name=file_name, raw_text=cleaned_raw_text)
+        return await FileObject.objects.acreate(
+            user=user, file_name=file_name, **FileObjectAdapters.get_raw_text_fields(raw_text)
+        )
 
     @staticmethod
     @arequire_valid_user
     async def aget_file_objects_by_name(user: KhojUser, file_name: str, agent: Agent = None):
         return await sync_to_async(list)(FileObject.objects.filter(user=user, file_name=file_name, agent=agent))
 
+    @staticmethod
+    @arequire_valid_user
+    async def aget_file_object_lines(
+        user: KhojUser, file_name: str, start_line: int, end_line: int, agent: Agent = None
+    ) -> Optional[Tuple[str, int]]:
+        """
+        Get text of lines start_line to end_line (1-based, inclusive) of the file and its total number of lines.
+        Reads only the offsets of the requested lines, then only the bytes of those lines, from the database.
+        So reading lines costs the same anywhere in the file. Returns None if the file does not exist.
+        """
+        # Offsets of the first requested line to the line after the last requested line
+        num_offsets = end_line - start_line + 2
+        file_lines = (
+            FileObject.objects.filter(user=user, file_name=file_name, agent=agent)
+            .annotate(
+                requested_line_offsets=ByteSubstr(
+                    "line_offsets", (start_line - 1) * LINE_OFFSET_SIZE + 1, num_offsets * LINE_OFFSET_SIZE
+                ),
+                line_offsets_size=OctetLength("line_offsets"),
+                text_size=OctetLength("raw_text"),
+            )
+            .values_list("id", "requested_line_offsets", "line_offsets_size", "text_size")
+        )
+        result = await file_lines.afirst()
+        if result is None:
+            return None
+        file_object_id, requested_line_offsets, line_offsets_size, text_size = result
+        line_count = (line_offsets_size or 0) // LINE_OFFSET_SIZE
+
+        # Lines after the last line start one byte after the end of the text, i.e after an implicit newline
+        line_offsets = unpack_line_offsets(bytes(requested_line_offsets or b""))
+        line_offsets += [(text_size or 0) + 1] * (num_offsets - len(line_offsets))
+        start_offset, end_offset = line_offsets[0], line_offsets[-1]
+        if end_offset - start_offset - 1 <= 0:
+            return "", line_count
+        lines_text = await FileObjectAdapters.aget_file_object_text_bytes(
+            user, file_object_id, start_offset, end_offset - start_offset - 1
+        )
+        return lines_text.decode("utf-8"), line_count
+
     @staticmethod
     @arequire_valid_user
     async def aget_file_objects_by_path_prefix(user: KhojUser, path_prefix: str, agent: Agent = None):
@@ -1755,6 +1967,24 @@ class FileObjectAdapters:
             FileObject.objects.filter(user=user, agent=agent, file_name__startswith=path_prefix)
         )
 
+    @staticmethod
+    @arequire_valid_user
+    async def aget_file_names_by_path(
+        user: KhojUser, path_prefix: str = "", pattern: Optional[str] = None, agent: Agent = None
+    ) -> List[str]:
+        """
+        Get names of files under the path prefix, matching the glob pattern relative to the path prefix, if specified.
+        Does not load the file contents.
+        """
+        query = FileObject.objects.filter(user=user, agent=agent)
+        if pattern:
+            query = query.filter(
+                get_path_filter("file_name", f"{path_prefix}{pattern}", full_match=True, char_classes=True)
+            )
+        elif path_prefix:
+            query = query.filter(file_name__startswith=path_prefix)
+        return await sync_to_async(list)(query.order_by("-updated_at").values_list("file_name", flat=True))
+
     @staticmethod
     @arequire_valid_user
     async def aget_file_objects_by_names(user: KhojUser, file_names: List[str]):
@@ -1799,6 +2029,38 @@ class FileObjectAdapters:
             query = query.filter(file_name__startswith=path_prefix)
         return await sync_to_async(list)(query)
 
+    @staticmethod
+    @arequire_valid_user
+    async def aget_file_object_names_by_regex(
+        user: KhojUser, regex_pattern: str, path_prefix: Optional[str] = None
+    ) -> List[Tuple[int, str, int]]:
+        """
+        Get id, name and size in bytes of the text of file objects with text matching the regex pattern, ordered by name.
+        Does not load the file contents. Matching files are shortlisted by the trigram index on file text.
+        """
+        query = FileObject.objects.filter(user=user, agent=None, raw_text__iregex=regex_pattern)
+        if path_prefix:
+            query = query.filter(file_name__startswith=path_prefix)
+        query = query.annotate(text_size=OctetLength("raw_text")).order_by("file_name")
+        return await sync_to_async(list)(query.values_list("id", "file_name", "text_size"))
+
+    @staticmethod
+    @arequire_valid_user
+    async def aget_file_object_text_bytes(user: KhojUser, file_object_id: int, start: int, length: int) -> bytes:
+        """
+        Get chunk of the UTF-8 encoded file object text starting at the 0-based byte offset.
+        Only reads the stored chunks of the text bytes of large files the byte range spans. So reads cost the same
+        anywhere in large files. Smaller files without stored text bytes are encoded whole to read the byte range.
+        """
+        chunks = FileObject.objects.filter(user=user, id=file_object_id).annotate(
+            text_chunk=Coalesce(
+                ByteSubstr("raw_text_bytes", start + 1, length),
+                ByteSubstr(TextBytes("raw_text"), start + 1, length),
+            )
+        )
+        text_chunk = await chunks.values_list("text_chunk", flat=True).afirst()
+        return bytes(text_chunk or b"")
+
 
 class EntryAdapters:
     word_filter = WordFilter()
@@ -1814,6 +2076,8 @@ class EntryAdapters:
     @require_valid_user
     def delete_entry_by_file(user: KhojUser, file_path: str):
         deleted_count, _ = Entry.objects.filter(user=user, file_path=file_path).delete()
+        if deleted_count:
+            state.search_cache.invalidate(user.uuid)
         return deleted_count
 
     @staticmethod
@@ -1839,6 +2103,8 @@ class EntryAdapters:
             batch = Entry.objects.filter(id__in=batch_ids, user=user)
             count, _ = batch.delete()
             deleted_count += count
+        if deleted_count:
+            state.search_cache.invalidate(user.uuid)
         return deleted_count
 
     @staticmethod
@@ -1851,6 +2117,8 @@ class EntryAdapters:
             batch = Entry.objects.filter(id__in=batch_ids, user=user)
             count, _ = await batch.adelete()
             deleted_count += count
+        if deleted_count:
+            await sync_to_async(state.search_cache.invalidate)(user.uuid)
         return deleted_count
 
     @staticmethod
@@ -1858,10 +2126,108 @@ class EntryAdapters:
     def get_existing_entry_hashes_by_file(user: KhojUser, file_path: str):
         return Entry.objects.filter(user=user, file_path=file_path).values_list("hashed_value", flat=True)
 
+    @staticmethod
+    @require_valid_user
+    def get_existing_entry_ids_by_file_and_hash(
+        user: KhojUser, file_type: str, batch_size=5000
+    ) -> Dict[str, Dict[str, List[int]]]:
+        "Get ids of user's existing entries of file type, grouped by file path and hash. Stream them in a single query"
+        entry_ids_by_file: Dict[str, Dict[str, List[int]]] = {}
+        entry_rows = (
+            Entry.objects.filter(user=user, file_type=file_type)
+            .values_list("id", "file_path", "hashed_value")
+            .iterator(chunk_size=batch_size)
+        )
+        for entry_id, file_path, hashed_value in entry_rows:
+            entry_ids_by_file.setdefault(file_path, {}).setdefault(hashed_value, []).append(entry_id)
+        return entry_ids_by_file
+
+    @staticmethod
+    def get_stored_embedding_hashes(search_model: SearchModelConfig, hashed_values: List[str], batch_size=1000):
+        "Get hashes of content with embeddings already stored for the search model"
+        model_fingerprint = search_model.get_embeddings_fingerprint()
+        stored_hashes = set()
+        for i in range(0, len(hashed_values), batch_size):
+            batch = hashed_values[i : i + batch_size]
+            stored_hashes |= set(
+                ContentEmbeddings.objects.filter(
+                    search_model=search_model, model_fingerprint=model_fingerprint, hashed_value__in=batch
+                ).values_list("hashed_value", flat=True)
+            )
+        return stored_hashes
+
+    @staticmethod
+    def get_stored_embeddings(search_model: SearchModelConfig, hashed_values: List[str]):
+        "Get stored embeddings of content by its hash for the search model"
+        return dict(
+            ContentEmbeddings.objects.filter(
+                search_model=search_model,
+                model_fingerprint=search_model.get_embeddings_fingerprint(),
+                hashed_value__in=hashed_values,
+            ).values_list("hashed_value", "embeddings")
+        )
+
+    @staticmethod
+    def store_embeddings(search_model: SearchModelConfig, hashed_values: List[str], embeddings: List, batch_size=500):
+        "Store embeddings of content by its hash for the search model to reuse for identical content"
+        model_fingerprint = search_model.get_embeddings_fingerprint()
+        # Overwrite previously stored embeddings of the content, e.g when regenerating the index
+        ContentEmbeddings.objects.bulk_create(
+            [
+                ContentEmbeddings(
+                    search_model=search_model,
+                    model_fingerprint=model_fingerprint,
+                    hashed_value=hashed_value,
+                    embeddings=embedding,
+                )
+                for hashed_value, embedding in zip(hashed_values, embeddings)
+            ],
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["search_model", "model_fingerprint", "hashed_value"],
+            update_fields=["embeddings", "updated_at"],
+        )
+
+    @staticmethod
+    def prune_stored_embeddings() -> int:
+        """
+        Delete stored embeddings of content no longer indexed by any user or agent,
+        and stored embeddings generated with previous settings of their search model.
+        Return number of stored embeddings deleted.
+        """
+        num_deleted = 0
+        for search_model in SearchModelConfig.objects.all():
+            deleted_count, _ = (
+                ContentEmbeddings.objects.filter(search_model=search_model)
+                .exclude(model_fingerprint=search_model.get_embeddings_fingerprint())
+                .delete()
+            )
+            num_deleted += deleted_count
+
+        indexed_content = Entry.objects.filter(
+            search_model_id=OuterRef("search_model_id"), hashed_value=OuterRef("hashed_value")
+        )
+        deleted_count, _ = ContentEmbeddings.objects.filter(~Exists(indexed_content)).delete()
+        return num_deleted + deleted_count
+
+    @staticmethod
+    @require_valid_user
+    def delete_entries_by_ids(user: KhojUser, entry_ids: List[int], batch_size=1000) -> int:
+        deleted_count = 0
+        for i in range(0, len(entry_ids), batch_size):
+            batch = entry_ids[i : i + batch_size]
+            count, _ = Entry.objects.filter(user=user, id__in=batch).delete()
+            deleted_count += count
+        if deleted_count:
+            state.search_cache.invalidate(user.uuid)
+        return deleted_count
+
     @staticmethod
     @require_valid_user
     def delete_entry_by_hash(user: KhojUser, hashed_values: List[str]):
-        Entry.objects.filter(user=user, hashed_value__in=hashed_values).delete()
+        deleted_count, _ = Entry.objects.filter(user=user, hashed_value__in=hashed_values).delete()
+        if deleted_count:
+            state.search_cache.invalidate(user.uuid)
 
     @staticmethod
     def get_entries_by_date_filter(entry: BaseManager[Entry], start_date: date, end_date: date):
@@ -1893,7 +2259,23 @@ class EntryAdapters:
     @staticmethod
     @arequire_valid_user
     async def adelete_entry_by_file(user: KhojUser, file_path: str):
-        return await Entry.objects.filter(user=user, file_path=file_path).adelete()
+        deleted = await Entry.objects.filter(user=user, file_path=file_path).adelete()
+        if deleted[0]:
+            await sync_to_async(state.search_cache.invalidate)(user.uuid)
+        return deleted
+
+    @staticmethod
+    @require_valid_user
+    def delete_entries_by_filenames(user: KhojUser, filenames: List[str], batch_size=1000):
+        deleted_count = 0
+        for i in range(0, len(filenames), batch_size):
+            batch = filenames[i : i + batch_size]
+            count, _ = Entry.objects.filter(user=user, file_path__in=batch).delete()
+            deleted_count += count
+
+        if deleted_count:
+            state.search_cache.invalidate(user.uuid)
+        return deleted_count
 
     @staticmethod
     @arequire_valid_user
@@ -1904,6 +2286,8 @@ class EntryAdapters:
             count, _ = await Entry.objects.filter(user=user, file_path__in=batch).adelete()
             deleted_count += count
 
+        if deleted_count:
+            await sync_to_async(state.search_cache.invalidate)(user.uuid)
         return deleted_count
 
     @staticmethod
@@ -1960,6 +2344,7 @@ class EntryAdapters:
         if len(word_filters) == 0 and len(file_filters) == 0 and len(date_filters) == 0:
             return Entry.objects.filter(owner_filter)
 
+        # Case-insensitive word filters are served by the trigram index on upper cased entry text
         for term in word_filters:
             if term.startswith("+"):
                 q_filter_terms &= Q(raw__icontains=term[1:])
@@ -1971,15 +2356,11 @@ class EntryAdapters:
         if len(file_filters) > 0:
             for term in file_filters:
                 if term.startswith("-"):
-                    # Convert the glob term to a regex pattern
-                    regex_term = re.escape(term[1:]).replace(r"\*", ".*").replace(r"\?", ".")
-                    # Exclude all files that match the regex term
-                    q_file_filter_terms &= ~Q(file_path__regex=regex_term)
+                    # Exclude all files that match the glob term
+                    q_file_filter_terms &= ~get_path_filter("file_path", term[1:])
                 else:
-                    # Convert the glob term to a regex pattern
-                    regex_term = re.escape(term).replace(r"\*", ".*").replace(r"\?", ".")
-                    # Include any files that match the regex term
-                    q_file_filter_terms |= Q(file_path__regex=regex_term)
+                    # Include any files that match the glob term
+                    q_file_filter_terms |= get_path_filter("file_path", term)
 
             q_filter_terms &= q_file_filter_terms
 
@@ -1999,6 +2380,226 @@ class EntryAdapters:
             relevant_entries = relevant_entries.filter(file_type=file_type_filter)
         return relevant_entries
 
+    @staticmethod
+    def has_query_filters(query: str) -> bool:
+        return (
+            len(EntryAdapters.word_filter.get_filter_terms(query)) > 0
+            or len(EntryAdapters.file_filter.get_filter_terms(query)) > 0
+            or len(EntryAdapters.date_filter.get_query_date_range(query)) > 0
+        )
+
+    @staticmethod
+    def get_vector_index_name(user: KhojUser, search_model: SearchModelConfig) -> str:
+        return f"entry_embeddings_{search_model.vector_index_type}_user_{user.id}_model_{search_model.id}"
+
+    @staticmethod
+    def has_vector_index(user: KhojUser, search_model: SearchModelConfig) -> bool:
+        if (
+            search_model.vector_index_type == SearchModelConfig.VectorIndexType.NONE
+            or not search_model.embeddings_dimensions
+        ):
+            return False
+
+        return EntryAdapters.get_vector_index_validity(user, search_model) is True
+
+    @staticmethod
+    def get_vector_index_validity(user: KhojUser, search_model: SearchModelConfig) -> Optional[bool]:
+        """
+        Check if the vector index of the user's knowledge base is valid. Return None if the index does not exist.
+        A failed or interrupted concurrent index build leaves behind an invalid index that the query planner does not use.
+        """
+        index_name = EntryAdapters.get_vector_index_name(user, search_model)
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT i.indisvalid FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid WHERE c.relname = %s",
+                [index_name],
+            )
+            row = cursor.fetchone()
+            return row[0] if row else None
+
+    @staticmethod
+    def drop_vector_indexes(search_model: SearchModelConfig) -> int:
+        "Drop vector indexes of all knowledge bases on the search model's embeddings. Return number of indexes dropped"
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT indexname FROM pg_indexes WHERE tablename = %s AND indexname ~ %s",
+                [Entry._meta.db_table, f"^entry_embeddings_[a-z]+_user_[0-9]+_model_{int(search_model.id)}$"],
+            )
+            index_names = [row[0] for row in cursor.fetchall()]
+            for index_name in index_names:
+                cursor.execute(f"DROP INDEX IF EXISTS {index_name}")
+        return len(index_names)
+
+    @staticmethod
+    def set_embeddings_dimensions(search_model: SearchModelConfig, dimensions: int) -> bool:
+        """
+        Record dimensions of the embeddings generated by the search model, if changed. Return True if changed.
+        Vector indexes built for the previous dimensions are dropped, as they index embeddings cast to those dimensions.
+        """
+        if not dimensions or search_model.embeddings_dimensions == dimensions:
+            return False
+        # Block vector index builds of all knowledge bases on the search model while its dimensions change
+        with EntryAdapters.embeddings_lock(search_model):
+            # Another indexer may have recorded the dimensions while waiting for the lock
+            search_model.refresh_from_db(fields=["embeddings_dimensions"])
+            if search_model.embeddings_dimensions == dimensions:
+                return False
+            if search_model.embeddings_dimensions:
+                logger.info(
+                    f"Embedding dimensions of search model {search_model.name} changed "
+                    f"from {search_model.embeddings_dimensions} to {dimensions}. Dropping its vector indexes."
+                )
+                EntryAdapters.drop_vector_indexes(search_model)
+            search_model.embeddings_dimensions = dimensions
+            search_model.save(update_fields=["embeddings_dimensions"])
+        return True
+
+    @staticmethod
+    def regenerate_stale_embeddings(search_model: SearchModelConfig, batch_size=1000) -> int:
+        """
+        Re-embed entries on the search model if they were embedded with different settings. E.g another inference backend.
+        Their embeddings are not comparable with query embeddings of the current settings. Return number of entries re-embedded.
+        Entries of search models without a recorded embeddings fingerprint are assumed to be embedded with current settings.
+        """
+        model_fingerprint = search_model.get_embeddings_fingerprint()
+        if search_model.embeddings_fingerprint == model_fingerprint:
+            return 0
+
+        num_entries = 0
+        # Block indexing into knowledge bases on the search model while its entries are re-embedded
+        with EntryAdapters.embeddings_lock(search_model):
+            # Another server worker may have re-embedded the entries while waiting for the lock
+            search_model.refresh_from_db(fields=["embeddings_fingerprint"])
+            if search_model.embeddings_fingerprint == model_fingerprint:
+                return 0
+            if search_model.embeddings_fingerprint is not None:
+                logger.info(f"Settings of search model {search_model.name} changed. Re-embedding its entries.")
+                EntryAdapters.drop_vector_indexes(search_model)
+                entries = Entry.objects.filter(search_model=search_model).only("id", "compiled", "hashed_value")
+                last_id = 0
+                while batch := list(entries.filter(id__gt=last_id).order_by("id")[:batch_size]):
+                    embeddings = state.embeddings_model[search_model.name].embed_documents(
+                        [entry.compiled for entry in batch]
+                    )
+                    EntryAdapters.set_embeddings_dimensions(search_model, len(embeddings[0]))
+                    # Binary embeddings are re-quantized from the new embeddings on the next index update
+                    for entry, embedding in zip(batch, embeddings):
+                        entry.embeddings = embedding
+                        entry.binary_embeddings = None
+                    Entry.objects.bulk_update(batch, ["embeddings", "binary_embeddings"])
+                    EntryAdapters.store_embeddings(search_model, [entry.hashed_value for entry in batch], embeddings)
+                    num_entries += len(batch)
+                    last_id = batch[-1].id
+            search_model.embeddings_fingerprint = model_fingerprint
+            search_model.save(update_fields=["embeddings_fingerprint"])
+
+        # Rebuild vector indexes dropped with the stale embeddings. Invalidate search results ranked by them
+        if num_entries:
+            for user in KhojUser.objects.filter(entry__search_model=search_model).distinct():
+                EntryAdapters.update_vector_index(user, search_model)
+                state.search_cache.invalidate(user.uuid)
+        return num_entries
+
+    @staticmethod
+    @contextmanager
+    def embeddings_lock(search_model: SearchModelConfig, user: KhojUser = None, shared: bool = False):
+        """
+        Serialize changes to the embeddings index of a search model, or of a user's knowledge base on it.
+        Uses a Postgres advisory lock. So it holds across indexing threads and server workers.
+
+        Poll for the lock instead of blocking on it. A concurrent index build waits for running statements
+        to finish, so a statement blocked on the lock held by the index builder would deadlock with it.
+        """
+        lock_key = f"khoj_embeddings_index_model_{search_model.id}" + (f"_user_{user.id}" if user else "")
+        lock_mode = "_shared" if shared else ""
+        with connection.cursor() as cursor:
+            while True:
+                cursor.execute(f"SELECT pg_try_advisory_lock{lock_mode}(hashtext(%s))", [lock_key])
+                if cursor.fetchone()[0]:
+                    break
+                time.sleep(0.1)
+        try:
+            yield
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT pg_advisory_unlock{lock_mode}(hashtext(%s))", [lock_key])
+
+    @staticmethod
+    @require_valid_user
+    def update_vector_index(user: KhojUser, search_model: SearchModelConfig) -> bool:
+        """
+        Build an approximate nearest neighbour index on the embeddings of the user's knowledge base, once it is large enough.
+
+        Each large knowledge base gets its own partial index. So filtering by owner does not degrade the recall of
+        the index scan, and small knowledge bases are not slowed down by a shared index. They are searched exactly.
+        """
+        if search_model.vector_index_type == SearchModelConfig.VectorIndexType.NONE:
+            return False
+        # Content types of a knowledge base are indexed concurrently. Build its index once, for current dimensions
+        with (
+            EntryAdapters.embeddings_lock(search_model, shared=True),
+            EntryAdapters.embeddings_lock(search_model, user),
+        ):
+            search_model.refresh_from_db(fields=["embeddings_dimensions"])
+            return EntryAdapters._build_vector_index(user, search_model)
+
+    @staticmethod
+    def _build_vector_index(user: KhojUser, search_model: SearchModelConfig) -> bool:
+        if not search_model.embeddings_dimensions:
+            return False
+        index_validity = EntryAdapters.get_vector_index_validity(user, search_model)
+        if index_validity is True:
+            return True
+
+        num_entries = Entry.objects.filter(user=user, search_model=search_model).count()
+        if num_entries < search_model.vector_index_min_entries:
+            return False
+
+        if search_model.vector_index_type == SearchModelConfig.VectorIndexType.IVFFLAT:
+            index_params = f"lists = {max(1, num_entries // 1000)}"
+        else:
+            index_params = "m = 16, ef_construction = 64"
+
+        # Build index without blocking writes to the entries table, unless running in a transaction
+        concurrently = "" if connection.in_atomic_block else "CONCURRENTLY"
+        with timer(f"Built {search_model.vector_index_type} index over {num_entries} entries of {user} in", logger):
+            with connection.cursor() as cursor:
+                # Drop invalid index left behind by a failed build before rebuilding it
+                if index_validity is False:
+                    logger.warning(f"Rebuilding invalid vector index of {user}'s knowledge base")
+                    cursor.execute(
+                        f"DROP INDEX {concurrently} IF EXISTS {EntryAdapters.get_vector_index_name(user, search_model)}"
+                    )
+                cursor.execute(
+                    f"CREATE INDEX {concurrently} IF NOT EXISTS {EntryAdapters.get_vector_index_name(user, search_model)} "
+                    f"ON {Entry._meta.db_table} USING {search_model.vector_index_type} "
+                    f"((embeddings::vector({int(search_model.embeddings_dimensions)})) vector_cosine_ops) "
+                    f"WITH ({index_params}) "
+                    f"WHERE user_id = {int(user.id)} AND search_model_id = {int(search_model.id)}"
+                )
+        return True
+
+    @staticmethod
+    @require_valid_user
+    def update_quantized_embeddings(user: KhojUser, search_model: SearchModelConfig) -> int:
+        """
+        Set binary embeddings of the user's entries indexed before the search model quantized embeddings.
+        Return number of entries updated.
+        """
+        if search_model.embeddings_quantization != SearchModelConfig.EmbeddingsQuantization.BINARY:
+            return 0
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"UPDATE {Entry._meta.db_table} SET binary_embeddings = ("
+                "SELECT string_agg(CASE WHEN value > 0 THEN '1' ELSE '0' END, '' ORDER BY position) "
+                "FROM unnest(embeddings::real[]) WITH ORDINALITY AS element(value, position)"
+                ")::varbit "
+                "WHERE user_id = %s AND search_model_id = %s AND binary_embeddings IS NULL",
+                [user.id, search_model.id],
+            )
+            return cursor.rowcount
+
     @staticmethod
     def search_with_embeddings(
         raw_query: str,
@@ -2008,7 +2609,34 @@ class EntryAdapters:
         file_type_filter: str = None,
         max_distance: float = math.inf,
         agent: Agent = None,
-    ):
+        search_model: SearchModelConfig = None,
+    ) -> List[Entry]:
+        return EntryAdapters.search_with_multiple_embeddings(
+            raw_queries=[raw_query],
+            embeddings=[embeddings],
+            user=user,
+            max_results=max_results,
+            file_type_filter=file_type_filter,
+            max_distance=max_distance,
+            agent=agent,
+            search_model=search_model,
+        )[0]
+
+    @staticmethod
+    def search_with_multiple_embeddings(
+        raw_queries: List[str],
+        embeddings: List[Tensor],
+        user: KhojUser,
+        max_results: int = 10,
+        file_type_filter: str = None,
+        max_distance: float = math.inf,
+        agent: Agent = None,
+        search_model: SearchModelConfig = None,
+    ) -> List[List[Entry]]:
+        """
+        Get the top entries for each query in a single database round-trip.
+        The top entries for each query are retrieved by a subquery and combined via UNION ALL.
+        """
         owner_filter = Q()
 
         if user is not None:
@@ -2016,19 +2644,81 @@ class EntryAdapters:
         if agent is not None:
             owner_filter |= Q(agent=agent)
 
-        if owner_filter == Q():
-            return Entry.objects.none()
+        if owner_filter == Q() or not raw_queries:
+            return [[] for _ in raw_queries]
+
+        # Use the approximate nearest neighbour index of the user's knowledge base, if it has one.
+        # The partial index only covers the user's unfiltered entries. Search exactly when any other entries requested.
+        can_use_vector_index = (
+            search_model is not None
+            and user is not None
+            and not file_type_filter
+            and (agent is None or not EntryAdapters.agent_has_entries(agent))
+            and EntryAdapters.has_vector_index(user, search_model)
+        )
 
-        relevant_entries = EntryAdapters.apply_filters(user, raw_query, file_type_filter, agent)
-        relevant_entries = relevant_entries.filter(owner_filter).annotate(
-            distance=CosineDistance("embeddings", embeddings)
+        # Otherwise shortlist entries by their binary embeddings, if quantized, and rescore the shortlist exactly
+        use_quantized_embeddings = (
+            search_model is not None
+            and search_model.embeddings_quantization == SearchModelConfig.EmbeddingsQuantization.BINARY
         )
-        relevant_entries = relevant_entries.filter(distance__lte=max_distance)
 
-        if file_type_filter:
-            relevant_entries = relevant_entries.filter(file_type=file_type_filter)
-        relevant_entries = relevant_entries.order_by("distance")
-        return relevant_entries[:max_results]
+        use_vector_index = False
+        subqueries = []
+        for query_index, (raw_query, query_embeddings) in enumerate(zip(raw_queries, embeddings)):
+            embeddings_field = "embeddings"
+            if can_use_vector_index and not EntryAdapters.has_query_filters(raw_query):
+                use_vector_index = True
+                # Match the indexed expression for the query planner to use the index
+                embeddings_field = Cast("embeddings", VectorField(dimensions=search_model.embeddings_dimensions))
+                relevant_entries = Entry.objects.filter(user=user, search_model=search_model)
+            elif use_quantized_embeddings:
+                candidate_entries = EntryAdapters.apply_filters(user, raw_query, file_type_filter, agent)
+                candidate_entries = candidate_entries.filter(owner_filter)
+                if file_type_filter:
+                    candidate_entries = candidate_entries.filter(file_type=file_type_filter)
+                # Only compare binary embeddings of the search model. Bit strings of other lengths cannot be compared
+                hamming_distance = HammingDistance("binary_embeddings", binary_quantize(query_embeddings))
+                shortlist_ids = (
+                    candidate_entries.filter(search_model=search_model, binary_embeddings__isnull=False)
+                    .order_by(hamming_distance)
+                    .values("id")[: max(max_results, search_model.quantized_search_candidates)]
+                )
+                # Rescore the shortlist with all entries without binary embeddings, until they are backfilled
+                relevant_entries = candidate_entries.filter(Q(id__in=shortlist_ids) | Q(binary_embeddings__isnull=True))
+            else:
+                relevant_entries = EntryAdapters.apply_filters(user, raw_query, file_type_filter, agent)
+                relevant_entries = relevant_entries.filter(owner_filter)
+
+            relevant_entries = relevant_entries.annotate(
+                distance=CosineDistance(embeddings_field, query_embeddings),
+                query_index=Value(query_index, output_field=IntegerField()),
+            )
+            relevant_entries = relevant_entries.filter(distance__lte=max_distance)
+
+            if file_type_filter:
+                relevant_entries = relevant_entries.filter(file_type=file_type_filter)
+            subqueries.append(relevant_entries.order_by("distance")[:max_results])
+
+        combined_entries = subqueries[0].union(*subqueries[1:], all=True) if len(subqueries) > 1 else subqueries[0]
+
+        if use_vector_index:
+            # Set recall, latency trade-off of the index scan for this query only
+            with transaction.atomic():
+                with connection.cursor() as cursor:
+                    if search_model.vector_index_type == SearchModelConfig.VectorIndexType.IVFFLAT:
+                        cursor.execute("SET LOCAL ivfflat.probes = %s", [search_model.vector_index_probes])
+                    else:
+                        cursor.execute("SET LOCAL hnsw.ef_search = %s", [search_model.vector_index_ef_search])
+                combined_entries = list(combined_entries)
+        else:
+            combined_entries = list(combined_entries)
+
+        # Split retrieved entries by query. Sort as order of combined results is not guaranteed
+        entries_by_query: List[List[Entry]] = [[] for _ in raw_queries]
+        for entry in sorted(combined_entries, key=lambda e: e.distance):
+            entries_by_query[entry.query_index].append(entry)
+        return entries_by_query
 
     @staticmethod
     @require_valid_user
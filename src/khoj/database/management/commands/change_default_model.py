@@ -6,7 +6,7 @@ from django.db import transaction
 from django.db.models import Q
 from tqdm import tqdm
 
-from khoj.database.adapters import get_default_search_model
+from khoj.database.adapters import EntryAdapters, get_default_search_model
 from khoj.database.models import Entry, SearchModelConfig
 from khoj.processor.embeddings import EmbeddingsModel
 
@@ -51,6 +51,9 @@ class Command(BaseCommand):
                     logger.error(f"Error embedding documents: {e}")
                     return
 
+                if embeddings:
+                    EntryAdapters.set_embeddings_dimensions(search_model, len(embeddings[0]))
+
                 for i, entry in enumerate(entries):
                     entry.embeddings = embeddings[i]
                     entry.search_model_id = search_model.id
@@ -78,6 +81,8 @@ class Command(BaseCommand):
                         query_encode_kwargs=model.bi_encoder_query_encode_config,
                         docs_encode_kwargs=model.bi_encoder_docs_encode_config,
                         model_kwargs=model.bi_encoder_model_config,
+                        inference_backend=model.inference_backend,
+                        inference_threads=model.inference_threads,
                     )
                 }
             )
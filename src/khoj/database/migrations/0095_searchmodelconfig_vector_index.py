@@ -0,0 +1,59 @@
+# Generated by Django 5.1.10 on 2026-10-17 06:58
+
+from django.db import migrations, models
+
+
+def set_embeddings_dimensions(apps, schema_editor):
+    SearchModelConfig = apps.get_model("database", "SearchModelConfig")
+    db_alias = schema_editor.connection.alias
+
+    # Infer embedding dimensions of each search model from an entry it has already indexed
+    with schema_editor.connection.cursor() as cursor:
+        for search_model in SearchModelConfig.objects.using(db_alias).all():
+            cursor.execute(
+                "SELECT vector_dims(embeddings) FROM database_entry WHERE search_model_id = %s LIMIT 1",
+                [search_model.id],
+            )
+            row = cursor.fetchone()
+            if row:
+                search_model.embeddings_dimensions = row[0]
+                search_model.save(update_fields=["embeddings_dimensions"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0094_serverchatsettings_think_free_deep_and_more"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="embeddings_dimensions",
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="vector_index_type",
+            field=models.CharField(
+                choices=[("none", "None"), ("hnsw", "Hnsw"), ("ivfflat", "Ivfflat")],
+                default="hnsw",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="vector_index_ef_search",
+            field=models.IntegerField(default=100),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="vector_index_probes",
+            field=models.IntegerField(default=10),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="vector_index_min_entries",
+            field=models.IntegerField(default=10000),
+        ),
+        migrations.RunPython(set_embeddings_dimensions, reverse_code=migrations.RunPython.noop),
+    ]
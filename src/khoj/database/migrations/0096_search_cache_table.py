@@ -0,0 +1,22 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:02
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_search_cache_table(apps, schema_editor):
+    call_command("createcachetable", "khoj_search_cache", database=schema_editor.connection.alias)
+
+
+def delete_search_cache_table(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS khoj_search_cache")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0095_searchmodelconfig_vector_index"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_cache_table, reverse_code=delete_search_cache_table),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:06
+
+import django.db.models.deletion
+import pgvector.django
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0096_search_cache_table"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ContentEmbeddings",
+            fields=[
+                ("id", models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name="ID")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+                ("model_fingerprint", models.CharField(default="", max_length=32)),
+                ("hashed_value", models.CharField(max_length=100)),
+                ("embeddings", pgvector.django.VectorField()),
+                (
+                    "search_model",
+                    models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, to="database.searchmodelconfig"),
+                ),
+            ],
+            options={
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("search_model", "model_fingerprint", "hashed_value"), name="unique_model_content_hash"
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,34 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:10
+
+import django.contrib.postgres.indexes
+import django.db.models.functions.text
+from django.db import migrations
+
+from khoj.database.operations import AddTrigramIndexConcurrently, OptionalTrigramExtension
+
+
+class Migration(migrations.Migration):
+    # Build index concurrently to not block writes to large entry tables
+    atomic = False
+
+    dependencies = [
+        ("database", "0097_contentembeddings"),
+    ]
+
+    operations = [
+        OptionalTrigramExtension(),
+        # Optional trigram index may be missing from the database. So it is not declared on the model
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                AddTrigramIndexConcurrently(
+                    model_name="entry",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        django.contrib.postgres.indexes.OpClass(
+                            django.db.models.functions.text.Upper("raw"), name="gin_trgm_ops"
+                        ),
+                        name="entry_raw_upper_trgm_idx",
+                    ),
+                ),
+            ],
+        ),
+    ]
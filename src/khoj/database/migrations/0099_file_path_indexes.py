@@ -0,0 +1,48 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:11
+
+import django.contrib.postgres.indexes
+from django.contrib.postgres.operations import AddIndexConcurrently
+from django.db import migrations, models
+
+from khoj.database.operations import AddTrigramIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Build indexes concurrently to not block writes to large entry tables
+    atomic = False
+
+    dependencies = [
+        ("database", "0098_entry_raw_upper_trgm_idx"),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name="fileobject",
+            index=models.Index(
+                fields=["file_name"], name="fileobject_name_prefix_idx", opclasses=["varchar_pattern_ops"]
+            ),
+        ),
+        AddIndexConcurrently(
+            model_name="entry",
+            index=models.Index(
+                fields=["file_path"], name="entry_file_path_prefix_idx", opclasses=["varchar_pattern_ops"]
+            ),
+        ),
+        # Optional trigram indexes may be missing from the database. So they are not declared on the models
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                AddTrigramIndexConcurrently(
+                    model_name="fileobject",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=["file_name"], name="fileobject_name_trgm_idx", opclasses=["gin_trgm_ops"]
+                    ),
+                ),
+                AddTrigramIndexConcurrently(
+                    model_name="entry",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=["file_path"], name="entry_file_path_trgm_idx", opclasses=["gin_trgm_ops"]
+                    ),
+                ),
+            ],
+        ),
+    ]
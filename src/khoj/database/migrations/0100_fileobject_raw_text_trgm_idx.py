@@ -0,0 +1,46 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:13
+
+import django.contrib.postgres.indexes
+from django.db import migrations, models
+
+from khoj.database.operations import AddTrigramIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # Build index concurrently to not block writes to large file object tables
+    atomic = False
+
+    dependencies = [
+        ("database", "0099_file_path_indexes"),
+    ]
+
+    operations = [
+        # Optional trigram index may be missing from the database. So it is not declared on the model
+        migrations.SeparateDatabaseAndState(
+            database_operations=[
+                AddTrigramIndexConcurrently(
+                    model_name="fileobject",
+                    index=django.contrib.postgres.indexes.GinIndex(
+                        fields=["raw_text"], name="fileobject_raw_text_trgm_idx", opclasses=["gin_trgm_ops"]
+                    ),
+                ),
+            ],
+        ),
+        migrations.AddField(
+            model_name="fileobject",
+            name="raw_text_bytes",
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+        # Store file text bytes uncompressed out of line. So reading a byte range only fetches the chunks it spans.
+        # Substrings of compressed or multi-byte encoded text are read from the start of the text instead
+        migrations.RunSQL(
+            "ALTER TABLE database_fileobject ALTER COLUMN raw_text_bytes SET STORAGE EXTERNAL",
+            reverse_sql="ALTER TABLE database_fileobject ALTER COLUMN raw_text_bytes SET STORAGE EXTENDED",
+        ),
+        # Only large files store their text bytes. Smaller files are read whole
+        migrations.RunSQL(
+            "UPDATE database_fileobject SET raw_text_bytes = convert_to(raw_text, 'UTF8') "
+            "WHERE octet_length(raw_text) >= 1048576",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+    ]
@@ -0,0 +1,43 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:14
+
+import re
+import struct
+
+from django.db import migrations, models
+
+
+def set_line_offsets(apps, schema_editor):
+    FileObject = apps.get_model("database", "FileObject")
+    db_alias = schema_editor.connection.alias
+
+    # Compute packed byte offsets of lines of existing file objects in batches to limit memory usage
+    batch = []
+    for file_object in FileObject.objects.using(db_alias).only("id", "raw_text").iterator(chunk_size=100):
+        offsets = [0] + [match.end() for match in re.finditer(b"\n", file_object.raw_text.encode("utf-8"))]
+        file_object.line_offsets = struct.pack(f">{len(offsets)}I", *offsets)
+        batch.append(file_object)
+        if len(batch) >= 100:
+            FileObject.objects.using(db_alias).bulk_update(batch, ["line_offsets"])
+            batch = []
+    if batch:
+        FileObject.objects.using(db_alias).bulk_update(batch, ["line_offsets"])
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0100_fileobject_raw_text_trgm_idx"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="fileobject",
+            name="line_offsets",
+            field=models.BinaryField(blank=True, default=None, null=True),
+        ),
+        # Store line offsets uncompressed out of line. So reading offsets of a line range only fetches the chunks it spans
+        migrations.RunSQL(
+            "ALTER TABLE database_fileobject ALTER COLUMN line_offsets SET STORAGE EXTERNAL",
+            reverse_sql=migrations.RunSQL.noop,
+        ),
+        migrations.RunPython(set_line_offsets, reverse_code=migrations.RunPython.noop),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:56
+
+from django.core.management import call_command
+from django.db import migrations
+
+
+def create_llm_cache_table(apps, schema_editor):
+    call_command("createcachetable", "khoj_llm_cache", database=schema_editor.connection.alias)
+
+
+def delete_llm_cache_table(apps, schema_editor):
+    schema_editor.execute("DROP TABLE IF EXISTS khoj_llm_cache")
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0101_fileobject_line_offsets"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_llm_cache_table, reverse_code=delete_llm_cache_table),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 5.1.10 on 2026-10-17 07:59
+
+from django.db import migrations, models
+
+import khoj.database.models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0102_llm_cache_table"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="entry",
+            name="binary_embeddings",
+            field=khoj.database.models.BitStringField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="embeddings_quantization",
+            field=models.CharField(
+                choices=[("none", "None"), ("binary", "Binary")],
+                default="none",
+                max_length=20,
+            ),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="quantized_search_candidates",
+            field=models.IntegerField(default=200),
+        ),
+    ]
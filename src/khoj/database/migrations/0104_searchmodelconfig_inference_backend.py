@@ -0,0 +1,27 @@
+# Generated by Django 5.1.10 on 2026-10-17 08:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("database", "0103_entry_binary_embeddings"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="inference_backend",
+            field=models.CharField(choices=[("torch", "Torch"), ("int8", "Int8")], default="torch", max_length=20),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="inference_threads",
+            field=models.IntegerField(blank=True, default=None, null=True),
+        ),
+        migrations.AddField(
+            model_name="searchmodelconfig",
+            name="embeddings_fingerprint",
+            field=models.CharField(blank=True, default=None, max_length=32, null=True),
+        ),
+    ]
@@ -1,6 +1,9 @@
+import hashlib
+import json
 import logging
 import os
 import re
+import threading
 import uuid
 from random import choice
 from typing import Dict, List, Optional, Union
@@ -9,15 +12,36 @@ from django.contrib.auth.models import AbstractUser
 from django.contrib.postgres.fields import ArrayField
 from django.core.exceptions import ValidationError
 from django.db import models
+from django.db.models.expressions import RawSQL
 from django.db.models.signals import pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 from pgvector.django import VectorField
 from phonenumber_field.modelfields import PhoneNumberField
 from pydantic import BaseModel as PydanticBaseModel
 from pydantic import Field, model_validator
 
+from khoj.utils.helpers import SizedLRU
+
 logger = logging.getLogger(__name__)
 
+# Decoded messages of recently accessed conversations, keyed by conversation id and last update time.
+# Bounded by the count and the total serialized size of cached conversations
+conversation_messages_cache = SizedLRU(
+    capacity=int(os.getenv("KHOJ_CONVERSATION_MESSAGES_CACHE_SIZE", 100)),
+    max_size=int(os.getenv("KHOJ_CONVERSATION_MESSAGES_CACHE_MAX_MB", 64)) * 1024 * 1024,
+)
+conversation_messages_cache_lock = threading.Lock()
+
+
+class BitStringField(models.Field):
+    "Variable length bit string. Stored as a Postgres bit varying column, read and written as a string of 0s and 1s"
+
+    description = "Bit string"
+
+    def db_type(self, connection):
+        return "varbit"
+
 
 # Pydantic models for type Chat Message validation
 class Context(PydanticBaseModel):
@@ -513,6 +537,19 @@ class SearchModelConfig(DbBaseModel):
         OPENAI = "openai"
         LOCAL = "local"
 
+    class VectorIndexType(models.TextChoices):
+        NONE = "none"
+        HNSW = "hnsw"
+        IVFFLAT = "ivfflat"
+
+    class EmbeddingsQuantization(models.TextChoices):
+        NONE = "none"
+        BINARY = "binary"
+
+    class InferenceBackend(models.TextChoices):
+        TORCH = "torch"
+        INT8 = "int8"
+
     # This is the model name exposed to users on their settings page
     name = models.CharField(max_length=200, default="default")
     # Type of content the model can generate embeddings for
@@ -537,16 +574,56 @@ class SearchModelConfig(DbBaseModel):
     embeddings_inference_endpoint_type = models.CharField(
         max_length=200, choices=ApiType.choices, default=ApiType.LOCAL
     )
+    # Backend to run local bi-encoder and cross-encoder models with. Int8 quantizes them for faster inference on CPU
+    inference_backend = models.CharField(
+        max_length=20, choices=InferenceBackend.choices, default=InferenceBackend.TORCH
+    )
+    # Number of CPU threads to run local models with. Applies to the whole server process. Unset uses torch default
+    inference_threads = models.IntegerField(default=None, null=True, blank=True)
     # Inference server API endpoint to use for embeddings inference. Cross-encoder model should be hosted on this server
     cross_encoder_inference_endpoint = models.CharField(max_length=200, default=None, null=True, blank=True)
     # Inference server API Key to use for embeddings inference. Cross-encoder model should be hosted on this server
     cross_encoder_inference_endpoint_api_key = models.CharField(max_length=200, default=None, null=True, blank=True)
     # The confidence threshold of the bi_encoder model to consider the embeddings as relevant
     bi_encoder_confidence_threshold = models.FloatField(default=0.18)
+    # Dimensions of the embeddings generated by the bi-encoder. Required to build an approximate nearest neighbour index
+    embeddings_dimensions = models.IntegerField(default=None, null=True, blank=True)
+    # Embeddings fingerprint of the settings the entries were embedded with. Entries are re-embedded once it changes
+    embeddings_fingerprint = models.CharField(max_length=32, default=None, null=True, blank=True)
+    # Approximate nearest neighbour index to build on the embeddings of large knowledge bases
+    vector_index_type = models.CharField(max_length=20, choices=VectorIndexType.choices, default=VectorIndexType.HNSW)
+    # Size of the candidate list explored per query by the HNSW index. Higher improves recall at the cost of latency
+    vector_index_ef_search = models.IntegerField(default=100)
+    # Number of lists probed per query by the IVFFlat index. Higher improves recall at the cost of latency
+    vector_index_probes = models.IntegerField(default=10)
+    # Minimum number of entries in a knowledge base to index and search it approximately. Smaller ones use exact search
+    vector_index_min_entries = models.IntegerField(default=10000)
+    # Quantized embeddings to shortlist entries by before exact search. Shortlist by hamming distance of binary embeddings
+    embeddings_quantization = models.CharField(
+        max_length=20, choices=EmbeddingsQuantization.choices, default=EmbeddingsQuantization.NONE
+    )
+    # Number of shortlisted entries to rescore with full precision embeddings. Higher improves recall at cost of latency
+    quantized_search_candidates = models.IntegerField(default=200)
 
     def __str__(self):
         return self.name
 
+    def get_embeddings_fingerprint(self) -> str:
+        """
+        Hash of the settings that determine the embeddings the bi-encoder generates for content.
+        Embeddings generated with different fingerprints are not comparable.
+        """
+        model_config = {key: value for key, value in self.bi_encoder_model_config.items() if key != "device"}
+        settings = [
+            self.bi_encoder,
+            self.embeddings_inference_endpoint,
+            self.embeddings_inference_endpoint_type,
+            self.bi_encoder_docs_encode_config,
+            model_config,
+            self.inference_backend,
+        ]
+        return hashlib.md5(json.dumps(settings, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
 
 class TextToImageModelConfig(DbBaseModel):
     class ModelType(models.TextChoices):
@@ -642,14 +719,57 @@ class Conversation(DbBaseModel):
             raise ValidationError(f"Invalid conversation_log format: {str(e)}")
 
     def save(self, *args, **kwargs):
-        self.clean()
+        # Only validate conversation log when it is being saved
+        update_fields = kwargs.get("update_fields")
+        if update_fields is None or "conversation_log" in update_fields:
+            self.clean()
         super().save(*args, **kwargs)
 
+    @property
+    def raw_messages(self) -> List[dict]:
+        """Conversation messages as stored. Avoids decoding messages for read-only access. Do not modify"""
+        return self.conversation_log.get("chat", [])
+
     @property
     def messages(self) -> List[ChatMessageModel]:
-        """Type-hinted accessor for conversation messages"""
+        """
+        Type-hinted accessor for conversation messages.
+        Decoded messages are cached until the conversation is next updated. So treat them as read-only.
+        """
+        raw_messages = self.raw_messages
+        cached_messages = self._get_cached_messages(raw_messages)
+        if cached_messages is not None:
+            return list(cached_messages)
+
+        validated_messages = self._decode_messages(raw_messages)
+        messages_size = len(json.dumps(raw_messages, default=str))
+        with conversation_messages_cache_lock:
+            conversation_messages_cache.set(
+                (self.id, self.updated_at), (len(raw_messages), tuple(validated_messages)), messages_size
+            )
+        return validated_messages
+
+    def get_latest_messages(self, n: int) -> List[ChatMessageModel]:
+        """Get the latest n conversation messages. Only decodes the latest messages if not already cached"""
+        raw_messages = self.raw_messages
+        cached_messages = self._get_cached_messages(raw_messages)
+        if cached_messages is not None:
+            return list(cached_messages[-n:])
+        return self._decode_messages(raw_messages[-n:])
+
+    def _get_cached_messages(self, raw_messages: List[dict]) -> Optional[tuple]:
+        cache_key = (self.id, self.updated_at)
+        with conversation_messages_cache_lock:
+            cached = conversation_messages_cache[cache_key] if cache_key in conversation_messages_cache else None
+        # Ignore cached messages if conversation log has been modified in memory since
+        if cached is None or cached[0] != len(raw_messages):
+            return None
+        return cached[1]
+
+    @staticmethod
+    def _decode_messages(raw_messages: List[dict]) -> List[ChatMessageModel]:
         validated_messages = []
-        for msg in self.conversation_log.get("chat", []):
+        for msg in raw_messages:
             try:
                 # Clean up inferred queries if they contain None
                 if msg.get("intent") and msg["intent"].get("inferred_queries"):
@@ -680,8 +800,12 @@ class Conversation(DbBaseModel):
             return None
 
         # Pop the last message, save the conversation, and then return the message.
+        # Remove the last message in the database instead of rewriting the whole conversation log
         popped_message_dict = chat_log.pop()
-        await self.asave()
+        self.updated_at = timezone.now()
+        await Conversation.objects.filter(id=self.id).aupdate(
+            conversation_log=RawSQL("conversation_log #- '{chat,-1}'", []), updated_at=self.updated_at
+        )
 
         # Try to validate and return the popped message as a Pydantic model
         try:
@@ -724,9 +848,24 @@ class FileObject(DbBaseModel):
     # Contains the full text of a file that has associated Entry objects
     file_name = models.CharField(max_length=400, default=None, null=True, blank=True)
     raw_text = models.TextField()
+    # UTF-8 encoding of raw_text of large files. Stored uncompressed, so byte ranges of their text are read without
+    # reading the text before. Unset for smaller files, as storing their text twice costs more than reading it whole
+    raw_text_bytes = models.BinaryField(default=None, null=True, blank=True)
+    # Byte offset of the start of each line in raw_text_bytes, packed as 4 byte big-endian unsigned integers.
+    # Stored uncompressed. So the offsets of a line range are read without loading all offsets or the full text
+    line_offsets = models.BinaryField(default=None, null=True, blank=True)
     user = models.ForeignKey(KhojUser, on_delete=models.CASCADE, default=None, null=True, blank=True)
     agent = models.ForeignKey(Agent, on_delete=models.CASCADE, default=None, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Pattern ops index to serve file path prefix lookups, i.e file_name__startswith
+            models.Index(fields=["file_name"], opclasses=["varchar_pattern_ops"], name="fileobject_name_prefix_idx"),
+        ]
+        # Optional trigram indexes are built by migrations on databases with the pg_trgm extension, not declared here.
+        # fileobject_name_trgm_idx serves file path glob lookups, i.e file_name__regex.
+        # fileobject_raw_text_trgm_idx shortlists files with text matching grep patterns, i.e raw_text__iregex.
+
 
 class Entry(DbBaseModel):
     class EntryType(models.TextChoices):
@@ -748,6 +887,8 @@ class Entry(DbBaseModel):
     user = models.ForeignKey(KhojUser, on_delete=models.CASCADE, default=None, null=True, blank=True)
     agent = models.ForeignKey(Agent, on_delete=models.CASCADE, default=None, null=True, blank=True)
     embeddings = VectorField(dimensions=None)
+    # Sign bits of the embeddings. Set when the search model quantizes embeddings
+    binary_embeddings = BitStringField(default=None, null=True, blank=True)
     raw = models.TextField()
     compiled = models.TextField()
     heading = models.CharField(max_length=1000, default=None, null=True, blank=True)
@@ -761,11 +902,41 @@ class Entry(DbBaseModel):
     search_model = models.ForeignKey(SearchModelConfig, on_delete=models.SET_NULL, default=None, null=True, blank=True)
     file_object = models.ForeignKey(FileObject, on_delete=models.CASCADE, default=None, null=True, blank=True)
 
+    class Meta:
+        indexes = [
+            # Pattern ops index to serve file path prefix lookups, i.e file_path__startswith
+            models.Index(fields=["file_path"], opclasses=["varchar_pattern_ops"], name="entry_file_path_prefix_idx"),
+        ]
+        # Optional trigram indexes are built by migrations on databases with the pg_trgm extension, not declared here.
+        # entry_raw_upper_trgm_idx serves case-insensitive word filters on entries, i.e raw__icontains lookups.
+        # entry_file_path_trgm_idx serves file filter lookups, i.e file_path__contains, file_path__regex.
+
     def save(self, *args, **kwargs):
         if self.user and self.agent:
             raise ValidationError("An Entry cannot be associated with both a user and an agent.")
 
 
+class ContentEmbeddings(DbBaseModel):
+    """
+    Embeddings of content by search model, keyed by hash of the content.
+    Used to reuse embeddings of identical content indexed by any user or agent, instead of re-encoding it.
+    Embeddings are also keyed by the embeddings fingerprint of the search model. So they are not reused once its
+    settings change. Embeddings of stale fingerprints or of content no longer indexed are pruned regularly.
+    """
+
+    search_model = models.ForeignKey(SearchModelConfig, on_delete=models.CASCADE)
+    model_fingerprint = models.CharField(max_length=32, default="")
+    hashed_value = models.CharField(max_length=100)
+    embeddings = VectorField(dimensions=None)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["search_model", "model_fingerprint", "hashed_value"], name="unique_model_content_hash"
+            ),
+        ]
+
+
 class EntryDates(DbBaseModel):
     date = models.DateField()
     entry = models.ForeignKey(Entry, on_delete=models.CASCADE, related_name="embeddings_dates")
@@ -0,0 +1,45 @@
+"""
+Migration operations for optional Postgres extensions.
+
+The embedded Postgres server does not ship the pg_trgm extension. So trigram indexes are only built on databases where
+the extension is available. Queries work the same without these indexes, just slower on large tables.
+As they may be missing from the database, these indexes are not declared on the models.
+"""
+
+from django.contrib.postgres.operations import AddIndexConcurrently, TrigramExtension
+
+
+def is_extension_available(schema_editor, name: str) -> bool:
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_available_extensions WHERE name = %s", [name])
+        return cursor.fetchone() is not None
+
+
+def is_extension_installed(schema_editor, name: str) -> bool:
+    with schema_editor.connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = %s", [name])
+        return cursor.fetchone() is not None
+
+
+class OptionalTrigramExtension(TrigramExtension):
+    "Install the pg_trgm extension, if available on the database server"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if is_extension_available(schema_editor, self.name):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if is_extension_installed(schema_editor, self.name):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
+
+
+class AddTrigramIndexConcurrently(AddIndexConcurrently):
+    "Build trigram index concurrently, if the pg_trgm extension is installed"
+
+    def database_forwards(self, app_label, schema_editor, from_state, to_state):
+        if is_extension_installed(schema_editor, "pg_trgm"):
+            super().database_forwards(app_label, schema_editor, from_state, to_state)
+
+    def database_backwards(self, app_label, schema_editor, from_state, to_state):
+        if is_extension_installed(schema_editor, "pg_trgm"):
+            super().database_backwards(app_label, schema_editor, from_state, to_state)
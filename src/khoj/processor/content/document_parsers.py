@@ -0,0 +1,281 @@
+"""
+Parse text from documents in worker processes.
+
+Parsing PDFs, DOCX files and images is CPU bound. So files are parsed in worker processes to use all cores.
+Workers persist across files and requests. So the document loaders and OCR model are only loaded once per worker.
+A file that takes too long to parse or crashes its worker is skipped without failing the rest of the batch,
+or the files other requests are parsing. Only its worker is replaced.
+
+This module is imported by the worker processes. So it should not import Django models or other heavy modules.
+"""
+
+import logging
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+import traceback
+from functools import cache
+from multiprocessing.connection import Connection, wait
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+NULL_TRANSLATOR = str.maketrans("", "", "\x00")
+DOCUMENT_LOADER_MODULES = [
+    "langchain_community.document_loaders.pdf",
+    "langchain_community.document_loaders.word_document",
+]
+
+parser_pool: Optional["ParserPool"] = None
+parser_pool_lock = threading.Lock()
+
+
+def clean_pdf_text(text: str) -> str:
+    """Clean PDF text by removing null bytes and invalid Unicode characters."""
+    # Use faster translation table instead of replace
+    return text.translate(NULL_TRANSLATOR)
+
+
+def parse_pdf(file_name: str, pdf_file: bytes) -> List[str]:
+    """Extract text of each page from PDF file"""
+    from langchain_community.document_loaders import PyMuPDFLoader
+
+    # Create temp file with .pdf extension that gets auto-deleted
+    with tempfile.NamedTemporaryFile(suffix=".pdf", delete=True) as tmpf:
+        tmpf.write(pdf_file)
+        tmpf.flush()  # Ensure all data is written
+
+        # Load the content using PyMuPDFLoader
+        pdf_entries_per_file = PyMuPDFLoader(tmpf.name).load()
+
+    # Convert the loaded entries into the desired format
+    return [clean_pdf_text(page.page_content) for page in pdf_entries_per_file]
+
+
+def parse_docx(file_name: str, docx_file: bytes) -> List[str]:
+    """Extract text of each page from DOCX file"""
+    from langchain_community.document_loaders import Docx2txtLoader
+
+    # Create temp file with .docx extension that gets auto-deleted
+    with tempfile.NamedTemporaryFile(suffix=".docx", delete=True) as tmp:
+        tmp.write(docx_file)
+        tmp.flush()  # Ensure all data is written
+
+        # Load the content using Docx2txtLoader
+        docx_entries_per_file = Docx2txtLoader(tmp.name).load()
+
+    # Convert the loaded entries into the desired format
+    return [page.page_content for page in docx_entries_per_file]
+
+
+@cache
+def get_ocr_model():
+    "Load OCR model once per process"
+    from rapidocr_onnxruntime import RapidOCR
+
+    return RapidOCR()
+
+
+def parse_image(file_name: str, image_file: bytes) -> str:
+    """Extract text from image file using OCR"""
+    # use either png or jpg
+    if file_name.endswith(".png"):
+        suffix = ".png"
+    elif file_name.endswith(".jpg") or file_name.endswith(".jpeg"):
+        suffix = ".jpg"
+    elif file_name.endswith(".webp"):
+        suffix = ".webp"
+    else:
+        raise ValueError(f"Unsupported image file type: {file_name}")
+
+    # write the image to a temporary file
+    with tempfile.NamedTemporaryFile(suffix=suffix, delete=True) as tmp:
+        tmp.write(image_file)
+        tmp.flush()
+        result, _ = get_ocr_model()(tmp.name)
+
+    return " ".join([text[1] for text in result]) if result else ""
+
+
+def run_parser_worker(connection: Connection):
+    "Parse files sent by the server process until it closes the connection. Send back parsed content or parse error"
+    while True:
+        try:
+            parse_file, file_name, file = connection.recv()
+        except EOFError:
+            break
+        try:
+            connection.send((parse_file(file_name, file), None))
+        except Exception as e:
+            connection.send((None, "".join(traceback.format_exception(e))))
+    connection.close()
+
+
+class ParserWorker:
+    "Persistent worker process parsing files sent to it over a pipe"
+
+    def __init__(self, context: multiprocessing.context.BaseContext):
+        self.connection, worker_connection = context.Pipe()
+        self.process = context.Process(target=run_parser_worker, args=(worker_connection,), daemon=True)
+        try:
+            self.process.start()
+        finally:
+            # Close server copy of worker connection. So the server sees the end of input if the worker crashes
+            worker_connection.close()
+
+    def stop(self):
+        if self.process.is_alive():
+            self.process.terminate()
+        self.process.join()
+        self.connection.close()
+
+
+class ParserPool:
+    """
+    Pool of up to max_workers parser workers shared by all requests. Workers are started on demand and reused.
+    Workers that crash or overrun their parse deadline are stopped, and replaced by new ones on demand.
+    """
+
+    def __init__(self, max_workers: int):
+        self.max_workers = max_workers
+        # Fork workers from a clean server process. Forking the multi-threaded server process is unsafe
+        # and spawning workers would re-run the server's main module
+        self.context = multiprocessing.get_context("forkserver")
+        # Preload document loaders in the fork server. So new workers do not import them again
+        self.context.set_forkserver_preload([__name__, *DOCUMENT_LOADER_MODULES])
+        self.worker_slots = threading.Semaphore(max_workers)
+        self.idle_workers: List[ParserWorker] = []
+        self.lock = threading.Lock()
+        self.closed = False
+
+    def acquire(self, blocking: bool = True) -> Optional[ParserWorker]:
+        "Get an idle worker or start a new one. Return None if all worker slots are busy and not blocking"
+        if not self.worker_slots.acquire(blocking=blocking):
+            return None
+        with self.lock:
+            while self.idle_workers:
+                worker = self.idle_workers.pop()
+                if worker.process.is_alive():
+                    return worker
+                worker.stop()
+        try:
+            return ParserWorker(self.context)
+        except Exception:
+            self.worker_slots.release()
+            raise
+
+    def release(self, worker: ParserWorker, reuse: bool = True):
+        "Return worker to the pool for reuse. Stop it if it is not reusable, or the pool was closed"
+        with self.lock:
+            reuse = reuse and not self.closed
+            if reuse:
+                self.idle_workers.append(worker)
+        if not reuse:
+            worker.stop()
+        self.worker_slots.release()
+
+    def close(self):
+        "Stop idle workers. Busy workers are stopped once they are released"
+        with self.lock:
+            self.closed = True
+            idle_workers, self.idle_workers = self.idle_workers, []
+        for worker in idle_workers:
+            worker.stop()
+
+
+def get_parser_pool(max_workers: int) -> ParserPool:
+    "Get parser pool shared across requests. Replace it if the configured number of workers changed"
+    global parser_pool
+    with parser_pool_lock:
+        if parser_pool is None or parser_pool.max_workers != max_workers:
+            if parser_pool is not None:
+                parser_pool.close()
+            parser_pool = ParserPool(max_workers)
+        return parser_pool
+
+
+def parse_files_in_workers(
+    parse_file: Callable[[str, bytes], Any], files: Dict[str, bytes], max_workers: int, timeout: float
+) -> Dict[str, Any]:
+    """
+    Parse files in the shared parser pool. Up to max_workers workers run at a time across all requests.
+    Each file gets timeout seconds from when it is sent to a worker. A file that overruns only stops its own worker.
+    """
+    pool = get_parser_pool(max_workers)
+    parsed_files: Dict[str, Any] = {}
+    files_to_parse = list(files)
+    # Map of connection to each busy worker, with the file it is parsing and its deadline
+    busy_workers: Dict[Connection, Tuple[str, ParserWorker, float]] = {}
+
+    def release_worker(connection: Connection, reuse: bool = True):
+        _, worker, _ = busy_workers.pop(connection)
+        pool.release(worker, reuse)
+
+    try:
+        while files_to_parse or busy_workers:
+            # Send files waiting to be parsed to workers. Only wait for a free worker if no worker of ours is busy
+            while files_to_parse and (worker := pool.acquire(blocking=not busy_workers)):
+                file = files_to_parse.pop(0)
+                busy_workers[worker.connection] = (file, worker, time.monotonic() + timeout)
+                try:
+                    worker.connection.send((parse_file, file, files[file]))
+                except Exception as e:
+                    logger.warning(f"Unable to send file to parser worker: {file}. This file will not be indexed. {e}")
+                    release_worker(worker.connection, reuse=False)
+            if not busy_workers:
+                continue
+
+            # Wait for a worker to finish or for the earliest deadline to pass
+            next_deadline = min(deadline for _, _, deadline in busy_workers.values())
+            for connection in wait(list(busy_workers), timeout=max(0, next_deadline - time.monotonic())):
+                file = busy_workers[connection][0]
+                try:
+                    parsed_file, error = connection.recv()
+                except (EOFError, ConnectionResetError):
+                    logger.warning(f"Parsing crashed worker process on file: {file}. This file will not be indexed.")
+                    release_worker(connection, reuse=False)
+                    continue
+                if error is None:
+                    parsed_files[file] = parsed_file
+                else:
+                    logger.warning(f"Unable to parse file: {file}. This file will not be indexed.\n{error}")
+                release_worker(connection)
+
+            # Stop workers that overran their deadline
+            now = time.monotonic()
+            for connection, (file, _, deadline) in list(busy_workers.items()):
+                if deadline <= now:
+                    logger.warning(
+                        f"Timed out parsing file after {timeout} seconds: {file}. This file will not be indexed."
+                    )
+                    release_worker(connection, reuse=False)
+    finally:
+        # Stop workers left parsing if parsing was interrupted
+        for connection in list(busy_workers):
+            release_worker(connection, reuse=False)
+
+    return parsed_files
+
+
+def parse_files(parse_file: Callable[[str, bytes], Any], files: Dict[str, bytes]) -> Dict[str, Any]:
+    """
+    Parse files in parallel using worker processes. Return parsed content of each file that could be parsed.
+    Files that time out, crash their worker or fail to parse are logged and skipped.
+    """
+    max_workers = int(os.getenv("KHOJ_PARSER_WORKERS", os.cpu_count() or 1))
+    timeout = float(os.getenv("KHOJ_PARSER_TIMEOUT", 300))
+    parsed_files: Dict[str, Any] = {}
+
+    # Parse files in current process if worker processes disabled
+    if max_workers <= 0:
+        for file in files:
+            try:
+                parsed_files[file] = parse_file(file, files[file])
+            except Exception as e:
+                logger.warning(f"Unable to parse file: {file}. This file will not be indexed.")
+                logger.warning(e, exc_info=True)
+        return parsed_files
+
+    return parse_files_in_workers(parse_file, files, max_workers, timeout)
@@ -1,10 +1,9 @@
 import logging
-import os
-from datetime import datetime, timezone
 from typing import Dict, List, Tuple
 
 from khoj.database.models import Entry as DbEntry
 from khoj.database.models import KhojUser
+from khoj.processor.content.document_parsers import parse_files, parse_image
 from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.utils.helpers import timer
 from khoj.utils.rawconfig import Entry
@@ -53,44 +52,15 @@ class ImageToEntries(TextToEntries):
         file_to_text_map = dict()
         entries: List[str] = []
         entry_to_location_map: List[Tuple[str, str]] = []
+        # Extract text from images in parallel worker processes
+        parsed_image_files = parse_files(parse_image, image_files)
         for image_file in image_files:
-            try:
-                bytes = image_files[image_file]
-                # write the image to a temporary file
-                timestamp_now = datetime.now(timezone.utc).timestamp()
-                # use either png or jpg
-                if image_file.endswith(".png"):
-                    tmp_file = f"tmp_image_file_{timestamp_now}.png"
-                elif image_file.endswith(".jpg") or image_file.endswith(".jpeg"):
-                    tmp_file = f"tmp_image_file_{timestamp_now}.jpg"
-                elif image_file.endswith(".webp"):
-                    tmp_file = f"tmp_image_file_{timestamp_now}.webp"
-                with open(tmp_file, "wb") as f:
-                    bytes = image_files[image_file]
-                    f.write(bytes)
-                try:
-                    from rapidocr_onnxruntime import RapidOCR
-
-                    loader = RapidOCR()
-                    image_entries_per_file = ""
-                    result, _ = loader(tmp_file)
-                    if result:
-                        expanded_entries = [text[1] for text in result]
-                        image_entries_per_file = " ".join(expanded_entries)
-                except ImportError:
-                    logger.warning(
-                        f"Unable to process image or scanned file for text: {image_file}. This file will not be indexed."
-                    )
-                    continue
-                entry_to_location_map.append((image_entries_per_file, image_file))
-                entries.extend([image_entries_per_file])
-                file_to_text_map[image_file] = image_entries_per_file
-            except Exception as e:
-                logger.warning(f"Unable to process file: {image_file}. This file will not be indexed.")
-                logger.warning(e, exc_info=True)
-            finally:
-                if os.path.exists(tmp_file):
-                    os.remove(tmp_file)
+            if image_file not in parsed_image_files:
+                continue
+            image_entries_per_file = parsed_image_files[image_file]
+            entry_to_location_map.append((image_entries_per_file, image_file))
+            entries.extend([image_entries_per_file])
+            file_to_text_map[image_file] = image_entries_per_file
         return file_to_text_map, ImageToEntries.convert_image_entries_to_maps(entries, dict(entry_to_location_map))
 
     @staticmethod
@@ -1,11 +1,9 @@
 import logging
-import tempfile
-from typing import Dict, Final, List, Tuple
-
-from langchain_community.document_loaders import PyMuPDFLoader
+from typing import Dict, List, Tuple
 
 from khoj.database.models import Entry as DbEntry
 from khoj.database.models import KhojUser
+from khoj.processor.content.document_parsers import parse_files, parse_pdf
 from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.utils.helpers import timer
 from khoj.utils.rawconfig import Entry
@@ -14,9 +12,6 @@ logger = logging.getLogger(__name__)
 
 
 class PdfToEntries(TextToEntries):
-    # Class-level constant translation table
-    NULL_TRANSLATOR: Final = str.maketrans("", "", "\x00")
-
     def __init__(self):
         super().__init__()
 
@@ -57,15 +52,15 @@ class PdfToEntries(TextToEntries):
         file_to_text_map = dict()
         entries: List[str] = []
         entry_to_location_map: List[Tuple[str, str]] = []
+        # Parse PDF files in parallel worker processes
+        parsed_pdf_files = parse_files(parse_pdf, pdf_files)
         for pdf_file in pdf_files:
-            try:
-                pdf_entries_per_file = PdfToEntries.extract_text(pdf_files[pdf_file])
-                entry_to_location_map += zip(pdf_entries_per_file, [pdf_file] * len(pdf_entries_per_file))
-                entries.extend(pdf_entries_per_file)
-                file_to_text_map[pdf_file] = pdf_entries_per_file
-            except Exception as e:
-                logger.warning(f"Unable to extract entries from file: {pdf_file}")
-                logger.warning(e, exc_info=True)
+            if pdf_file not in parsed_pdf_files:
+                continue
+            pdf_entries_per_file = parsed_pdf_files[pdf_file]
+            entry_to_location_map += zip(pdf_entries_per_file, [pdf_file] * len(pdf_entries_per_file))
+            entries.extend(pdf_entries_per_file)
+            file_to_text_map[pdf_file] = pdf_entries_per_file
 
         return file_to_text_map, PdfToEntries.convert_pdf_entries_to_maps(entries, dict(entry_to_location_map))
 
@@ -94,26 +89,11 @@ class PdfToEntries(TextToEntries):
     @staticmethod
     def extract_text(pdf_file):
         """Extract text from specified PDF files"""
+        pdf_entry_by_pages = []
         try:
-            # Create temp file with .pdf extension that gets auto-deleted
-            with tempfile.NamedTemporaryFile(suffix=".pdf", delete=True) as tmpf:
-                tmpf.write(pdf_file)
-                tmpf.flush()  # Ensure all data is written
-
-                # Load the content using PyMuPDFLoader
-                loader = PyMuPDFLoader(tmpf.name)
-                pdf_entries_per_file = loader.load()
-
-                # Convert the loaded entries into the desired format
-                pdf_entry_by_pages = [PdfToEntries.clean_text(page.page_content) for page in pdf_entries_per_file]
+            pdf_entry_by_pages = parse_pdf("file.pdf", pdf_file)
         except Exception as e:
             logger.warning(f"Unable to process file: {pdf_file}. This file will not be indexed.")
             logger.warning(e, exc_info=True)
 
         return pdf_entry_by_pages
-
-    @staticmethod
-    def clean_text(text: str) -> str:
-        """Clean PDF text by removing null bytes and invalid Unicode characters."""
-        # Use faster translation table instead of replace
-        return text.translate(PdfToEntries.NULL_TRANSLATOR)
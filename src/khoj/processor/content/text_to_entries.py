@@ -1,10 +1,13 @@
 import hashlib
 import logging
+import os
+import queue
 import re
+import threading
 import uuid
 from abc import ABC, abstractmethod
-from itertools import repeat
-from typing import Any, Callable, List, Set, Tuple
+from itertools import chain, repeat
+from typing import Any, Callable, Iterator, List, Set, Tuple
 
 from langchain_text_splitters import RecursiveCharacterTextSplitter
 from tqdm import tqdm
@@ -15,10 +18,10 @@ from khoj.database.adapters import (
     get_default_search_model,
 )
 from khoj.database.models import Entry as DbEntry
-from khoj.database.models import EntryDates, KhojUser
+from khoj.database.models import EntryDates, KhojUser, SearchModelConfig
 from khoj.search_filter.date_filter import DateFilter
 from khoj.utils import state
-from khoj.utils.helpers import batcher, is_none_or_empty, timer
+from khoj.utils.helpers import batcher, binary_quantize, is_none_or_empty, timer
 from khoj.utils.rawconfig import Entry
 
 logger = logging.getLogger(__name__)
@@ -155,8 +158,8 @@ class TextToEntries(ABC):
             hashes_by_file = dict[str, set[str]]()
             current_entry_hashes = list(map(TextToEntries.hash_func(key), current_entries))
             hash_to_current_entries = dict(zip(current_entry_hashes, current_entries))
-            for entry in tqdm(current_entries, desc="Hashing Entries"):
-                hashes_by_file.setdefault(entry.file, set()).add(TextToEntries.hash_func(key)(entry))
+            for entry_hash, entry in zip(current_entry_hashes, current_entries):
+                hashes_by_file.setdefault(entry.file, set()).add(entry_hash)
 
         num_deleted_entries = 0
         if regenerate:
@@ -164,23 +167,19 @@ class TextToEntries(ABC):
                 logger.debug(f"Deleting all entries for file type {file_type}")
                 num_deleted_entries = EntryAdapters.delete_all_entries(user, file_type=file_type)
 
-        hashes_to_process = set()
+        with timer("Loaded hashes of existing entries in", logger):
+            existing_entry_ids_by_file = EntryAdapters.get_existing_entry_ids_by_file_and_hash(user, file_type)
+
         with timer("Identified entries to add to database in", logger):
-            for file in tqdm(hashes_by_file, desc="Identify new entries"):
-                hashes_for_file = hashes_by_file[file]
-                existing_entries = DbEntry.objects.filter(
-                    user=user, hashed_value__in=hashes_for_file, file_type=file_type
-                )
-                existing_entry_hashes = set([entry.hashed_value for entry in existing_entries])
-                hashes_to_process |= hashes_for_file - existing_entry_hashes
+            existing_entry_hashes = {
+                hashed_value for file_entries in existing_entry_ids_by_file.values() for hashed_value in file_entries
+            }
+            hashes_to_process = set(hash_to_current_entries) - existing_entry_hashes
 
-        embeddings = []
         model = get_default_search_model()
-        with timer("Generated embeddings for entries to add to database in", logger):
-            entries_to_process = [hash_to_current_entries[hashed_val] for hashed_val in hashes_to_process]
-            data_to_embed = [getattr(entry, key) for entry in entries_to_process]
-            modified_files = {entry.file for entry in entries_to_process}
-            embeddings += self.embeddings_model[model.name].embed_documents(data_to_embed)
+        entry_hashes_to_process = list(hashes_to_process)
+        entries_to_process = [hash_to_current_entries[hashed_val] for hashed_val in entry_hashes_to_process]
+        modified_files = {entry.file for entry in entries_to_process}
 
         file_to_file_object_map = {}
         if file_to_text_map and modified_files:
@@ -195,72 +194,204 @@ class TextToEntries(ABC):
                         file_object = FileObjectAdapters.create_file_object(user, modified_file, raw_text)
                     file_to_file_object_map[modified_file] = file_object
 
-        added_entries: list[DbEntry] = []
-        with timer("Added entries to database in", logger):
-            num_items = len(hashes_to_process)
-            assert num_items == len(embeddings)
-            batch_size = min(200, num_items)
-            entry_batches = zip(hashes_to_process, embeddings)
-
-            for entry_batch in tqdm(batcher(entry_batches, batch_size), desc="Add entries to database"):
-                batch_embeddings_to_create: List[DbEntry] = []
-                for entry_hash, new_entry in entry_batch:
-                    entry = hash_to_current_entries[entry_hash]
-                    file_object = file_to_file_object_map.get(entry.file, None)
-                    batch_embeddings_to_create.append(
-                        DbEntry(
-                            user=user,
-                            embeddings=new_entry,
-                            raw=entry.raw,
-                            compiled=entry.compiled,
-                            heading=entry.heading[:1000],  # Truncate to max chars of field allowed
-                            file_path=entry.file,
-                            file_source=file_source,
-                            file_type=file_type,
-                            hashed_value=entry_hash,
-                            corpus_id=entry.corpus_id,
-                            url=entry.uri,
-                            search_model=model,
-                            file_object=file_object,
-                        )
-                    )
-                try:
-                    added_entries += DbEntry.objects.bulk_create(batch_embeddings_to_create)
-                except Exception as e:
-                    batch_indexing_error = "\n\n".join(
-                        f"file: {entry.file_path}\nheading: {entry.heading}\ncompiled: {entry.compiled[:100]}\nraw: {entry.raw[:100]}"
-                        for entry in batch_embeddings_to_create
-                    )
-                    logger.error(f"Error adding entries to database:\n{batch_indexing_error}\n---\n{e}", exc_info=True)
-            logger.debug(f"Added {len(added_entries)} {file_type} entries to database")
-
-        new_dates = []
-        with timer("Indexed dates from added entries in", logger):
-            for added_entry in added_entries:
-                dates_in_entries = zip(self.date_filter.extract_dates(added_entry.compiled), repeat(added_entry))
-                dates_to_create = [
-                    EntryDates(date=date, entry=added_entry)
-                    for date, added_entry in dates_in_entries
-                    if not is_none_or_empty(date)
-                ]
-                new_dates += EntryDates.objects.bulk_create(dates_to_create)
-            logger.debug(f"Indexed {len(new_dates)} dates from added {file_type} entries")
+        # Reuse stored embeddings of identical content indexed before by any user or agent.
+        # Re-encode all content when regenerating the index, to recover from bad stored embeddings
+        chunk_size = int(os.getenv("KHOJ_INDEXING_CHUNK_SIZE", 1000))
+        with timer("Identified entries with stored embeddings in", logger):
+            stored_hashes = (
+                set() if regenerate else EntryAdapters.get_stored_embedding_hashes(model, entry_hashes_to_process)
+            )
+            hashes_with_stored_embeddings = [h for h in entry_hashes_to_process if h in stored_hashes]
+            hashes_to_embed = [h for h in entry_hashes_to_process if h not in stored_hashes]
+            logger.debug(f"Reusing stored embeddings of {len(hashes_with_stored_embeddings)} {file_type} entries")
+
+        def stored_chunks():
+            for chunk_start in range(0, len(hashes_with_stored_embeddings), chunk_size):
+                chunk_hashes = hashes_with_stored_embeddings[chunk_start : chunk_start + chunk_size]
+                stored_embeddings = EntryAdapters.get_stored_embeddings(model, chunk_hashes)
+                # Embed content whose stored embeddings were pruned after they were identified
+                hashes_to_embed.extend(h for h in chunk_hashes if stored_embeddings.get(h) is None)
+                chunk_hashes = [h for h in chunk_hashes if stored_embeddings.get(h) is not None]
+                yield chunk_hashes, [stored_embeddings[entry_hash] for entry_hash in chunk_hashes], False
+
+        # Embed other entries in chunks on a background thread while earlier chunks are added to the database.
+        # Starts once all stored chunks are added, to also embed content with stored embeddings pruned meanwhile
+        def embedded_chunks():
+            queue_depth = int(os.getenv("KHOJ_INDEXING_QUEUE_DEPTH", 2))
+            data_to_embed = [getattr(hash_to_current_entries[entry_hash], key) for entry_hash in hashes_to_embed]
+            for chunk_start, embeddings in self.embed_in_chunks(model.name, data_to_embed, chunk_size, queue_depth):
+                yield hashes_to_embed[chunk_start : chunk_start + len(embeddings)], embeddings, True
+
+        num_added_entries = 0
+        num_new_dates = 0
+        with timer("Embedded and added entries to database in", logger):
+            all_chunks = chain(stored_chunks(), embedded_chunks())
+            for chunk_hashes, embeddings, is_new in tqdm(all_chunks, desc="Add entries to database"):
+                # Record embedding dimensions of search model to build vector index of its embeddings
+                if len(embeddings) > 0 and model.embeddings_dimensions != len(embeddings[0]):
+                    EntryAdapters.set_embeddings_dimensions(model, len(embeddings[0]))
+
+                assert len(chunk_hashes) == len(embeddings)
+                added_entries = self.add_entries_to_database(
+                    user,
+                    zip(chunk_hashes, embeddings),
+                    hash_to_current_entries,
+                    file_to_file_object_map,
+                    file_type,
+                    file_source,
+                    model,
+                )
+                if is_new:
+                    EntryAdapters.store_embeddings(model, chunk_hashes, embeddings)
+                num_added_entries += len(added_entries)
+                num_new_dates += self.index_dates(added_entries)
+            logger.debug(f"Added {num_added_entries} {file_type} entries to database")
+            logger.debug(f"Indexed {num_new_dates} dates from added {file_type} entries")
+
+        # Invalidate cached search results of user on all workers
+        if num_added_entries:
+            state.search_cache.invalidate(user.uuid)
 
         with timer("Deleted entries identified by server from database in", logger):
-            for file in hashes_by_file:
-                existing_entry_hashes = EntryAdapters.get_existing_entry_hashes_by_file(user, file)
-                to_delete_entry_hashes = set(existing_entry_hashes) - hashes_by_file[file]
-                num_deleted_entries += len(to_delete_entry_hashes)
-                EntryAdapters.delete_entry_by_hash(user, hashed_values=list(to_delete_entry_hashes))
+            # Delete existing entries of updated files that are not in their current version
+            to_delete_entry_ids = [
+                entry_id
+                for file in hashes_by_file
+                for hashed_value, entry_ids in existing_entry_ids_by_file.get(file, {}).items()
+                if hashed_value not in hashes_by_file[file]
+                for entry_id in entry_ids
+            ]
+            num_deleted_entries += EntryAdapters.delete_entries_by_ids(user, to_delete_entry_ids)
 
         with timer("Deleted entries requested by clients from database in", logger):
-            if deletion_filenames is not None:
-                for file_path in deletion_filenames:
-                    deleted_count = EntryAdapters.delete_entry_by_file(user, file_path)
-                    num_deleted_entries += deleted_count
-                    FileObjectAdapters.delete_file_object_by_name(user, file_path)
+            if deletion_filenames:
+                deletion_filenames = list(deletion_filenames)
+                num_deleted_entries += EntryAdapters.delete_entries_by_filenames(user, deletion_filenames)
+                FileObjectAdapters.delete_file_objects_by_names(user, deletion_filenames)
+
+        if model.embeddings_quantization == SearchModelConfig.EmbeddingsQuantization.BINARY:
+            with timer("Quantized embeddings of previously indexed entries in", logger):
+                try:
+                    num_quantized_entries = EntryAdapters.update_quantized_embeddings(user, model)
+                    logger.debug(f"Quantized embeddings of {num_quantized_entries} previously indexed entries")
+                except Exception as e:
+                    logger.error(f"Failed to quantize embeddings of {user}'s knowledge base: {e}", exc_info=True)
 
-        return len(added_entries), num_deleted_entries
+        if num_added_entries:
+            with timer("Updated vector index of knowledge base in", logger):
+                try:
+                    EntryAdapters.update_vector_index(user, model)
+                except Exception as e:
+                    logger.error(f"Failed to update vector index of {user}'s knowledge base: {e}", exc_info=True)
+
+        return num_added_entries, num_deleted_entries
+
+    def embed_in_chunks(
+        self, search_model_name: str, docs: List[str], chunk_size: int, queue_depth: int
+    ) -> Iterator[Tuple[int, List]]:
+        """
+        Embed documents in chunks on a background thread. Yield start index and embeddings of each chunk once ready.
+        At most queue_depth embedded chunks wait to be consumed. So memory use stays flat for large corpora.
+        """
+        embedded_chunks: queue.Queue = queue.Queue(maxsize=max(1, queue_depth))
+        stop_embedding = threading.Event()
+        embedding_done = object()
+
+        def put(item) -> bool:
+            # Wait for space in queue unless consumer has stopped
+            while not stop_embedding.is_set():
+                try:
+                    embedded_chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def embed_chunks():
+            try:
+                for chunk_start in range(0, len(docs), chunk_size):
+                    chunk = docs[chunk_start : chunk_start + chunk_size]
+                    embeddings = self.embeddings_model[search_model_name].embed_documents(chunk)
+                    if not put((chunk_start, embeddings)):
+                        return
+                put(embedding_done)
+            except Exception as e:
+                put(e)
+
+        if not docs:
+            return
+        producer = threading.Thread(target=embed_chunks, name="embed-entries", daemon=True)
+        producer.start()
+        try:
+            while True:
+                item = embedded_chunks.get()
+                if item is embedding_done:
+                    return
+                elif isinstance(item, Exception):
+                    raise item
+                yield item
+        finally:
+            stop_embedding.set()
+            producer.join()
+
+    @staticmethod
+    def add_entries_to_database(
+        user: KhojUser,
+        hashes_with_embeddings,
+        hash_to_current_entries: dict[str, Entry],
+        file_to_file_object_map: dict,
+        file_type: str,
+        file_source: str,
+        model,
+        batch_size: int = 200,
+    ) -> List[DbEntry]:
+        added_entries: List[DbEntry] = []
+        quantize_embeddings = model.embeddings_quantization == SearchModelConfig.EmbeddingsQuantization.BINARY
+        for entry_batch in batcher(hashes_with_embeddings, batch_size):
+            batch_embeddings_to_create: List[DbEntry] = []
+            for entry_hash, new_entry in entry_batch:
+                entry = hash_to_current_entries[entry_hash]
+                file_object = file_to_file_object_map.get(entry.file, None)
+                batch_embeddings_to_create.append(
+                    DbEntry(
+                        user=user,
+                        embeddings=new_entry,
+                        binary_embeddings=binary_quantize(new_entry) if quantize_embeddings else None,
+                        raw=entry.raw,
+                        compiled=entry.compiled,
+                        heading=entry.heading[:1000],  # Truncate to max chars of field allowed
+                        file_path=entry.file,
+                        file_source=file_source,
+                        file_type=file_type,
+                        hashed_value=entry_hash,
+                        corpus_id=entry.corpus_id,
+                        url=entry.uri,
+                        search_model=model,
+                        file_object=file_object,
+                    )
+                )
+            try:
+                added_entries += DbEntry.objects.bulk_create(batch_embeddings_to_create)
+            except Exception as e:
+                batch_indexing_error = "\n\n".join(
+                    f"file: {entry.file_path}\nheading: {entry.heading}\ncompiled: {entry.compiled[:100]}\nraw: {entry.raw[:100]}"
+                    for entry in batch_embeddings_to_create
+                )
+                logger.error(f"Error adding entries to database:\n{batch_indexing_error}\n---\n{e}", exc_info=True)
+        return added_entries
+
+    def index_dates(self, added_entries: List[DbEntry]) -> int:
+        "Index dates in added entries. Return number of dates indexed"
+        num_new_dates = 0
+        for added_entry in added_entries:
+            dates_in_entries = zip(self.date_filter.extract_dates(added_entry.compiled), repeat(added_entry))
+            dates_to_create = [
+                EntryDates(date=date, entry=added_entry)
+                for date, added_entry in dates_in_entries
+                if not is_none_or_empty(date)
+            ]
+            num_new_dates += len(EntryDates.objects.bulk_create(dates_to_create))
+        return num_new_dates
 
     @staticmethod
     def mark_entries_for_update(
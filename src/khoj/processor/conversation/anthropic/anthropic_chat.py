@@ -4,6 +4,7 @@ from typing import AsyncGenerator, List, Optional
 from langchain_core.messages.chat import ChatMessage
 
 from khoj.processor.conversation.anthropic.utils import (
+    aanthropic_completion_with_backoff,
     anthropic_chat_completion_with_backoff,
     anthropic_completion_with_backoff,
 )
@@ -44,6 +45,34 @@ def anthropic_send_message_to_model(
     )
 
 
+async def aanthropic_send_message_to_model(
+    messages,
+    api_key,
+    api_base_url,
+    model,
+    response_type="text",
+    response_schema=None,
+    tools=None,
+    deepthought=False,
+    tracer={},
+) -> ResponseWithThought:
+    """
+    Send message to model without blocking the event loop
+    """
+    return await aanthropic_completion_with_backoff(
+        messages=messages,
+        system_prompt="",
+        model_name=model,
+        api_key=api_key,
+        api_base_url=api_base_url,
+        response_type=response_type,
+        response_schema=response_schema,
+        tools=tools,
+        deepthought=deepthought,
+        tracer=tracer,
+    )
+
+
 async def converse_anthropic(
     # Query
     messages: List[ChatMessage],
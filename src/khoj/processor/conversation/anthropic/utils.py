@@ -2,7 +2,7 @@ import json
 import logging
 from copy import deepcopy
 from time import perf_counter
-from typing import AsyncGenerator, Dict, List
+from typing import AsyncGenerator, Dict, List, Tuple
 
 import anthropic
 from langchain_core.messages.chat import ChatMessage
@@ -42,37 +42,25 @@ MAX_REASONING_TOKENS_ANTHROPIC = 12000
 REASONING_MODELS = ["claude-3-7", "claude-sonnet-4", "claude-opus-4"]
 
 
-@retry(
-    wait=wait_random_exponential(min=1, max=10),
-    stop=stop_after_attempt(2),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=True,
-)
-def anthropic_completion_with_backoff(
+def prepare_anthropic_request(
     messages: list[ChatMessage],
     system_prompt: str,
     model_name: str,
-    temperature: float = 0.4,
-    api_key: str | None = None,
-    api_base_url: str | None = None,
+    temperature: float,
     model_kwargs: dict | None = None,
     max_tokens: int | None = None,
     response_type: str = "text",
     response_schema: BaseModel | None = None,
     tools: List[ToolDefinition] = None,
     deepthought: bool = False,
-    tracer: dict = {},
-) -> ResponseWithThought:
-    client = anthropic_clients.get(api_key)
-    if not client:
-        client = get_anthropic_client(api_key, api_base_url)
-        anthropic_clients[api_key] = client
-
+) -> Tuple[list, str, float, int, dict]:
+    """
+    Format messages and configure model arguments for the Anthropic messages API.
+    Returns the formatted messages, the response prefill, temperature, max tokens and model arguments.
+    """
     formatted_messages, system = format_messages_for_anthropic(messages, system_prompt)
 
-    thoughts = ""
-    aggregated_response = ""
-    final_message = None
+    response_prefill = ""
     model_kwargs = model_kwargs or dict()
 
     # Configure structured output
@@ -93,7 +81,7 @@ def anthropic_completion_with_backoff(
     elif response_type == "json_object" and not (is_reasoning_model(model_name) and deepthought):
         # Prefill model response with '{' to make it output a valid JSON object. Not supported with extended thinking.
         formatted_messages.append(anthropic.types.MessageParam(role="assistant", content="{"))
-        aggregated_response += "{"
+        response_prefill = "{"
 
     if system:
         model_kwargs["system"] = system
@@ -105,23 +93,21 @@ def anthropic_completion_with_backoff(
         # Temperature control not supported when using extended thinking
         temperature = 1.0
 
-    with client.messages.stream(
-        messages=formatted_messages,
-        model=model_name,  # type: ignore
-        temperature=temperature,
-        timeout=20,
-        max_tokens=max_tokens,
-        **(model_kwargs),
-    ) as stream:
-        for chunk in stream:
-            if chunk.type != "content_block_delta":
-                continue
-            if chunk.delta.type == "thinking_delta":
-                thoughts += chunk.delta.thinking
-            elif chunk.delta.type == "text_delta":
-                aggregated_response += chunk.delta.text
-        final_message = stream.get_final_message()
+    return formatted_messages, response_prefill, temperature, max_tokens, model_kwargs
+
 
+def to_anthropic_response(
+    messages: list[ChatMessage],
+    model_name: str,
+    temperature: float,
+    final_message: anthropic.types.Message,
+    aggregated_response: str,
+    thoughts: str,
+    response_schema: BaseModel | None = None,
+    tools: List[ToolDefinition] = None,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    "Extract, validate and trace the response by the Anthropic messages API. Return it as a response with thoughts."
     # Track raw content of model response to reuse for cache hits in multi-turn chats
     raw_content = [item.model_dump() for item in final_message.content]
 
@@ -172,6 +158,149 @@ def anthropic_completion_with_backoff(
     return ResponseWithThought(text=aggregated_response, thought=thoughts, raw_content=raw_content)
 
 
+@retry(
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+def anthropic_completion_with_backoff(
+    messages: list[ChatMessage],
+    system_prompt: str,
+    model_name: str,
+    temperature: float = 0.4,
+    api_key: str | None = None,
+    api_base_url: str | None = None,
+    model_kwargs: dict | None = None,
+    max_tokens: int | None = None,
+    response_type: str = "text",
+    response_schema: BaseModel | None = None,
+    tools: List[ToolDefinition] = None,
+    deepthought: bool = False,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    client = anthropic_clients.get(api_key)
+    if not client:
+        client = get_anthropic_client(api_key, api_base_url)
+        anthropic_clients[api_key] = client
+
+    formatted_messages, aggregated_response, temperature, max_tokens, model_kwargs = prepare_anthropic_request(
+        messages,
+        system_prompt,
+        model_name,
+        temperature,
+        model_kwargs,
+        max_tokens,
+        response_type,
+        response_schema,
+        tools,
+        deepthought,
+    )
+
+    thoughts = ""
+    with client.messages.stream(
+        messages=formatted_messages,
+        model=model_name,  # type: ignore
+        temperature=temperature,
+        timeout=20,
+        max_tokens=max_tokens,
+        **(model_kwargs),
+    ) as stream:
+        for chunk in stream:
+            if chunk.type != "content_block_delta":
+                continue
+            if chunk.delta.type == "thinking_delta":
+                thoughts += chunk.delta.thinking
+            elif chunk.delta.type == "text_delta":
+                aggregated_response += chunk.delta.text
+        final_message = stream.get_final_message()
+
+    return to_anthropic_response(
+        messages,
+        model_name,
+        temperature,
+        final_message,
+        aggregated_response,
+        thoughts,
+        response_schema,
+        tools,
+        tracer,
+    )
+
+
+@retry(
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+async def aanthropic_completion_with_backoff(
+    messages: list[ChatMessage],
+    system_prompt: str,
+    model_name: str,
+    temperature: float = 0.4,
+    api_key: str | None = None,
+    api_base_url: str | None = None,
+    model_kwargs: dict | None = None,
+    max_tokens: int | None = None,
+    response_type: str = "text",
+    response_schema: BaseModel | None = None,
+    tools: List[ToolDefinition] = None,
+    deepthought: bool = False,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    """
+    Async version of anthropic_completion_with_backoff. Uses the pooled async client to not block the event loop.
+    """
+    client = anthropic_async_clients.get(api_key)
+    if not client:
+        client = get_anthropic_async_client(api_key, api_base_url)
+        anthropic_async_clients[api_key] = client
+
+    formatted_messages, aggregated_response, temperature, max_tokens, model_kwargs = prepare_anthropic_request(
+        messages,
+        system_prompt,
+        model_name,
+        temperature,
+        model_kwargs,
+        max_tokens,
+        response_type,
+        response_schema,
+        tools,
+        deepthought,
+    )
+
+    thoughts = ""
+    async with client.messages.stream(
+        messages=formatted_messages,
+        model=model_name,  # type: ignore
+        temperature=temperature,
+        timeout=20,
+        max_tokens=max_tokens,
+        **(model_kwargs),
+    ) as stream:
+        async for chunk in stream:
+            if chunk.type != "content_block_delta":
+                continue
+            if chunk.delta.type == "thinking_delta":
+                thoughts += chunk.delta.thinking
+            elif chunk.delta.type == "text_delta":
+                aggregated_response += chunk.delta.text
+        final_message = await stream.get_final_message()
+
+    return to_anthropic_response(
+        messages,
+        model_name,
+        temperature,
+        final_message,
+        aggregated_response,
+        thoughts,
+        response_schema,
+        tools,
+        tracer,
+    )
+
+
 @retry(
     wait=wait_exponential(multiplier=1, min=4, max=10),
     stop=stop_after_attempt(2),
@@ -4,6 +4,7 @@ from typing import AsyncGenerator, List, Optional
 from langchain_core.messages.chat import ChatMessage
 
 from khoj.processor.conversation.google.utils import (
+    agemini_completion_with_backoff,
     gemini_chat_completion_with_backoff,
     gemini_completion_with_backoff,
 )
@@ -15,6 +16,22 @@ from khoj.processor.conversation.utils import (
 logger = logging.getLogger(__name__)
 
 
+def get_model_kwargs(response_type="text", response_schema=None, tools=None) -> dict:
+    """
+    Configure structured output arguments for Gemini models
+    """
+    model_kwargs = {}
+
+    if tools:
+        model_kwargs["tools"] = tools
+    # Monitor for flakiness in 1.5+ models. This would cause unwanted behavior and terminate response early in 1.5 models.
+    elif response_type == "json_object":
+        model_kwargs["response_mime_type"] = "application/json"
+        if response_schema:
+            model_kwargs["response_schema"] = response_schema
+    return model_kwargs
+
+
 def gemini_send_message_to_model(
     messages,
     api_key,
@@ -30,15 +47,7 @@ def gemini_send_message_to_model(
     """
     Send message to model
     """
-    model_kwargs = {}
-
-    if tools:
-        model_kwargs["tools"] = tools
-    # Monitor for flakiness in 1.5+ models. This would cause unwanted behavior and terminate response early in 1.5 models.
-    elif response_type == "json_object":
-        model_kwargs["response_mime_type"] = "application/json"
-        if response_schema:
-            model_kwargs["response_schema"] = response_schema
+    model_kwargs = get_model_kwargs(response_type, response_schema, tools)
 
     # Get Response from Gemini
     return gemini_completion_with_backoff(
@@ -53,6 +62,35 @@ def gemini_send_message_to_model(
     )
 
 
+async def agemini_send_message_to_model(
+    messages,
+    api_key,
+    model,
+    api_base_url=None,
+    response_type="text",
+    response_schema=None,
+    tools=None,
+    deepthought=False,
+    tracer={},
+) -> ResponseWithThought:
+    """
+    Send message to model without blocking the event loop
+    """
+    model_kwargs = get_model_kwargs(response_type, response_schema, tools)
+
+    # Get Response from Gemini
+    return await agemini_completion_with_backoff(
+        messages=messages,
+        system_prompt="",
+        model_name=model,
+        api_key=api_key,
+        api_base_url=api_base_url,
+        model_kwargs=model_kwargs,
+        deepthought=deepthought,
+        tracer=tracer,
+    )
+
+
 async def converse_gemini(
     # Query
     messages: List[ChatMessage],
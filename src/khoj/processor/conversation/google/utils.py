@@ -5,7 +5,7 @@ import random
 import re
 from copy import deepcopy
 from time import perf_counter
-from typing import Any, AsyncGenerator, AsyncIterator, Dict, List
+from typing import Any, AsyncGenerator, AsyncIterator, Dict, List, Tuple
 
 import httpx
 from google import genai
@@ -167,32 +167,19 @@ def _wait_with_gemini_delay(min_wait=4, max_wait=120, multiplier=1, fallback_wai
     return wait_func
 
 
-@retry(
-    retry=retry_if_exception(_is_retryable_error),
-    wait=_wait_with_gemini_delay(min_wait=1, max_wait=10, fallback_wait=wait_random_exponential(min=1, max=10)),
-    stop=stop_after_attempt(2),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=False,
-    retry_error_callback=_gemini_retry_error_callback,
-)
-def gemini_completion_with_backoff(
+def prepare_gemini_request(
     messages: list[ChatMessage],
     system_prompt: str,
     model_name: str,
     temperature=1.0,
-    api_key=None,
-    api_base_url: str = None,
     model_kwargs={},
     deepthought=False,
-    tracer={},
-) -> ResponseWithThought:
-    client = gemini_clients.get(api_key)
-    if not client:
-        client = get_gemini_client(api_key, api_base_url)
-        gemini_clients[api_key] = client
-
+) -> Tuple[list, gtypes.GenerateContentConfig]:
+    """
+    Format messages and configure generation for the Gemini API.
+    Returns the formatted messages and generation config.
+    """
     formatted_messages, system_instruction = format_messages_for_gemini(messages, system_prompt)
-    raw_content, response_text, response_thoughts = [], "", None
 
     # Configure structured output
     tools = None
@@ -224,47 +211,60 @@ def gemini_completion_with_backoff(
         top_p=0.95,
         http_options=gtypes.HttpOptions(client_args={"timeout": httpx.Timeout(30.0, read=60.0)}),
     )
+    return formatted_messages, config
+
+
+def parse_gemini_response(response: gtypes.GenerateContentResponse) -> Tuple[str, str, list]:
+    "Extract response text, thoughts and raw content from Gemini response"
+    if not response.candidates or not response.candidates[0].content or response.candidates[0].content.parts is None:
+        raise ValueError("Failed to get response from model.")
+    raw_content = [part.model_dump() for part in response.candidates[0].content.parts]
+    if response.function_calls:
+        function_calls = [
+            ToolCall(name=function_call.name, args=function_call.args, id=function_call.id).__dict__
+            for function_call in response.function_calls
+        ]
+        response_text = json.dumps(function_calls)
+    else:
+        # If no function calls, use the text response
+        response_text = response.text
+    response_thoughts = "\n".join(
+        [part.text for part in response.candidates[0].content.parts if part.thought and isinstance(part.text, str)]
+    )
+    return response_text, response_thoughts, raw_content
+
+
+def handle_gemini_client_error(e: gerrors.ClientError, messages: list[ChatMessage], model_name: str) -> str:
+    "Raise retryable Gemini client errors. Otherwise return the reason for stopping as the response text."
+    # For 429 rate-limit errors, raise wrapped exception so tenacity can retry.
+    if e.code == 429:
+        # Prepare friendly message for eventual exhaustion
+        response_text = "My brain is exhausted. Can you please try again in a bit?"
+        logger.warning(f"Retryable Gemini ClientError: {e.code} {e.status}. Details: {e.details}")
+        # Raise wrapped so our retry callback can produce final ResponseWithThought
+        raise GeminiRetryableClientError(e, response_text)
+    # Handle non-retryable client errors
+    else:
+        # Respond with reason for stopping
+        response_text, _ = handle_gemini_response(e.args)
+    logger.warning(
+        f"LLM Response Prevented for {model_name}: {response_text}.\n"
+        + f"Last Message by {messages[-1].role}: {messages[-1].content}"
+    )
+    return response_text
 
-    try:
-        # Generate the response
-        response = client.models.generate_content(model=model_name, config=config, contents=formatted_messages)
-        if (
-            not response.candidates
-            or not response.candidates[0].content
-            or response.candidates[0].content.parts is None
-        ):
-            raise ValueError("Failed to get response from model.")
-        raw_content = [part.model_dump() for part in response.candidates[0].content.parts]
-        if response.function_calls:
-            function_calls = [
-                ToolCall(name=function_call.name, args=function_call.args, id=function_call.id).__dict__
-                for function_call in response.function_calls
-            ]
-            response_text = json.dumps(function_calls)
-        else:
-            # If no function calls, use the text response
-            response_text = response.text
-        response_thoughts = "\n".join(
-            [part.text for part in response.candidates[0].content.parts if part.thought and isinstance(part.text, str)]
-        )
-    except gerrors.ClientError as e:
-        response = None
-        # For 429 rate-limit errors, raise wrapped exception so tenacity can retry.
-        if e.code == 429:
-            # Prepare friendly message for eventual exhaustion
-            response_text = "My brain is exhausted. Can you please try again in a bit?"
-            logger.warning(f"Retryable Gemini ClientError: {e.code} {e.status}. Details: {e.details}")
-            # Raise wrapped so our retry callback can produce final ResponseWithThought
-            raise GeminiRetryableClientError(e, response_text)
-        # Handle non-retryable client errors
-        else:
-            # Respond with reason for stopping
-            response_text, _ = handle_gemini_response(e.args)
-        logger.warning(
-            f"LLM Response Prevented for {model_name}: {response_text}.\n"
-            + f"Last Message by {messages[-1].role}: {messages[-1].content}"
-        )
 
+def to_gemini_response(
+    messages: list[ChatMessage],
+    model_name: str,
+    temperature: float,
+    response: gtypes.GenerateContentResponse | None,
+    response_text: str,
+    response_thoughts: str,
+    raw_content: list,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    "Track usage, validate and trace the Gemini response. Return it as a response with thoughts."
     # Aggregate cost of chat
     input_tokens = response.usage_metadata.prompt_token_count or 0 if response else 0
     output_tokens = response.usage_metadata.candidates_token_count or 0 if response else 0
@@ -295,6 +295,95 @@ def gemini_completion_with_backoff(
     return ResponseWithThought(text=response_text, thought=response_thoughts, raw_content=raw_content)
 
 
+@retry(
+    retry=retry_if_exception(_is_retryable_error),
+    wait=_wait_with_gemini_delay(min_wait=1, max_wait=10, fallback_wait=wait_random_exponential(min=1, max=10)),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=False,
+    retry_error_callback=_gemini_retry_error_callback,
+)
+def gemini_completion_with_backoff(
+    messages: list[ChatMessage],
+    system_prompt: str,
+    model_name: str,
+    temperature=1.0,
+    api_key=None,
+    api_base_url: str = None,
+    model_kwargs={},
+    deepthought=False,
+    tracer={},
+) -> ResponseWithThought:
+    client = gemini_clients.get(api_key)
+    if not client:
+        client = get_gemini_client(api_key, api_base_url)
+        gemini_clients[api_key] = client
+
+    formatted_messages, config = prepare_gemini_request(
+        messages, system_prompt, model_name, temperature, model_kwargs, deepthought
+    )
+    raw_content, response_text, response_thoughts = [], "", None
+
+    try:
+        # Generate the response
+        response = client.models.generate_content(model=model_name, config=config, contents=formatted_messages)
+        response_text, response_thoughts, raw_content = parse_gemini_response(response)
+    except gerrors.ClientError as e:
+        response = None
+        response_text = handle_gemini_client_error(e, messages, model_name)
+
+    return to_gemini_response(
+        messages, model_name, temperature, response, response_text, response_thoughts, raw_content, tracer
+    )
+
+
+@retry(
+    retry=retry_if_exception(_is_retryable_error),
+    wait=_wait_with_gemini_delay(min_wait=1, max_wait=10, fallback_wait=wait_random_exponential(min=1, max=10)),
+    stop=stop_after_attempt(2),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=False,
+    retry_error_callback=_gemini_retry_error_callback,
+)
+async def agemini_completion_with_backoff(
+    messages: list[ChatMessage],
+    system_prompt: str,
+    model_name: str,
+    temperature=1.0,
+    api_key=None,
+    api_base_url: str = None,
+    model_kwargs={},
+    deepthought=False,
+    tracer={},
+) -> ResponseWithThought:
+    """
+    Async version of gemini_completion_with_backoff. Uses the async api of the pooled client to not block the event loop.
+    """
+    client = gemini_clients.get(api_key)
+    if not client:
+        client = get_gemini_client(api_key, api_base_url)
+        gemini_clients[api_key] = client
+
+    formatted_messages, config = prepare_gemini_request(
+        messages, system_prompt, model_name, temperature, model_kwargs, deepthought
+    )
+    raw_content, response_text, response_thoughts = [], "", None
+
+    try:
+        # Generate the response
+        response = await client.aio.models.generate_content(
+            model=model_name, config=config, contents=formatted_messages
+        )
+        response_text, response_thoughts, raw_content = parse_gemini_response(response)
+    except gerrors.ClientError as e:
+        response = None
+        response_text = handle_gemini_client_error(e, messages, model_name)
+
+    return to_gemini_response(
+        messages, model_name, temperature, response, response_text, response_thoughts, raw_content, tracer
+    )
+
+
 @retry(
     retry=retry_if_exception(_is_retryable_error),
     wait=_wait_with_gemini_delay(multiplier=1, min_wait=4, max_wait=10),
@@ -4,6 +4,8 @@ from typing import Any, AsyncGenerator, Dict, List, Optional
 from langchain_core.messages.chat import ChatMessage
 
 from khoj.processor.conversation.openai.utils import (
+    acompletion_with_backoff,
+    aresponses_completion_with_backoff,
     chat_completion_with_backoff,
     clean_response_schema,
     completion_with_backoff,
@@ -24,21 +26,16 @@ from khoj.utils.helpers import ToolDefinition
 logger = logging.getLogger(__name__)
 
 
-def send_message_to_model(
-    messages,
-    api_key,
+def get_model_kwargs(
     model,
     response_type="text",
     response_schema=None,
     tools: list[ToolDefinition] = None,
-    deepthought=False,
     api_base_url=None,
-    tracer: dict = {},
-):
+) -> Dict[str, Any]:
     """
-    Send message to model
+    Configure structured output arguments supported by model
     """
-
     model_kwargs: Dict[str, Any] = {}
     json_support = get_structured_output_support(model, api_base_url)
     strict = not is_cerebras_api(api_base_url)
@@ -69,6 +66,24 @@ def send_message_to_model(
             }
     elif response_type == "json_object" and json_support == StructuredOutputSupport.OBJECT:
         model_kwargs["response_format"] = {"type": response_type}
+    return model_kwargs
+
+
+def send_message_to_model(
+    messages,
+    api_key,
+    model,
+    response_type="text",
+    response_schema=None,
+    tools: list[ToolDefinition] = None,
+    deepthought=False,
+    api_base_url=None,
+    tracer: dict = {},
+):
+    """
+    Send message to model
+    """
+    model_kwargs = get_model_kwargs(model, response_type, response_schema, tools, api_base_url)
 
     # Get Response from GPT
     if supports_responses_api(model, api_base_url):
@@ -93,6 +108,45 @@ def send_message_to_model(
         )
 
 
+async def asend_message_to_model(
+    messages,
+    api_key,
+    model,
+    response_type="text",
+    response_schema=None,
+    tools: list[ToolDefinition] = None,
+    deepthought=False,
+    api_base_url=None,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    """
+    Send message to model without blocking the event loop
+    """
+    model_kwargs = get_model_kwargs(model, response_type, response_schema, tools, api_base_url)
+
+    # Get Response from GPT
+    if supports_responses_api(model, api_base_url):
+        return await aresponses_completion_with_backoff(
+            messages=messages,
+            model_name=model,
+            openai_api_key=api_key,
+            api_base_url=api_base_url,
+            deepthought=deepthought,
+            model_kwargs=model_kwargs,
+            tracer=tracer,
+        )
+    else:
+        return await acompletion_with_backoff(
+            messages=messages,
+            model_name=model,
+            openai_api_key=api_key,
+            api_base_url=api_base_url,
+            deepthought=deepthought,
+            model_kwargs=model_kwargs,
+            tracer=tracer,
+        )
+
+
 async def converse_openai(
     # Query
     messages: List[ChatMessage],
@@ -3,7 +3,7 @@ import logging
 import os
 from copy import deepcopy
 from time import perf_counter
-from typing import AsyncGenerator, Dict, Generator, List, Literal, Optional, Union
+from typing import AsyncGenerator, Dict, Generator, List, Literal, Optional, Tuple, Union
 from urllib.parse import urlparse
 
 import httpx
@@ -21,6 +21,7 @@ from openai.types.chat.chat_completion_chunk import (
     Choice,
     ChoiceDelta,
 )
+from openai.types.completion_usage import CompletionUsage
 from openai.types.responses import Response as OpenAIResponse
 from openai.types.responses import ResponseFunctionToolCall, ResponseReasoningItem
 from pydantic import BaseModel
@@ -75,36 +76,21 @@ def _extract_text_for_instructions(content: Union[str, List, Dict, None]) -> str
     return str(content)
 
 
-@retry(
-    retry=(
-        retry_if_exception_type(openai._exceptions.APITimeoutError)
-        | retry_if_exception_type(openai._exceptions.RateLimitError)
-        | retry_if_exception_type(openai._exceptions.InternalServerError)
-        | retry_if_exception_type(ValueError)
-    ),
-    wait=wait_random_exponential(min=1, max=10),
-    stop=stop_after_attempt(3),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=True,
-)
-def completion_with_backoff(
+def prepare_chat_completion_request(
     messages: List[ChatMessage],
     model_name: str,
-    temperature=0.6,
-    openai_api_key=None,
-    api_base_url=None,
+    temperature: float,
+    api_base_url: str = None,
     deepthought: bool = False,
     model_kwargs: dict = {},
-    tracer: dict = {},
-) -> ResponseWithThought:
-    client_key = f"{openai_api_key}--{api_base_url}"
-    client = openai_clients.get(client_key)
-    if not client:
-        client = get_openai_client(openai_api_key, api_base_url)
-        openai_clients[client_key] = client
-
+) -> Tuple[List[dict], dict, bool, bool]:
+    """
+    Format messages and configure model arguments for the OpenAI (compatible) chat completions API.
+    Returns the formatted messages, model arguments, if response should be streamed and if thoughts are inline in the response.
+    """
+    model_kwargs = deepcopy(model_kwargs)
     stream = not is_non_streaming_model(model_name, api_base_url)
-    stream_processor = default_stream_processor
+    in_stream_thoughts = False
     if stream:
         model_kwargs["stream_options"] = {"include_usage": True}
 
@@ -129,7 +115,7 @@ def completion_with_backoff(
             # Grok-4 models do not support reasoning_effort parameter
             model_kwargs.pop("reasoning_effort", None)
     elif model_name.startswith("deepseek-reasoner") or model_name.startswith("deepseek-chat"):
-        stream_processor = in_stream_thought_processor
+        in_stream_thoughts = True
         # Two successive messages cannot be from the same role. Should merge any back-to-back messages from the same role.
         # The first message should always be a user message (except system message).
         updated_messages: List[dict] = []
@@ -142,7 +128,7 @@ def completion_with_backoff(
                 updated_messages.append(message)
         formatted_messages = updated_messages
     elif is_qwen_style_reasoning_model(model_name, api_base_url):
-        stream_processor = in_stream_thought_processor
+        in_stream_thoughts = True
         # Reasoning is enabled by default. Disable when deepthought is False.
         # See https://qwenlm.github.io/blog/qwen3/#advanced-usages
         if not deepthought:
@@ -150,14 +136,112 @@ def completion_with_backoff(
     elif is_groq_api(api_base_url):
         model_kwargs["service_tier"] = "auto"
 
-    read_timeout = 300 if is_local_api(api_base_url) else 60
     if os.getenv("KHOJ_LLM_SEED"):
         model_kwargs["seed"] = int(os.getenv("KHOJ_LLM_SEED"))
 
+    return formatted_messages, model_kwargs, stream, in_stream_thoughts
+
+
+def parse_chat_completion(chunk: ChatCompletion) -> Tuple[str, str, List[ToolCall]]:
+    "Extract response text, thoughts and tool calls from non-streamed chat completion"
+    aggregated_response = chunk.choices[0].message.content
+    if hasattr(chunk.choices[0].message, "reasoning_content"):
+        thoughts = chunk.choices[0].message.reasoning_content
+    else:
+        thoughts = chunk.choices[0].message.model_extra.get("reasoning_content", "")
+    raw_tool_calls = chunk.choices[0].message.tool_calls or []
+    tool_calls = [
+        ToolCall(name=tool.function.name, args=tool.function.parsed_arguments, id=tool.id) for tool in raw_tool_calls
+    ]
+    return aggregated_response, thoughts, tool_calls
+
+
+def to_chat_completion_response(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature: float,
+    aggregated_response: str,
+    thoughts: str,
+    tool_calls: List[ToolCall],
+    usage: Optional[CompletionUsage],
+    tracer: dict = {},
+) -> ResponseWithThought:
+    "Track usage, validate and trace the chat completion. Return it as a response with thoughts."
+    if tool_calls:
+        # If there are tool calls, aggregate thoughts and responses into thoughts
+        if thoughts and aggregated_response:
+            # wrap each line of thought in italics
+            thoughts = "\n".join([f"*{line.strip()}*" for line in thoughts.splitlines() if line.strip()])
+            thoughts = f"{thoughts}\n\n{aggregated_response}"
+        else:
+            thoughts = thoughts or aggregated_response
+        # Json dump tool calls into aggregated response
+        aggregated_response = json.dumps([tool_call.__dict__ for tool_call in tool_calls])
+
+    # Calculate cost of chat
+    input_tokens = usage.prompt_tokens if usage else 0
+    output_tokens = usage.completion_tokens if usage else 0
+    cost = (
+        usage.model_extra.get("estimated_cost", 0) if usage and usage.model_extra else 0
+    )  # Estimated costs returned by DeepInfra API
+
+    tracer["usage"] = get_chat_usage_metrics(
+        model_name, input_tokens, output_tokens, usage=tracer.get("usage"), cost=cost
+    )
+
+    # Validate the response. If empty, raise an error to retry.
+    if is_none_or_empty(aggregated_response):
+        logger.warning(f"No response by {model_name}\nLast Message by {messages[-1].role}: {messages[-1].content}.")
+        raise ValueError(f"Empty or no response by {model_name} over API. Retry if needed.")
+
+    # Save conversation trace
+    tracer["chat_model"] = model_name
+    tracer["temperature"] = temperature
+    if is_promptrace_enabled():
+        commit_conversation_trace(messages, aggregated_response, tracer)
+
+    return ResponseWithThought(text=aggregated_response, thought=thoughts)
+
+
+@retry(
+    retry=(
+        retry_if_exception_type(openai._exceptions.APITimeoutError)
+        | retry_if_exception_type(openai._exceptions.RateLimitError)
+        | retry_if_exception_type(openai._exceptions.InternalServerError)
+        | retry_if_exception_type(ValueError)
+    ),
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+def completion_with_backoff(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature=0.6,
+    openai_api_key=None,
+    api_base_url=None,
+    deepthought: bool = False,
+    model_kwargs: dict = {},
+    tracer: dict = {},
+) -> ResponseWithThought:
+    client_key = f"{openai_api_key}--{api_base_url}"
+    client = openai_clients.get(client_key)
+    if not client:
+        client = get_openai_client(openai_api_key, api_base_url)
+        openai_clients[client_key] = client
+
+    formatted_messages, model_kwargs, stream, in_stream_thoughts = prepare_chat_completion_request(
+        messages, model_name, temperature, api_base_url, deepthought, model_kwargs
+    )
+    stream_processor = in_stream_thought_processor if in_stream_thoughts else default_stream_processor
+    read_timeout = 300 if is_local_api(api_base_url) else 60
+
     tool_ids = []
     tool_calls: list[ToolCall] = []
     thoughts = ""
     aggregated_response = ""
+    usage = None
     if stream:
         with client.beta.chat.completions.stream(
             messages=formatted_messages,  # type: ignore
@@ -166,6 +250,8 @@ def completion_with_backoff(
             **model_kwargs,
         ) as chat:
             for chunk in stream_processor(chat):
+                if chunk.type == "chunk" and chunk.chunk.usage:
+                    usage = chunk.chunk.usage
                 if chunk.type == "content.delta":
                     aggregated_response += chunk.delta
                 elif chunk.type == "thought.delta":
@@ -185,22 +271,13 @@ def completion_with_backoff(
                 ):
                     thoughts += chunk.chunk.choices[0].delta.reasoning
                 elif chunk.type == "chunk" and chunk.chunk.choices and chunk.chunk.choices[0].delta.tool_calls:
-                    tool_ids += [tool_call.id for tool_call in chunk.chunk.choices[0].delta.tool_calls]
+                    # Only the first delta of each tool call has its id
+                    tool_ids += [tool_call.id for tool_call in chunk.chunk.choices[0].delta.tool_calls if tool_call.id]
                 elif chunk.type == "tool_calls.function.arguments.done":
                     tool_calls += [ToolCall(name=chunk.name, args=json.loads(chunk.arguments), id=None)]
-        if tool_calls:
-            # If there are tool calls, aggregate thoughts and responses into thoughts
-            if thoughts and aggregated_response:
-                # wrap each line of thought in italics
-                thoughts = "\n".join([f"*{line.strip()}*" for line in thoughts.splitlines() if line.strip()])
-                thoughts = f"{thoughts}\n\n{aggregated_response}"
-            else:
-                thoughts = thoughts or aggregated_response
-            # Json dump tool calls into aggregated response
-            tool_calls = [
-                ToolCall(name=chunk.name, args=chunk.args, id=tool_id) for chunk, tool_id in zip(tool_calls, tool_ids)
-            ]
-            aggregated_response = json.dumps([tool_call.__dict__ for tool_call in tool_calls])
+        tool_calls = [
+            ToolCall(name=chunk.name, args=chunk.args, id=tool_id) for chunk, tool_id in zip(tool_calls, tool_ids)
+        ]
     else:
         # Non-streaming chat completion
         chunk = client.beta.chat.completions.parse(
@@ -209,54 +286,99 @@ def completion_with_backoff(
             timeout=httpx.Timeout(30, read=read_timeout),
             **model_kwargs,
         )
-        aggregated_response = chunk.choices[0].message.content
-        if hasattr(chunk.choices[0].message, "reasoning_content"):
-            thoughts = chunk.choices[0].message.reasoning_content
-        else:
-            thoughts = chunk.choices[0].message.model_extra.get("reasoning_content", "")
-        raw_tool_calls = chunk.choices[0].message.tool_calls
-        if raw_tool_calls:
-            tool_calls = [
-                ToolCall(name=tool.function.name, args=tool.function.parsed_arguments, id=tool.id)
-                for tool in raw_tool_calls
-            ]
-            # If there are tool calls, aggregate thoughts and responses into thoughts
-            if thoughts and aggregated_response:
-                # wrap each line of thought in italics
-                thoughts = "\n".join([f"*{line.strip()}*" for line in thoughts.splitlines() if line.strip()])
-                thoughts = f"{thoughts}\n\n{aggregated_response}"
-            else:
-                thoughts = thoughts or aggregated_response
-            # Json dump tool calls into aggregated response
-            aggregated_response = json.dumps([tool_call.__dict__ for tool_call in tool_calls])
+        aggregated_response, thoughts, tool_calls = parse_chat_completion(chunk)
+        usage = chunk.usage
 
-    # Align chunk definition with non-streaming mode for post stream completion usage
-    if hasattr(chunk, "chunk"):
-        chunk = chunk.chunk
+    return to_chat_completion_response(
+        messages, model_name, temperature, aggregated_response, thoughts, tool_calls, usage, tracer
+    )
 
-    # Calculate cost of chat
-    input_tokens = chunk.usage.prompt_tokens if hasattr(chunk, "usage") and chunk.usage else 0
-    output_tokens = chunk.usage.completion_tokens if hasattr(chunk, "usage") and chunk.usage else 0
-    cost = (
-        chunk.usage.model_extra.get("estimated_cost", 0) if hasattr(chunk, "usage") and chunk.usage else 0
-    )  # Estimated costs returned by DeepInfra API
 
-    tracer["usage"] = get_chat_usage_metrics(
-        model_name, input_tokens, output_tokens, usage=tracer.get("usage"), cost=cost
-    )
+@retry(
+    retry=(
+        retry_if_exception_type(openai._exceptions.APITimeoutError)
+        | retry_if_exception_type(openai._exceptions.RateLimitError)
+        | retry_if_exception_type(openai._exceptions.InternalServerError)
+        | retry_if_exception_type(ValueError)
+    ),
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+async def acompletion_with_backoff(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature=0.6,
+    openai_api_key=None,
+    api_base_url=None,
+    deepthought: bool = False,
+    model_kwargs: dict = {},
+    tracer: dict = {},
+) -> ResponseWithThought:
+    """
+    Async version of completion_with_backoff. Uses the pooled async client to not block the event loop.
+    Aggregates the streamed response and returns a ResponseWithThought.
+    """
+    client_key = f"{openai_api_key}--{api_base_url}"
+    client = openai_async_clients.get(client_key)
+    if not client:
+        client = get_openai_async_client(openai_api_key, api_base_url)
+        openai_async_clients[client_key] = client
 
-    # Validate the response. If empty, raise an error to retry.
-    if is_none_or_empty(aggregated_response):
-        logger.warning(f"No response by {model_name}\nLast Message by {messages[-1].role}: {messages[-1].content}.")
-        raise ValueError(f"Empty or no response by {model_name} over API. Retry if needed.")
+    formatted_messages, model_kwargs, stream, in_stream_thoughts = prepare_chat_completion_request(
+        messages, model_name, temperature, api_base_url, deepthought, model_kwargs
+    )
+    stream_processor = ain_stream_thought_processor if in_stream_thoughts else astream_thought_processor
+    read_timeout = 300 if is_local_api(api_base_url) else 60
 
-    # Save conversation trace
-    tracer["chat_model"] = model_name
-    tracer["temperature"] = temperature
-    if is_promptrace_enabled():
-        commit_conversation_trace(messages, aggregated_response, tracer)
+    thoughts = ""
+    aggregated_response = ""
+    usage = None
+    if stream:
+        response: openai.AsyncStream[ChatCompletionChunk] = await client.chat.completions.create(
+            messages=formatted_messages,  # type: ignore
+            model=model_name,
+            stream=True,
+            timeout=httpx.Timeout(30, read=read_timeout),
+            **model_kwargs,
+        )
+        # Assemble streamed tool calls by their index
+        raw_tool_calls: Dict[int, Dict[str, str]] = {}
+        async for chunk in stream_processor(response):
+            if chunk.usage:
+                usage = chunk.usage
+            if len(chunk.choices) == 0:
+                continue
+            response_delta = chunk.choices[0].delta
+            if response_delta.content:
+                aggregated_response += response_delta.content
+            if response_delta.thought:
+                thoughts += response_delta.thought
+            for tool_call_delta in response_delta.tool_calls or []:
+                raw_tool_call = raw_tool_calls.setdefault(tool_call_delta.index, {"id": None, "name": "", "args": ""})
+                raw_tool_call["id"] = raw_tool_call["id"] or tool_call_delta.id
+                if tool_call_delta.function:
+                    raw_tool_call["name"] += tool_call_delta.function.name or ""
+                    raw_tool_call["args"] += tool_call_delta.function.arguments or ""
+        tool_calls = [
+            ToolCall(name=tool_call["name"], args=json.loads(tool_call["args"] or "{}"), id=tool_call["id"])
+            for _, tool_call in sorted(raw_tool_calls.items())
+        ]
+    else:
+        # Non-streaming chat completion
+        chunk = await client.beta.chat.completions.parse(
+            messages=formatted_messages,  # type: ignore
+            model=model_name,
+            timeout=httpx.Timeout(30, read=read_timeout),
+            **model_kwargs,
+        )
+        aggregated_response, thoughts, tool_calls = parse_chat_completion(chunk)
+        usage = chunk.usage
 
-    return ResponseWithThought(text=aggregated_response, thought=thoughts)
+    return to_chat_completion_response(
+        messages, model_name, temperature, aggregated_response, thoughts, tool_calls, usage, tracer
+    )
 
 
 @retry(
@@ -416,38 +538,18 @@ async def chat_completion_with_backoff(
         commit_conversation_trace(messages, aggregated_response, tracer)
 
 
-@retry(
-    retry=(
-        retry_if_exception_type(openai._exceptions.APITimeoutError)
-        | retry_if_exception_type(openai._exceptions.RateLimitError)
-        | retry_if_exception_type(openai._exceptions.InternalServerError)
-        | retry_if_exception_type(ValueError)
-    ),
-    wait=wait_random_exponential(min=1, max=10),
-    stop=stop_after_attempt(3),
-    before_sleep=before_sleep_log(logger, logging.DEBUG),
-    reraise=True,
-)
-def responses_completion_with_backoff(
+def prepare_responses_request(
     messages: List[ChatMessage],
     model_name: str,
-    temperature=0.6,
-    openai_api_key=None,
-    api_base_url=None,
+    temperature: float,
+    api_base_url: str = None,
     deepthought: bool = False,
     model_kwargs: dict = {},
-    tracer: dict = {},
-) -> ResponseWithThought:
+) -> Tuple[List[dict], Optional[str], float, dict]:
     """
-    Synchronous helper using the OpenAI Responses API in streaming mode under the hood.
-    Aggregates streamed deltas and returns a ResponseWithThought.
+    Format messages and configure model arguments for the OpenAI Responses API.
+    Returns the formatted messages, instructions, temperature and model arguments.
     """
-    client_key = f"{openai_api_key}--{api_base_url}"
-    client = openai_clients.get(client_key)
-    if not client:
-        client = get_openai_client(openai_api_key, api_base_url)
-        openai_clients[client_key] = client
-
     formatted_messages = format_message_for_api(messages, model_name, api_base_url)
     # Move the first system message to Responses API instructions
     instructions: Optional[str] = None
@@ -469,18 +571,17 @@ def responses_completion_with_backoff(
         model_kwargs.pop("top_p", None)
         model_kwargs.pop("stop", None)
 
-    read_timeout = 300 if is_local_api(api_base_url) else 60
+    return formatted_messages, instructions, temperature, model_kwargs
 
-    # Stream and aggregate
-    model_response: OpenAIResponse = client.responses.create(
-        input=formatted_messages,
-        instructions=instructions,
-        model=model_name,
-        temperature=temperature,
-        timeout=httpx.Timeout(30, read=read_timeout),  # type: ignore
-        store=False,
-        **model_kwargs,
-    )
+
+def to_responses_response(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature: float,
+    model_response: OpenAIResponse,
+    tracer: dict = {},
+) -> ResponseWithThought:
+    "Extract, validate and trace the response by the OpenAI Responses API. Return it as a response with thoughts."
     if not model_response or not isinstance(model_response, OpenAIResponse) or not model_response.output:
         raise ValueError(f"Empty response returned by {model_name}.")
 
@@ -530,6 +631,103 @@ def responses_completion_with_backoff(
     return ResponseWithThought(text=aggregated_text, thought=thoughts, raw_content=raw_content)
 
 
+@retry(
+    retry=(
+        retry_if_exception_type(openai._exceptions.APITimeoutError)
+        | retry_if_exception_type(openai._exceptions.RateLimitError)
+        | retry_if_exception_type(openai._exceptions.InternalServerError)
+        | retry_if_exception_type(ValueError)
+    ),
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+def responses_completion_with_backoff(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature=0.6,
+    openai_api_key=None,
+    api_base_url=None,
+    deepthought: bool = False,
+    model_kwargs: dict = {},
+    tracer: dict = {},
+) -> ResponseWithThought:
+    """
+    Synchronous helper using the OpenAI Responses API.
+    Returns the model response as a ResponseWithThought.
+    """
+    client_key = f"{openai_api_key}--{api_base_url}"
+    client = openai_clients.get(client_key)
+    if not client:
+        client = get_openai_client(openai_api_key, api_base_url)
+        openai_clients[client_key] = client
+
+    formatted_messages, instructions, temperature, model_kwargs = prepare_responses_request(
+        messages, model_name, temperature, api_base_url, deepthought, model_kwargs
+    )
+    read_timeout = 300 if is_local_api(api_base_url) else 60
+
+    model_response: OpenAIResponse = client.responses.create(
+        input=formatted_messages,
+        instructions=instructions,
+        model=model_name,
+        temperature=temperature,
+        timeout=httpx.Timeout(30, read=read_timeout),  # type: ignore
+        store=False,
+        **model_kwargs,
+    )
+    return to_responses_response(messages, model_name, temperature, model_response, tracer)
+
+
+@retry(
+    retry=(
+        retry_if_exception_type(openai._exceptions.APITimeoutError)
+        | retry_if_exception_type(openai._exceptions.RateLimitError)
+        | retry_if_exception_type(openai._exceptions.InternalServerError)
+        | retry_if_exception_type(ValueError)
+    ),
+    wait=wait_random_exponential(min=1, max=10),
+    stop=stop_after_attempt(3),
+    before_sleep=before_sleep_log(logger, logging.DEBUG),
+    reraise=True,
+)
+async def aresponses_completion_with_backoff(
+    messages: List[ChatMessage],
+    model_name: str,
+    temperature=0.6,
+    openai_api_key=None,
+    api_base_url=None,
+    deepthought: bool = False,
+    model_kwargs: dict = {},
+    tracer: dict = {},
+) -> ResponseWithThought:
+    """
+    Async version of responses_completion_with_backoff. Uses the pooled async client to not block the event loop.
+    """
+    client_key = f"{openai_api_key}--{api_base_url}"
+    client = openai_async_clients.get(client_key)
+    if not client:
+        client = get_openai_async_client(openai_api_key, api_base_url)
+        openai_async_clients[client_key] = client
+
+    formatted_messages, instructions, temperature, model_kwargs = prepare_responses_request(
+        messages, model_name, temperature, api_base_url, deepthought, model_kwargs
+    )
+    read_timeout = 300 if is_local_api(api_base_url) else 60
+
+    model_response: OpenAIResponse = await client.responses.create(
+        input=formatted_messages,
+        instructions=instructions,
+        model=model_name,
+        temperature=temperature,
+        timeout=httpx.Timeout(30, read=read_timeout),  # type: ignore
+        store=False,
+        **model_kwargs,
+    )
+    return to_responses_response(messages, model_name, temperature, model_response, tracer)
+
+
 @retry(
     retry=(
         retry_if_exception_type(openai._exceptions.APITimeoutError)
@@ -1107,18 +1305,15 @@ async def ain_stream_thought_processor(
     # Modes and transitions: detect_start > thought (optional) > message
     mode = "detect_start"
 
+    content_chunk = None
     async for chunk in astream_thought_processor(chat_stream):
-        if len(chunk.choices) == 0:
-            continue
-        if mode == "message":
-            # Message mode is terminal, so just yield chunks, no processing
+        if len(chunk.choices) == 0 or mode == "message" or chunk.choices[0].delta.content is None:
+            # Message mode is terminal, so just yield chunks, no processing.
+            # Chunks without content, like usage, tool call or structured thought chunks, are also passed through.
             yield chunk
             continue
 
-        if chunk.choices[0].delta.content is None:
-            # If delta content is None, we can't process it, just yield the chunk
-            continue
-
+        content_chunk = chunk
         buf += chunk.choices[0].delta.content
 
         if mode == "detect_start":
@@ -1180,7 +1375,8 @@ async def ain_stream_thought_processor(
                 continue
 
     # End of stream handling
-    if buf:
+    if buf and content_chunk:
+        chunk = content_chunk
         if mode == "thought":  # Stream ended before </think> was found
             chunk.choices[0].delta.thought = buf
             chunk.choices[0].delta.content = ""
@@ -649,7 +649,8 @@ Use the help of the provided tool AIs to accomplish the task assigned to you.
 {personality_context}
 
 # Instructions
-- Make detailed, self-contained requests to the tool AIs, one tool AI at a time, to gather information, perform actions etc.
+- Make detailed, self-contained requests to the tool AIs to gather information, perform actions etc.
+- Call multiple tool AIs in the same iteration when their requests are independent of each other. E.g search documents and search online at the same time. They will be run in parallel.
 - Break down your research process into independent, self-contained steps that can be executed sequentially using the available tool AIs to accomplish the user assigned task.
 - Ensure that all required context is passed to the tool AIs for successful execution. Include any relevant stuff that has previously been attempted. They only know the context provided in your query.
 - Think step by step to come up with creative strategies when the previous iteration did not yield useful results.
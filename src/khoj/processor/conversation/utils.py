@@ -1,14 +1,18 @@
 import base64
+import hashlib
 import json
 import logging
 import mimetypes
 import os
 import re
+import threading
 import uuid
+from bisect import bisect_left
 from dataclasses import dataclass
 from datetime import datetime
 from enum import Enum
 from io import BytesIO
+from itertools import accumulate
 from typing import Any, Callable, Dict, List, Literal, Optional, Tuple, Union
 
 import PIL.Image
@@ -34,6 +38,7 @@ from khoj.search_filter.file_filter import FileFilter
 from khoj.search_filter.word_filter import WordFilter
 from khoj.utils import state
 from khoj.utils.helpers import (
+    LRU,
     ConversationCommand,
     is_none_or_empty,
     is_promptrace_enabled,
@@ -191,6 +196,24 @@ def construct_iteration_history(
                 )
             )
             continue
+        tool_result = {
+            "type": "tool_result",
+            "id": iteration.query.id,
+            "name": iteration.query.name,
+            "content": iteration.summarizedResult,
+        }
+        # Tool calls requested in the same model response share its raw response.
+        # Add their results to the same tool result message that follows this model response.
+        previous_iteration = iteration_history[-2] if len(iteration_history) >= 2 else None
+        if (
+            iteration.raw_response
+            and previous_iteration
+            and previous_iteration.intent
+            and previous_iteration.intent.type == "tool_call"
+            and previous_iteration.message == iteration.raw_response
+        ):
+            iteration_history[-1].message.append(tool_result)
+            continue
         iteration_history += [
             ChatMessageModel(
                 by="khoj",
@@ -200,14 +223,7 @@ def construct_iteration_history(
             ChatMessageModel(
                 by="you",
                 intent=Intent(type="tool_result"),
-                message=[
-                    {
-                        "type": "tool_result",
-                        "id": iteration.query.id,
-                        "name": iteration.query.name,
-                        "content": iteration.summarizedResult,
-                    }
-                ],
+                message=[tool_result],
             ),
         ]
 
@@ -748,6 +764,27 @@ def get_encoder(
     return encoder
 
 
+# Token counts of recently seen message content, keyed by tokenizer and content hash.
+# Avoids re-tokenizing chat history, references on every chat turn
+token_count_cache = LRU(capacity=int(os.getenv("KHOJ_TOKEN_COUNT_CACHE_SIZE", 10000)))
+token_count_cache_lock = threading.Lock()
+
+
+def count_text_tokens(text: str, encoder) -> int:
+    """Count tokens in text. Reuse token count of previously seen text for encoders with a stable name"""
+    encoder_name = getattr(encoder, "name", None) or getattr(encoder, "name_or_path", None)
+    if not encoder_name:
+        return len(encoder.encode(text))
+    cache_key = (encoder_name, hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest())
+    with token_count_cache_lock:
+        if cache_key in token_count_cache:
+            return token_count_cache[cache_key]
+    token_count = len(encoder.encode(text))
+    with token_count_cache_lock:
+        token_count_cache[cache_key] = token_count
+    return token_count
+
+
 def count_tokens(
     message_content: str | list[str | dict],
     encoder: PreTrainedTokenizer | PreTrainedTokenizerFast | tiktoken.Encoding,
@@ -782,11 +819,11 @@ def count_tokens(
             else:
                 logger.warning(f"Unknown message type: {part}. Skipping.")
         message_content = "\n".join(message_content_parts).rstrip()
-        return len(encoder.encode(message_content)) + image_count * 500
+        return count_text_tokens(message_content, encoder) + image_count * 500
     elif isinstance(message_content, str):
-        return len(encoder.encode(message_content))
+        return count_text_tokens(message_content, encoder)
     else:
-        return len(encoder.encode(json.dumps(message_content)))
+        return count_text_tokens(json.dumps(message_content), encoder)
 
 
 def count_total_tokens(messages: list[ChatMessage], encoder, system_message: Optional[ChatMessage]) -> Tuple[int, int]:
@@ -800,6 +837,66 @@ def count_total_tokens(messages: list[ChatMessage], encoder, system_message: Opt
     return total_tokens, system_message_tokens
 
 
+def can_drop_message_part(messages: list[ChatMessage]) -> bool:
+    return len(messages) > 1 or len(messages[0].content) > 1
+
+
+def drop_oldest_message_parts(messages: list[ChatMessage], encoder, max_tokens: int) -> int:
+    """
+    Drop oldest messages and content parts in place until messages fit within max tokens.
+    Tokens of each message are counted once and updated incrementally as messages and content parts are dropped.
+    Returns approximate token count of the remaining messages.
+    """
+    # Reserves 4 tokens to demarcate each message (e.g <|im_start|>user, <|im_end|>, <|endoftext|> etc.)
+    message_tokens = [count_tokens(message.content, encoder) + 4 for message in messages]
+
+    # Find the oldest message from which messages fit within max tokens by binary search over suffix token counts
+    suffix_tokens = list(accumulate(reversed(message_tokens)))[::-1]
+    first_fitting_message = bisect_left(range(len(messages)), True, key=lambda idx: suffix_tokens[idx] <= max_tokens)
+    # Drop all messages before the message that needs to be truncated, but keep at least the last message
+    drop_count = min(max(first_fitting_message - 1, 0), len(messages) - 1)
+    # Drop tool result pair of tool call, if tool call message is removed
+    if (
+        0 < drop_count < len(messages) - 1
+        and messages[drop_count - 1].additional_kwargs.get("message_type") == "tool_call"
+        and messages[drop_count].additional_kwargs.get("message_type") == "tool_result"
+    ):
+        drop_count += 1
+    del messages[:drop_count]
+    del message_tokens[:drop_count]
+    total_tokens = sum(message_tokens)
+
+    part_tokens: Optional[List[int]] = None
+    while total_tokens > max_tokens and can_drop_message_part(messages):
+        # If the last message has more than one content part, pop the oldest content part.
+        # For tool calls, the whole message should dropped, assistant's tool call content being truncated annoys AI APIs.
+        if len(messages[0].content) > 1 and messages[0].additional_kwargs.get("message_type") != "tool_call":
+            # Count tokens of each content part of the oldest message once
+            if part_tokens is None:
+                part_tokens = [count_tokens([part], encoder) for part in messages[0].content]
+            # The oldest content part is earlier in content list. So pop from the front.
+            messages[0].content.pop(0)
+            dropped_tokens = part_tokens.pop(0)
+            message_tokens[0] -= dropped_tokens
+            total_tokens -= dropped_tokens
+        # Otherwise, pop the last message if it has only one content part or is a tool call.
+        else:
+            # The oldest message is the last one. So pop from the back.
+            dropped_message = messages.pop(0)
+            total_tokens -= message_tokens.pop(0)
+            part_tokens = None
+            # Drop tool result pair of tool call, if tool call message has been removed. Keep at least the last message
+            if (
+                dropped_message.additional_kwargs.get("message_type") == "tool_call"
+                and len(messages) > 1
+                and messages[0].additional_kwargs.get("message_type") == "tool_result"
+            ):
+                messages.pop(0)
+                total_tokens -= message_tokens.pop(0)
+
+    return total_tokens
+
+
 def truncate_messages(
     messages: list[ChatMessage],
     max_prompt_size: int,
@@ -823,29 +920,12 @@ def truncate_messages(
 
     # Drop older messages until under max supported prompt size by model
     total_tokens, system_message_tokens = count_total_tokens(messages, encoder, system_message)
-
-    while total_tokens > max_prompt_size and (len(messages) > 1 or len(messages[0].content) > 1):
-        # If the last message has more than one content part, pop the oldest content part.
-        # For tool calls, the whole message should dropped, assistant's tool call content being truncated annoys AI APIs.
-        if len(messages[0].content) > 1 and messages[0].additional_kwargs.get("message_type") != "tool_call":
-            # The oldest content part is earlier in content list. So pop from the front.
-            messages[0].content.pop(0)
-        # Otherwise, pop the last message if it has only one content part or is a tool call.
-        else:
-            # The oldest message is the last one. So pop from the back.
-            dropped_message = messages.pop(0)
-            # Drop tool result pair of tool call, if tool call message has been removed
-            if (
-                dropped_message.additional_kwargs.get("message_type") == "tool_call"
-                and messages
-                and messages[0].additional_kwargs.get("message_type") == "tool_result"
-            ):
-                messages.pop(0)
-
+    while total_tokens > max_prompt_size and can_drop_message_part(messages):
+        total_tokens = drop_oldest_message_parts(messages, encoder, max_prompt_size - system_message_tokens)
+        # Recount tokens as counting content parts separately only approximates the token count of the message
         total_tokens, _ = count_total_tokens(messages, encoder, system_message)
 
     # Truncate current message if still over max supported prompt size by model
-    total_tokens, _ = count_total_tokens(messages, encoder, system_message)
     if total_tokens > max_prompt_size:
         # At this point, a single message with a single content part of type dict should remain
         assert len(messages) == 1 and len(messages[0].content) == 1 and isinstance(messages[0].content[0], dict), (
@@ -1,7 +1,15 @@
+import asyncio
+import hashlib
+import json
 import logging
-from typing import List
+import os
+import threading
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
 
 import requests
+import torch
 import tqdm
 from sentence_transformers import CrossEncoder, SentenceTransformer
 from tenacity import (
@@ -14,6 +22,7 @@ from tenacity import (
 from torch import nn
 
 from khoj.database.models import SearchModelConfig
+from khoj.utils.cache import QueryEmbeddingsCache
 from khoj.utils.helpers import (
     fix_json_dict,
     get_device,
@@ -26,6 +35,129 @@ from khoj.utils.rawconfig import SearchResponse
 logger = logging.getLogger(__name__)
 
 
+@dataclass
+class PendingBatch:
+    requests: List[Tuple[List[Any], asyncio.Future]] = field(default_factory=list)
+    size: int = 0
+    flush_handle: Optional[asyncio.TimerHandle] = None
+
+
+class MicroBatcher:
+    """
+    Coalesce concurrent inference requests into batches.
+
+    Requests arriving within the batch window, up to the max batch size, are run through the model in a single call.
+    The results are then fanned back out to each caller.
+    """
+
+    def __init__(
+        self,
+        process_batch: Callable[[List[Any]], Sequence[Any]],
+        name: str,
+        max_batch_size: int = None,
+        batch_window: float = None,
+    ):
+        self.process_batch = process_batch
+        self.name = name
+        self.max_batch_size = max_batch_size or int(os.getenv("KHOJ_INFERENCE_MAX_BATCH_SIZE", 64))
+        if batch_window is None:
+            batch_window = float(os.getenv("KHOJ_INFERENCE_BATCH_WINDOW_MS", 5)) / 1000
+        self.batch_window = batch_window
+        self.pending_batches: Dict[asyncio.AbstractEventLoop, PendingBatch] = {}
+        self.running_tasks: set[asyncio.Task] = set()
+        self.num_requests = 0
+        self.num_batches = 0
+        self.num_items = 0
+        self.max_items_in_batch = 0
+
+    @property
+    def enabled(self) -> bool:
+        return self.batch_window > 0 and self.max_batch_size > 1
+
+    async def submit(self, items: List[Any]) -> List[Any]:
+        "Queue items for inference in the next batch. Return their results once the batch is processed"
+        if not items:
+            return []
+        if not self.enabled:
+            return list(await asyncio.to_thread(self.process_batch, items))
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        batch = self.pending_batches.setdefault(loop, PendingBatch())
+        batch.requests.append((items, future))
+        batch.size += len(items)
+        if batch.size >= self.max_batch_size:
+            self.flush(loop)
+        elif batch.flush_handle is None:
+            batch.flush_handle = loop.call_later(self.batch_window, self.flush, loop)
+        return await future
+
+    def flush(self, loop: asyncio.AbstractEventLoop):
+        "Start processing the pending batch of the event loop"
+        batch = self.pending_batches.pop(loop, None)
+        if batch is None:
+            return
+        if batch.flush_handle is not None:
+            batch.flush_handle.cancel()
+        task = loop.create_task(self.run_batch(batch))
+        self.running_tasks.add(task)
+        task.add_done_callback(self.running_tasks.discard)
+
+    async def run_batch(self, batch: PendingBatch):
+        items = [item for request_items, _ in batch.requests for item in request_items]
+        self.num_requests += len(batch.requests)
+        self.num_batches += 1
+        self.num_items += len(items)
+        self.max_items_in_batch = max(self.max_items_in_batch, len(items))
+        logger.debug(f"Running {self.name} on batch of {len(items)} items from {len(batch.requests)} requests")
+
+        try:
+            results = await asyncio.to_thread(self.process_batch, items)
+        except Exception as e:
+            for _, future in batch.requests:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        # Fan out results to each request in the batch
+        offset = 0
+        for request_items, future in batch.requests:
+            if not future.done():
+                future.set_result(list(results[offset : offset + len(request_items)]))
+            offset += len(request_items)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "requests": self.num_requests,
+            "batches": self.num_batches,
+            "items": self.num_items,
+            "max_batch_size": self.max_items_in_batch,
+            "avg_batch_size": self.num_items / self.num_batches if self.num_batches else 0.0,
+            "avg_requests_per_batch": self.num_requests / self.num_batches if self.num_batches else 0.0,
+        }
+
+
+def set_inference_threads(num_threads: Optional[int]):
+    "Set number of CPU threads to run local models with. It applies to the whole process"
+    if num_threads and num_threads > 0 and torch.get_num_threads() != num_threads:
+        logger.info(f"Running local model inference with {num_threads} CPU threads")
+        torch.set_num_threads(num_threads)
+
+
+def quantize_to_int8(model: nn.Module) -> nn.Module:
+    "Dynamically quantize weights of linear layers in model to int8. Speeds up inference on CPU"
+    return torch.ao.quantization.quantize_dynamic(model, {nn.Linear}, dtype=torch.qint8, inplace=True)
+
+
+def get_inference_device(inference_backend: str, requested_device: Optional[str]) -> str | torch.device:
+    "Get device to load local model on. Use requested device, else best available. Quantized int8 models only run on CPU"
+    if inference_backend != SearchModelConfig.InferenceBackend.INT8:
+        return requested_device if requested_device is not None else get_device()
+    if requested_device is not None and torch.device(requested_device).type != "cpu":
+        logger.warning(f"Int8 inference backend only runs on CPU. Loading model on CPU instead of {requested_device}.")
+    return "cpu"
+
+
 class EmbeddingsModel:
     def __init__(
         self,
@@ -36,6 +168,8 @@ class EmbeddingsModel:
         query_encode_kwargs: dict = {},
         docs_encode_kwargs: dict = {},
         model_kwargs: dict = {},
+        inference_backend: str = SearchModelConfig.InferenceBackend.TORCH,
+        inference_threads: int = None,
     ):
         default_query_encode_kwargs = {"show_progress_bar": False, "normalize_embeddings": True}
         default_docs_encode_kwargs = {"show_progress_bar": True, "normalize_embeddings": True}
@@ -46,16 +180,96 @@ class EmbeddingsModel:
         self.inference_endpoint = embeddings_inference_endpoint
         self.api_key = embeddings_inference_endpoint_api_key
         self.inference_endpoint_type = embeddings_inference_endpoint_type
+        self.inference_backend = inference_backend
+        # Serialize local model inference across indexing and search threads, to not oversubscribe CPU threads
+        self.inference_lock = threading.Lock()
         if self.inference_endpoint_type == SearchModelConfig.ApiType.LOCAL:
+            set_inference_threads(inference_threads)
+            self.model_kwargs["device"] = get_inference_device(
+                self.inference_backend, fix_json_dict(model_kwargs).get("device")
+            )
             with timer(f"Loaded embedding model {self.model_name}", logger):
                 self.embeddings_model = SentenceTransformer(self.model_name, **self.model_kwargs)
+                if self.inference_backend == SearchModelConfig.InferenceBackend.INT8:
+                    self.embeddings_model = quantize_to_int8(self.embeddings_model)
+        self.query_cache = QueryEmbeddingsCache(
+            capacity=int(os.getenv("KHOJ_QUERY_EMBEDDINGS_CACHE_SIZE", 10000)),
+            cache_file=self.get_query_cache_file(),
+        )
+        self.query_batcher = MicroBatcher(self.embed_queries, name=f"embeddings model {self.model_name}")
+
+    def get_query_cache_file(self) -> Path | None:
+        "Get file to persist query embeddings to, if configured. It is unique to the model and query encoding config"
+        cache_dir = os.getenv("KHOJ_QUERY_EMBEDDINGS_CACHE_DIR")
+        if not cache_dir:
+            return None
+        model_config = json.dumps(
+            [
+                self.model_name,
+                self.inference_endpoint,
+                self.inference_endpoint_type,
+                self.inference_backend,
+                self.query_encode_kwargs,
+            ],
+            sort_keys=True,
+            default=str,
+        )
+        model_hash = hashlib.md5(model_config.encode("utf-8")).hexdigest()
+        return Path(cache_dir).expanduser() / f"query_embeddings_{model_hash}.npz"
+
+    def stats(self) -> Dict[str, Any]:
+        return {"query_batching": self.query_batcher.stats(), "query_cache": self.query_cache.stats()}
 
     def embed_query(self, query):
+        return self.embed_queries([query])[0]
+
+    async def aembed_queries(self, queries: List[str]):
+        "Encode queries in a batch with the queries of other concurrent requests"
+        return await self.query_batcher.submit(queries)
+
+    def embed_queries(self, queries: List[str]):
+        "Encode multiple queries in a single batch. Reuse cached embeddings of previously seen queries"
+        if not queries:
+            return []
+        if not self.query_cache.enabled:
+            return self.encode_queries(queries)
+
+        cached_embeddings = self.query_cache.get_many(queries)
+        uncached_queries = list(dict.fromkeys(query for query in queries if query not in cached_embeddings))
+        if uncached_queries:
+            new_embeddings = dict(zip(uncached_queries, self.encode_queries(uncached_queries)))
+            self.query_cache.set_many(new_embeddings)
+            cached_embeddings.update(new_embeddings)
+        return [cached_embeddings[query] for query in queries]
+
+    def encode_queries(self, queries: List[str]):
         if self.inference_endpoint_type == SearchModelConfig.ApiType.HUGGINGFACE:
-            return self.embed_with_hf([query])[0]
+            return self.embed_with_hf(queries)
         elif self.inference_endpoint_type == SearchModelConfig.ApiType.OPENAI:
-            return self.embed_with_openai([query])[0]
-        return self.embeddings_model.encode([query], **self.query_encode_kwargs)[0]
+            return self.embed_with_openai(queries)
+        return self.encode_locally(queries, self.query_encode_kwargs)
+
+    def encode_locally(self, texts: List[str], encode_kwargs: dict):
+        "Encode texts with the local model. Run one inference at a time"
+        with self.inference_lock:
+            return self.embeddings_model.encode(texts, **encode_kwargs)
+
+    def encode_documents_locally(self, docs: List[str]) -> List[List[float]]:
+        """
+        Encode documents with the local model in batches of the query batcher's max batch size.
+        So concurrent search queries and other indexing threads only wait for a batch, not for all documents.
+        """
+        if not docs:
+            return []
+        batch_size = self.query_batcher.max_batch_size
+        encode_kwargs = {**self.docs_encode_kwargs, "show_progress_bar": False}
+        embeddings = []
+        progress_bar = self.docs_encode_kwargs.get("show_progress_bar") and len(docs) > batch_size
+        with tqdm.tqdm(total=len(docs), disable=not progress_bar) as pbar:
+            for i in range(0, len(docs), batch_size):
+                embeddings += self.encode_locally(docs[i : i + batch_size], encode_kwargs).tolist()
+                pbar.update(len(docs[i : i + batch_size]))
+        return embeddings
 
     @retry(
         retry=retry_if_exception_type(requests.exceptions.HTTPError),
@@ -93,7 +307,7 @@ class EmbeddingsModel:
 
     def embed_documents(self, docs):
         if self.inference_endpoint_type == SearchModelConfig.ApiType.LOCAL:
-            return self.embeddings_model.encode(docs, **self.docs_encode_kwargs).tolist() if docs else []
+            return self.encode_documents_locally(docs)
         elif self.inference_endpoint_type == SearchModelConfig.ApiType.HUGGINGFACE:
             embed_with_api = self.embed_with_hf
         elif self.inference_endpoint_type == SearchModelConfig.ApiType.OPENAI:
@@ -102,7 +316,7 @@ class EmbeddingsModel:
             logger.warning(
                 f"Unsupported inference endpoint: {self.inference_endpoint_type}. Generating embeddings locally instead."
             )
-            return self.embeddings_model.encode(docs, **self.docs_encode_kwargs).tolist()
+            return self.encode_documents_locally(docs)
         # break up the docs payload in chunks of 1000 to avoid hitting rate limits
         embeddings = []
         with tqdm.tqdm(total=len(docs)) as pbar:
@@ -121,26 +335,64 @@ class CrossEncoderModel:
         cross_encoder_inference_endpoint: str = None,
         cross_encoder_inference_endpoint_api_key: str = None,
         model_kwargs: dict = {},
+        inference_backend: str = SearchModelConfig.InferenceBackend.TORCH,
+        inference_threads: int = None,
     ):
         self.model_name = model_name
         self.inference_endpoint = cross_encoder_inference_endpoint
         self.api_key = cross_encoder_inference_endpoint_api_key
+        self.inference_backend = inference_backend
         self.model_kwargs = merge_dicts(model_kwargs, {"device": get_device()})
+        self.model_kwargs["device"] = get_inference_device(self.inference_backend, model_kwargs.get("device"))
+        set_inference_threads(inference_threads)
         with timer(f"Loaded cross-encoder model {self.model_name}", logger):
             self.cross_encoder_model = CrossEncoder(model_name=self.model_name, **self.model_kwargs)
+            if self.inference_backend == SearchModelConfig.InferenceBackend.INT8:
+                self.cross_encoder_model.model = quantize_to_int8(self.cross_encoder_model.model)
+        self.batcher = MicroBatcher(self.score_pairs, name=f"cross-encoder model {self.model_name}")
 
     def inference_server_enabled(self) -> bool:
         return self.api_key is not None and self.inference_endpoint is not None
 
-    def predict(self, query, hits: List[SearchResponse], key: str = "compiled"):
+    def stats(self) -> Dict[str, Any]:
+        return {"batching": self.batcher.stats()}
+
+    def predict(self, query: str | List[str], hits: List[SearchResponse], key: str = "compiled"):
+        """
+        Score relevance of each hit to the query.
+        Pass a list of queries, one per hit, to score hits retrieved for different queries in a single batch.
+        """
+        return self.score_pairs(self.to_pairs(query, hits, key))
+
+    async def apredict(self, query: str | List[str], hits: List[SearchResponse], key: str = "compiled"):
+        "Score relevance of each hit to the query in a batch with the hits of other concurrent requests"
+        return await self.batcher.submit(self.to_pairs(query, hits, key))
+
+    @staticmethod
+    def to_pairs(query: str | List[str], hits: List[SearchResponse], key: str = "compiled") -> List[Tuple[str, str]]:
+        queries = query if isinstance(query, list) else [query] * len(hits)
+        return [(hit_query, hit.additional[key]) for hit_query, hit in zip(queries, hits)]
+
+    def score_pairs(self, pairs: List[Tuple[str, str]]):
+        "Score relevance of each passage to its query"
         if self.inference_server_enabled() and "huggingface" in self.inference_endpoint:
-            target_url = f"{self.inference_endpoint}"
-            payload = {"inputs": {"query": query, "passages": [hit.additional[key] for hit in hits]}}
-            headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
-            response = requests.post(target_url, json=payload, headers=headers)
-            response.raise_for_status()
-            return response.json()["scores"]
+            # Inference endpoint scores passages against a single query. So score passages of each query separately
+            scores = [0.0] * len(pairs)
+            for unique_query in dict.fromkeys(query for query, _ in pairs):
+                pair_indices = [idx for idx, (query, _) in enumerate(pairs) if query == unique_query]
+                passages = [pairs[idx][1] for idx in pair_indices]
+                for idx, score in zip(pair_indices, self.predict_with_hf(unique_query, passages)):
+                    scores[idx] = score
+            return scores
 
-        cross_inp = [[query, hit.additional[key]] for hit in hits]
+        cross_inp = [[query, passage] for query, passage in pairs]
         cross_scores = self.cross_encoder_model.predict(cross_inp, activation_fct=nn.Sigmoid())
         return cross_scores
+
+    def predict_with_hf(self, query: str, passages: List[str]):
+        target_url = f"{self.inference_endpoint}"
+        payload = {"inputs": {"query": query, "passages": passages}}
+        headers = {"Authorization": f"Bearer {self.api_key}", "Content-Type": "application/json"}
+        response = requests.post(target_url, json=payload, headers=headers)
+        response.raise_for_status()
+        return response.json()["scores"]
@@ -6,7 +6,7 @@ import time
 import uuid
 from dataclasses import dataclass
 from datetime import datetime
-from functools import partial
+from functools import partial, wraps
 from typing import Any, Dict, List, Optional
 from urllib.parse import unquote
 
@@ -14,6 +14,7 @@ from fastapi import (
     APIRouter,
     Depends,
     HTTPException,
+    Query,
     Request,
     WebSocket,
     WebSocketDisconnect,
@@ -52,6 +53,7 @@ from khoj.processor.tools.online_search import (
 from khoj.processor.tools.run_code import run_code
 from khoj.routers.email import send_query_feedback
 from khoj.routers.helpers import (
+    SPECULATIVE_DOCUMENT_SEARCH,
     ApiImageRateLimiter,
     ApiUserRateLimiter,
     ChatEvent,
@@ -72,6 +74,7 @@ from khoj.routers.helpers import (
     is_ready_to_chat,
     read_chat_stream,
     search_documents,
+    speculative_search_documents,
     update_telemetry_state,
     validate_chat_model,
 )
@@ -230,13 +233,21 @@ def chat_history(
     common: CommonQueryParams,
     conversation_id: Optional[str] = None,
     n: Optional[int] = None,
+    before: Optional[str] = None,
+    after: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1),
+    exclude_fields: Optional[str] = None,
 ):
+    """
+    Get messages of the conversation. Page through long conversations with the before or after turn id and limit.
+    Pass a comma separated list of message fields, e.g context,onlineContext,researchContext, to exclude from messages.
+    """
     user = request.user.object
     validate_chat_model(user)
 
-    # Load Conversation History
+    # Load Conversation without its messages
     conversation = ConversationAdapters.get_conversation_by_user(
-        user=user, client_application=request.user.client_app, conversation_id=conversation_id
+        user=user, client_application=request.user.client_app, conversation_id=conversation_id, load_messages=False
     )
 
     if conversation is None:
@@ -260,23 +271,24 @@ def chat_history(
                 "is_hidden": conversation.agent.is_hidden,
             }
 
-    meta_log = conversation.conversation_log
-    meta_log.update(
-        {
-            "conversation_id": conversation.id,
-            "slug": conversation.title if conversation.title else conversation.slug,
-            "agent": agent_metadata,
-            "is_owner": conversation.user == user,
-        }
+    # Load requested window of conversation history.
+    # Latest N messages if N > 0. Else all messages except latest N
+    messages, has_more = ConversationAdapters.get_conversation_messages(
+        conversation,
+        before=before,
+        after=after,
+        limit=limit,
+        n=n,
+        exclude_fields=[field.strip() for field in exclude_fields.split(",")] if exclude_fields else None,
     )
-
-    if n:
-        # Get latest N messages if N > 0
-        if n > 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][-n:]
-        # Else return all messages except latest N
-        elif n < 0 and meta_log.get("chat"):
-            meta_log["chat"] = meta_log["chat"][:n]
+    meta_log = {
+        "chat": messages,
+        "has_more": has_more,
+        "conversation_id": conversation.id,
+        "slug": conversation.title if conversation.title else conversation.slug,
+        "agent": agent_metadata,
+        "is_owner": conversation.user == user,
+    }
 
     update_telemetry_state(
         request=request,
@@ -644,7 +656,7 @@ async def generate_chat_title(
     new_title = await acreate_title_from_history(request.user.object, conversation=conversation)
     conversation.slug = clean_text_for_db(new_title[:200])
 
-    await conversation.asave()
+    await conversation.asave(update_fields=["slug", "updated_at"])
 
     return {"status": "ok", "title": new_title}
 
@@ -662,6 +674,26 @@ def delete_message(request: Request, delete_request: DeleteMessageRequestBody) -
         return Response(content=json.dumps({"status": "error", "message": "Message not found"}), status_code=404)
 
 
+def cancel_background_tasks_on_exit(func):
+    """Cancel background tasks the wrapped event stream registers once the stream ends, fails or is closed"""
+
+    @wraps(func)
+    async def wrapper(*args, **kwargs):
+        background_tasks: List[asyncio.Task] = []
+        event_stream = func(*args, background_tasks=background_tasks, **kwargs)
+        try:
+            async for event in event_stream:
+                yield event
+        finally:
+            for task in background_tasks:
+                if not task.done():
+                    task.cancel()
+            await event_stream.aclose()
+
+    return wrapper
+
+
+@cancel_background_tasks_on_exit
 async def event_generator(
     body: ChatRequestBody,
     user_scope: Any,
@@ -669,6 +701,7 @@ async def event_generator(
     headers: Headers,
     request_obj: Request | WebSocket,
     parent_interrupt_queue: asyncio.Queue = None,
+    background_tasks: List[asyncio.Task] = None,
 ):
     # Access the parameters from the body
     q = body.q
@@ -953,7 +986,7 @@ async def event_generator(
 
     if not conversation.agent:
         conversation.agent = default_agent
-        await conversation.asave()
+        await conversation.asave(update_fields=["agent", "updated_at"])
         agent = default_agent
 
     await is_ready_to_chat(user)
@@ -978,7 +1011,15 @@ async def event_generator(
         train_of_thought = [thought.model_dump() for thought in last_message.trainOfThought or []]
         logger.info(f"Loaded interrupted partial context from conversation {conversation_id}.")
 
+    speculative_search: Optional[asyncio.Task] = None
     if conversation_commands == [ConversationCommand.Default]:
+        # Speculatively search knowledge base with the user query while selecting tools to use.
+        # Only on the first turn, as follow-up queries need chat history to infer search queries.
+        if SPECULATIVE_DOCUMENT_SEARCH and not chat_history:
+            speculative_search = asyncio.create_task(
+                speculative_search_documents(q, (n or 7), d, user, conversation_id, agent=agent)
+            )
+            background_tasks.append(speculative_search)
         try:
             chosen_io = await aget_data_sources_and_output_format(
                 q,
@@ -999,6 +1040,11 @@ async def event_generator(
         if ConversationCommand.Research in conversation_commands:
             conversation_commands = [ConversationCommand.Research]
 
+        # Drop speculative search results if notes were not selected
+        if speculative_search and ConversationCommand.Notes not in conversation_commands:
+            speculative_search.cancel()
+            speculative_search = None
+
         conversation_commands_str = ", ".join([cmd.value for cmd in conversation_commands])
         async for result in send_event(ChatEvent.STATUS, f"**Selected Tools:** {conversation_commands_str}"):
             yield result
@@ -1041,7 +1087,7 @@ async def event_generator(
                         code_results.update(research_result.codeContext)
                     if research_result.context:
                         compiled_references.extend(research_result.context)
-                if not research_results or research_results[-1] is not research_result:
+                if not any(research_result is result for result in research_results):
                     research_results.append(research_result)
             else:
                 yield research_result
@@ -1068,35 +1114,48 @@ async def event_generator(
     # Gather Context
     ## Gather Document References
     if ConversationCommand.Notes in conversation_commands:
-        try:
-            async for result in search_documents(
-                q,
-                (n or 7),
-                d,
-                user,
-                chat_history,
-                conversation_id,
-                conversation_commands,
-                location,
-                partial(send_event, ChatEvent.STATUS),
-                query_images=uploaded_images,
-                agent=agent,
-                query_files=attached_file_context,
-                tracer=tracer,
-            ):
-                if isinstance(result, dict) and ChatEvent.STATUS in result:
-                    yield result[ChatEvent.STATUS]
-                else:
-                    compiled_references.extend(result[0])
-                    inferred_queries.extend(result[1])
-                    defiltered_query = result[2]
-        except Exception as e:
-            error_message = f"Error searching knowledge base: {e}. Attempting to respond without document references."
-            logger.error(error_message, exc_info=True)
-            async for result in send_event(
-                ChatEvent.STATUS, "Document search failed. I'll try respond without document references"
-            ):
-                yield result
+        # Use speculative search results, if any. Else infer search queries to search knowledge base.
+        speculative_references: List[Dict[str, str]] = []
+        if speculative_search:
+            try:
+                speculative_references = await speculative_search
+            except Exception as e:
+                logger.error(f"Error in speculative search of knowledge base: {e}", exc_info=True)
+        if speculative_references:
+            compiled_references.extend(speculative_references)
+            inferred_queries.append(defiltered_query)
+        else:
+            try:
+                async for result in search_documents(
+                    q,
+                    (n or 7),
+                    d,
+                    user,
+                    chat_history,
+                    conversation_id,
+                    conversation_commands,
+                    location,
+                    partial(send_event, ChatEvent.STATUS),
+                    query_images=uploaded_images,
+                    agent=agent,
+                    query_files=attached_file_context,
+                    tracer=tracer,
+                ):
+                    if isinstance(result, dict) and ChatEvent.STATUS in result:
+                        yield result[ChatEvent.STATUS]
+                    else:
+                        compiled_references.extend(result[0])
+                        inferred_queries.extend(result[1])
+                        defiltered_query = result[2]
+            except Exception as e:
+                error_message = (
+                    f"Error searching knowledge base: {e}. Attempting to respond without document references."
+                )
+                logger.error(error_message, exc_info=True)
+                async for result in send_event(
+                    ChatEvent.STATUS, "Document search failed. I'll try respond without document references"
+                ):
+                    yield result
 
         if not is_none_or_empty(compiled_references):
             distinct_headings = set([d.get("compiled").split("\n")[0] for d in compiled_references if "compiled" in d])
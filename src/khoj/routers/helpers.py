@@ -1,13 +1,16 @@
 import asyncio
 import base64
-import fnmatch
+import codecs
 import hashlib
 import json
 import logging
 import math
 import os
 import re
+import threading
 import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
 from random import random
 from typing import (
@@ -20,6 +23,7 @@ from typing import (
     Optional,
     Set,
     Tuple,
+    Type,
     Union,
 )
 from urllib.parse import parse_qs, quote, unquote, urljoin, urlparse
@@ -31,6 +35,7 @@ import requests
 from apscheduler.job import Job
 from apscheduler.triggers.cron import CronTrigger
 from asgiref.sync import sync_to_async
+from django.db import connections
 from django.utils import timezone as django_timezone
 from fastapi import Depends, Header, HTTPException, Request, UploadFile, WebSocket
 from langchain_core.messages.chat import ChatMessage
@@ -78,16 +83,20 @@ from khoj.processor.content.notion.notion_to_entries import NotionToEntries
 from khoj.processor.content.org_mode.org_to_entries import OrgToEntries
 from khoj.processor.content.pdf.pdf_to_entries import PdfToEntries
 from khoj.processor.content.plaintext.plaintext_to_entries import PlaintextToEntries
+from khoj.processor.content.text_to_entries import TextToEntries
 from khoj.processor.conversation import prompts
 from khoj.processor.conversation.anthropic.anthropic_chat import (
+    aanthropic_send_message_to_model,
     anthropic_send_message_to_model,
     converse_anthropic,
 )
 from khoj.processor.conversation.google.gemini_chat import (
+    agemini_send_message_to_model,
     converse_gemini,
     gemini_send_message_to_model,
 )
 from khoj.processor.conversation.openai.gpt import (
+    asend_message_to_model,
     converse_openai,
     send_message_to_model,
 )
@@ -112,12 +121,12 @@ from khoj.search_filter.word_filter import WordFilter
 from khoj.search_type import text_search
 from khoj.utils import state
 from khoj.utils.helpers import (
-    LRU,
     ConversationCommand,
     ImageShape,
     ToolDefinition,
     get_file_type,
     in_debug_mode,
+    is_env_var_true,
     is_none_or_empty,
     is_operator_enabled,
     is_valid_url,
@@ -143,6 +152,9 @@ NOTION_OAUTH_CLIENT_ID = os.getenv("NOTION_OAUTH_CLIENT_ID")
 NOTION_OAUTH_CLIENT_SECRET = os.getenv("NOTION_OAUTH_CLIENT_SECRET")
 NOTION_REDIRECT_URI = os.getenv("NOTION_REDIRECT_URI")
 
+# Search knowledge base with the user query while the chat model selects the tools to use
+SPECULATIVE_DOCUMENT_SEARCH = is_env_var_true("KHOJ_SPECULATIVE_DOCUMENT_SEARCH")
+
 
 def is_query_empty(query: str) -> bool:
     return is_none_or_empty(query.strip())
@@ -284,7 +296,7 @@ async def acreate_title_from_history(
     """
     Create a title from the given conversation history
     """
-    chat_history = construct_chat_history(conversation.messages)
+    chat_history = construct_chat_history(conversation.get_latest_messages(4))
 
     title_generation_prompt = prompts.conversation_title_generation.format(chat_history=chat_history)
 
@@ -301,7 +313,9 @@ async def acreate_title_from_query(query: str, user: KhojUser = None) -> str:
     title_generation_prompt = prompts.subject_generation.format(query=query)
 
     with timer("Chat actor: Generate title from query", logger):
-        response = await send_message_to_model_wrapper(title_generation_prompt, fast_model=True, user=user)
+        response = await send_message_to_model_wrapper(
+            title_generation_prompt, fast_model=True, cache_response=True, user=user
+        )
 
     return response.text.strip()
 
@@ -500,6 +514,7 @@ async def infer_webpage_urls(
             response_schema=WebpageUrls,
             fast_model=False,
             agent_chat_model=agent_chat_model,
+            cache_response=True,
             user=user,
             tracer=tracer,
         )
@@ -566,6 +581,7 @@ async def generate_online_subqueries(
             response_schema=OnlineQueries,
             fast_model=False,
             agent_chat_model=agent_chat_model,
+            cache_response=True,
             user=user,
             tracer=tracer,
         )
@@ -632,6 +648,7 @@ async def aschedule_query(
         query_images=query_images,
         response_type="json_object",
         fast_model=False,
+        cache_response=True,
         user=user,
         tracer=tracer,
     )
@@ -1168,7 +1185,7 @@ async def search_documents(
     location_data: LocationData = None,
     send_status_func: Optional[Callable] = None,
     query_images: Optional[List[str]] = None,
-    previous_inferred_queries: Set = set(),
+    previous_inferred_queries: Optional[Set] = None,
     agent: Agent = None,
     query_files: str = None,
     tracer: dict = {},
@@ -1226,44 +1243,90 @@ async def search_documents(
         )
 
     # Collate search results as context for the LLM
+    # Skip queries already searched. Record queries to search, so concurrent searches sharing the set skip them
+    if previous_inferred_queries is None:
+        previous_inferred_queries = set()
     inferred_queries = list(set(inferred_queries) - previous_inferred_queries)
+    previous_inferred_queries.update(inferred_queries)
     with timer("Searching knowledge base took", logger):
-        search_results = []
         logger.info(f"🔍 Searching knowledge base with queries: {inferred_queries}")
         if send_status_func:
             inferred_queries_str = "\n- " + "\n- ".join(inferred_queries)
             async for event in send_status_func(f"**Searching Documents for:** {inferred_queries_str}"):
                 yield {ChatEvent.STATUS: event}
-        for query in inferred_queries:
-            results = await execute_search(
-                user if not should_limit_to_agent_knowledge else None,
-                f"{query} {filters_in_query}",
-                n=n,
-                t=SearchType.All,
-                r=True,
-                max_distance=d,
-                dedupe=False,
-                agent=agent,
-            )
-            # Attach associated query to each search result
-            for item in results:
-                item.additional["query"] = query
-                search_results.append(item)
-
-        search_results = text_search.deduplicated_search_responses(search_results)
-        compiled_references = [
-            {
-                "query": item.additional["query"],
-                "compiled": item["entry"],
-                "file": item.additional["file"],
-                "uri": item.additional["uri"],
-            }
-            for item in search_results
-        ]
+        results_by_query = await execute_searches(
+            user if not should_limit_to_agent_knowledge else None,
+            [f"{query} {filters_in_query}" for query in inferred_queries],
+            n=n,
+            t=SearchType.All,
+            r=True,
+            max_distance=d,
+            dedupe=False,
+            agent=agent,
+        )
+        compiled_references = compile_search_results(inferred_queries, results_by_query)
 
     yield compiled_references, inferred_queries, defiltered_query
 
 
+async def speculative_search_documents(
+    q: str,
+    n: int,
+    d: float,
+    user: KhojUser,
+    conversation_id: str,
+    agent: Agent = None,
+) -> List[Dict[str, str]]:
+    """
+    Search knowledge base with the user query as is. Skips inferring search queries with the chat model.
+    Used to retrieve documents while the chat model selects the tools to use. Results are used if notes are selected.
+    """
+    agent_has_entries = await sync_to_async(EntryAdapters.agent_has_entries)(agent=agent) if agent else False
+    if not agent_has_entries and not await EntryAdapters.auser_has_entries(user):
+        return []
+
+    # Extract filter terms from user message
+    defiltered_query = defilter_query(q)
+    filters_in_query = q.replace(defiltered_query, "").strip()
+    conversation = await sync_to_async(ConversationAdapters.get_conversation_by_id)(conversation_id)
+    if conversation:
+        filters_in_query += " ".join([f' file:"{filter}"' for filter in conversation.file_filters])
+
+    with timer("Speculative search of knowledge base took", logger):
+        results_by_query = await execute_searches(
+            user,
+            [f"{defiltered_query} {filters_in_query}"],
+            n=n,
+            t=SearchType.All,
+            r=True,
+            max_distance=d,
+            dedupe=False,
+            agent=agent,
+        )
+    return compile_search_results([defiltered_query], results_by_query)
+
+
+def compile_search_results(queries: List[str], results_by_query: List[List[SearchResponse]]) -> List[Dict[str, str]]:
+    "Deduplicate search results of the queries and compile them into document references"
+    search_results = []
+    for query, results in zip(queries, results_by_query):
+        # Attach associated query to each search result
+        for item in results:
+            item.additional["query"] = query
+            search_results.append(item)
+
+    search_results = text_search.deduplicated_search_responses(search_results)
+    return [
+        {
+            "query": item.additional["query"],
+            "compiled": item["entry"],
+            "file": item.additional["file"],
+            "uri": item.additional["uri"],
+        }
+        for item in search_results
+    ]
+
+
 async def extract_questions(
     query: str,
     user: KhojUser,
@@ -1329,6 +1392,7 @@ async def extract_questions(
         response_schema=DocumentQueries,
         fast_model=False,
         agent_chat_model=agent_chat_model,
+        cache_response=True,
         user=user,
         tracer=tracer,
     )
@@ -1357,8 +1421,30 @@ async def execute_search(
     dedupe: Optional[bool] = True,
     agent: Optional[Agent] = None,
 ):
+    if q is None or q == "":
+        logger.warning("No query param (q) passed in API call to initiate search")
+        return []
+
+    results = await execute_searches(user, [q], n, t, r, max_distance, dedupe, agent)
+    return results[0]
+
+
+async def execute_searches(
+    user: KhojUser,
+    queries: List[str],
+    n: Optional[int] = 5,
+    t: Optional[SearchType] = None,
+    r: Optional[bool] = False,
+    max_distance: Optional[Union[float, None]] = None,
+    dedupe: Optional[bool] = True,
+    agent: Optional[Agent] = None,
+) -> List[List[SearchResponse]]:
+    """
+    Search knowledge base for each query.
+    Encode, retrieve and rerank results of all queries in a single batch each.
+    """
     # Run validation checks
-    results: List[SearchResponse] = []
+    results: List[List[SearchResponse]] = [[] for _ in queries]
 
     start_time = time.time()
 
@@ -1367,35 +1453,46 @@ async def execute_search(
         logger.error(f"Agent {agent.slug} is not accessible by user {user}")
         return results
 
-    if q is None or q == "":
-        logger.warning("No query param (q) passed in API call to initiate search")
-        return results
-
     # initialize variables
-    user_query = q.strip()
+    user_queries = [q.strip() for q in queries]
     results_count = n or 5
     t = t or state.SearchType.All
-    search_tasks = []
 
-    # return cached results, if available
+    # return cached results, if available. Agents have their own knowledge base, so cache their results separately
+    agent_slug = agent.slug if agent else None
+    query_cache_keys = [f"{user_query}-{n}-{t}-{r}-{max_distance}-{dedupe}-{agent_slug}" for user_query in user_queries]
+    cache_version, cached_results = None, {}
     if user:
-        query_cache_key = f"{user_query}-{n}-{t}-{r}-{max_distance}-{dedupe}"
-        if query_cache_key in state.query_cache[user.uuid]:
+        cache_version, cached_results = await sync_to_async(state.search_cache.get_many)(user.uuid, query_cache_keys)
+    uncached_query_indices = []
+    for idx, (user_query, query_cache_key) in enumerate(zip(user_queries, query_cache_keys)):
+        if is_none_or_empty(user_query):
+            continue
+        elif query_cache_key in cached_results:
             logger.debug("Return response from query cache")
-            return state.query_cache[user.uuid][query_cache_key]
+            results[idx] = cached_results[query_cache_key]
+        else:
+            uncached_query_indices.append(idx)
 
-    # Encode query with filter terms removed
-    defiltered_query = user_query
-    for filter in [DateFilter(), WordFilter(), FileFilter()]:
-        defiltered_query = filter.defilter(defiltered_query)
+    if not uncached_query_indices:
+        return results
+
+    # Encode queries with filter terms removed
+    defiltered_queries = []
+    for idx in uncached_query_indices:
+        defiltered_query = user_queries[idx]
+        for filter in [DateFilter(), WordFilter(), FileFilter()]:
+            defiltered_query = filter.defilter(defiltered_query)
+        defiltered_queries.append(defiltered_query)
 
-    encoded_asymmetric_query = None
+    encoded_asymmetric_queries = None
+    search_model = await sync_to_async(get_default_search_model)()
     if t.value != SearchType.Image.value:
-        with timer("Encoding query took", logger=logger):
-            search_model = await sync_to_async(get_default_search_model)()
-            encoded_asymmetric_query = state.embeddings_model[search_model.name].embed_query(defiltered_query)
+        with timer("Encoding queries took", logger=logger):
+            encoded_asymmetric_queries = await state.embeddings_model[search_model.name].aembed_queries(
+                defiltered_queries
+            )
 
-    # Use asyncio to run searches in parallel
     if t.value in [
         SearchType.All.value,
         SearchType.Org.value,
@@ -1405,37 +1502,35 @@ async def execute_search(
         SearchType.Plaintext.value,
         SearchType.Pdf.value,
     ]:
-        # query markdown notes
-        search_tasks.append(
-            text_search.query(
-                user_query,
+        # Query requested content types for all queries at once
+        with timer("Query took", logger):
+            hits_by_query = await text_search.query_batch(
+                [user_queries[idx] for idx in uncached_query_indices],
                 user,
                 t,
-                question_embedding=encoded_asymmetric_query,
+                question_embeddings=encoded_asymmetric_queries,
                 max_distance=max_distance,
                 agent=agent,
             )
-        )
 
-    # Query across each requested content types in parallel
-    with timer("Query took", logger):
-        if search_tasks:
-            hits_list = await asyncio.gather(*search_tasks)
-            for hits in hits_list:
-                # Collate results
-                results += text_search.collate_results(hits, dedupe=dedupe)
+            # Collate results
+            uncached_results = [list(text_search.collate_results(hits, dedupe=dedupe)) for hits in hits_by_query]
 
-                # Sort results across all content types and take top results
-                results = text_search.rerank_and_sort_results(
-                    results, query=defiltered_query, rank_results=r, search_model_name=search_model.name
-                )[:results_count]
+            # Rerank results of all queries together, then sort results of each query and take top results
+            uncached_results = await text_search.rerank_and_sort_results_batch(
+                uncached_results, queries=defiltered_queries, rank_results=r, search_model_name=search_model.name
+            )
+            for idx, query_results in zip(uncached_query_indices, uncached_results):
+                results[idx] = query_results[:results_count]
 
     # Cache results
     if user:
-        state.query_cache[user.uuid][query_cache_key] = results
+        await sync_to_async(state.search_cache.set_many)(
+            user.uuid, cache_version, {query_cache_keys[idx]: results[idx] for idx in uncached_query_indices}
+        )
 
     end_time = time.time()
-    logger.debug(f"🔍 Search took: {end_time - start_time:.3f} seconds")
+    logger.debug(f"🔍 Search for {len(uncached_query_indices)} queries took: {end_time - start_time:.3f} seconds")
 
     return results
 
@@ -1455,6 +1550,7 @@ async def send_message_to_model_wrapper(
     deepthought: bool = False,
     fast_model: Optional[bool] = None,
     agent_chat_model: ChatModel = None,
+    cache_response: bool = False,
     # User
     user: KhojUser = None,
     # Tracer
@@ -1493,8 +1589,24 @@ async def send_message_to_model_wrapper(
         vision_enabled=vision_available,
     )
 
+    # Return cached response to the same prompt, if available
+    cache_key = None
+    if cache_response and not tools:
+        cache_key = state.llm_response_cache.make_key(
+            user.uuid if user else None,
+            chat_model,
+            truncated_messages,
+            response_type=response_type,
+            response_schema=response_schema,
+            deepthought=deepthought,
+        )
+        cached_response = await sync_to_async(state.llm_response_cache.get)(cache_key)
+        if cached_response:
+            logger.debug(f"Return {chat_model_name} response from cache")
+            return ResponseWithThought(text=cached_response["text"], thought=cached_response["thought"])
+
     if model_type == ChatModel.ModelType.OPENAI:
-        return send_message_to_model(
+        response = await asend_message_to_model(
             messages=truncated_messages,
             api_key=api_key,
             model=chat_model_name,
@@ -1506,7 +1618,7 @@ async def send_message_to_model_wrapper(
             tracer=tracer,
         )
     elif model_type == ChatModel.ModelType.ANTHROPIC:
-        return anthropic_send_message_to_model(
+        response = await aanthropic_send_message_to_model(
             messages=truncated_messages,
             api_key=api_key,
             model=chat_model_name,
@@ -1518,7 +1630,7 @@ async def send_message_to_model_wrapper(
             tracer=tracer,
         )
     elif model_type == ChatModel.ModelType.GOOGLE:
-        return gemini_send_message_to_model(
+        response = await agemini_send_message_to_model(
             messages=truncated_messages,
             api_key=api_key,
             model=chat_model_name,
@@ -1532,6 +1644,24 @@ async def send_message_to_model_wrapper(
     else:
         raise HTTPException(status_code=500, detail="Invalid conversation config")
 
+    if cache_key and is_cacheable_response(response, response_type):
+        await sync_to_async(state.llm_response_cache.set)(
+            cache_key, {"text": response.text, "thought": response.thought}
+        )
+    return response
+
+
+def is_cacheable_response(response: ResponseWithThought, response_type: str = "text") -> bool:
+    "Only cache non-empty responses. Json responses should also be valid json, so retries are not served bad responses"
+    if is_none_or_empty(response.text):
+        return False
+    if response_type == "json_object":
+        try:
+            pyjson5.loads(clean_json(response.text))
+        except Exception:
+            return False
+    return True
+
 
 def send_message_to_model_wrapper_sync(
     message: str,
@@ -2798,6 +2928,46 @@ def get_user_config(user: KhojUser, request: Request, is_detailed: bool = False)
     }
 
 
+content_type_executors: Dict[str, ThreadPoolExecutor] = {}
+content_type_executors_lock = threading.Lock()
+
+
+def get_content_type_executor(content_type: str) -> ThreadPoolExecutor:
+    "Get worker pool to index content type with. It bounds concurrent indexing of each content type across requests"
+    with content_type_executors_lock:
+        if content_type not in content_type_executors:
+            max_workers = int(os.getenv("KHOJ_INDEXING_WORKERS_PER_CONTENT_TYPE", 2))
+            content_type_executors[content_type] = ThreadPoolExecutor(
+                max_workers=max_workers, thread_name_prefix=f"index_{content_type}"
+            )
+        return content_type_executors[content_type]
+
+
+def setup_content_type(
+    content_type: str,
+    text_to_entries: Type[TextToEntries],
+    files: Optional[dict[str, str]],
+    regenerate: bool,
+    user: KhojUser,
+    config=None,
+) -> bool:
+    try:
+        # Extract Entries, Generate Embeddings
+        text_search.setup(text_to_entries, files, regenerate=regenerate, user=user, config=config)
+        return True
+    except Exception as e:
+        logger.error(f"🚨 Failed to setup {content_type}: {e}", exc_info=True)
+        return False
+
+
+def setup_content_type_in_worker(*args, **kwargs) -> bool:
+    try:
+        return setup_content_type(*args, **kwargs)
+    finally:
+        # Close database connections opened by worker thread
+        connections.close_all()
+
+
 def configure_content(
     user: KhojUser,
     files: Optional[dict[str, dict[str, str]]],
@@ -2824,151 +2994,73 @@ def configure_content(
         logger.warning(f"🚨 No files to process for {search_type} search.")
         return True
 
-    try:
-        # Initialize Org Notes Search
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Org.value) and files.get(
-            "org"
-        ):
-            logger.info("🦄 Setting up search for orgmode notes")
-            # Extract Entries, Generate Notes Embeddings
-            text_search.setup(
-                OrgToEntries,
-                files.get("org"),
-                regenerate=regenerate,
-                user=user,
-            )
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup org: {e}", exc_info=True)
-        success = False
+    def should_setup(content_type: state.SearchType) -> bool:
+        return search_type == state.SearchType.All.value or search_type == content_type.value
 
-    try:
-        # Initialize Markdown Search
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Markdown.value) and files.get(
-            "markdown"
-        ):
-            logger.info("💎 Setting up search for markdown notes")
-            # Extract Entries, Generate Markdown Embeddings
-            text_search.setup(
-                MarkdownToEntries,
-                files.get("markdown"),
-                regenerate=regenerate,
-                user=user,
-            )
+    # Collect content types to index with their indexer, files and config
+    content_types_to_setup: List[Tuple[str, Type[TextToEntries], Optional[dict[str, str]], Any]] = []
+    if should_setup(state.SearchType.Org) and files.get("org"):
+        logger.info("🦄 Setting up search for orgmode notes")
+        content_types_to_setup.append(("org", OrgToEntries, files.get("org"), None))
 
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup markdown: {e}", exc_info=True)
-        success = False
+    if should_setup(state.SearchType.Markdown) and files.get("markdown"):
+        logger.info("💎 Setting up search for markdown notes")
+        content_types_to_setup.append(("markdown", MarkdownToEntries, files.get("markdown"), None))
 
-    try:
-        # Initialize PDF Search
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Pdf.value) and files.get(
-            "pdf"
-        ):
-            logger.info("🖨️ Setting up search for pdf")
-            # Extract Entries, Generate PDF Embeddings
-            text_search.setup(
-                PdfToEntries,
-                files.get("pdf"),
-                regenerate=regenerate,
-                user=user,
-            )
+    if should_setup(state.SearchType.Pdf) and files.get("pdf"):
+        logger.info("🖨️ Setting up search for pdf")
+        content_types_to_setup.append(("PDF", PdfToEntries, files.get("pdf"), None))
 
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup PDF: {e}", exc_info=True)
-        success = False
-
-    try:
-        # Initialize Plaintext Search
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Plaintext.value) and files.get(
-            "plaintext"
-        ):
-            logger.info("📄 Setting up search for plaintext")
-            # Extract Entries, Generate Plaintext Embeddings
-            text_search.setup(
-                PlaintextToEntries,
-                files.get("plaintext"),
-                regenerate=regenerate,
-                user=user,
-            )
-
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup plaintext: {e}", exc_info=True)
-        success = False
+    if should_setup(state.SearchType.Plaintext) and files.get("plaintext"):
+        logger.info("📄 Setting up search for plaintext")
+        content_types_to_setup.append(("plaintext", PlaintextToEntries, files.get("plaintext"), None))
 
     try:
         # Run server side indexing of user Github docs if no client sent documents
-        if no_client_sent_documents:
+        if no_client_sent_documents and should_setup(state.SearchType.Github):
             github_config = GithubConfig.objects.filter(user=user).prefetch_related("githubrepoconfig").first()
-            if (
-                search_type == state.SearchType.All.value or search_type == state.SearchType.Github.value
-            ) and github_config is not None:
+            if github_config is not None:
                 logger.info("🐙 Setting up search for github")
-                # Extract Entries, Generate Github Embeddings
-                text_search.setup(
-                    GithubToEntries,
-                    None,
-                    regenerate=regenerate,
-                    user=user,
-                    config=github_config,
-                )
-
+                content_types_to_setup.append(("GitHub", GithubToEntries, None, github_config))
     except Exception as e:
         logger.error(f"🚨 Failed to setup GitHub: {e}", exc_info=True)
         success = False
 
     try:
         # Run server side indexing of user Notion docs if no client sent documents
-        if no_client_sent_documents:
-            # Initialize Notion Search
+        if no_client_sent_documents and should_setup(state.SearchType.Notion):
             notion_config = NotionConfig.objects.filter(user=user).first()
-            if (
-                search_type == state.SearchType.All.value or search_type == state.SearchType.Notion.value
-            ) and notion_config:
+            if notion_config:
                 logger.info("🔌 Setting up search for notion")
-                text_search.setup(
-                    NotionToEntries,
-                    None,
-                    regenerate=regenerate,
-                    user=user,
-                    config=notion_config,
-                )
-
+                content_types_to_setup.append(("Notion", NotionToEntries, None, notion_config))
     except Exception as e:
         logger.error(f"🚨 Failed to setup Notion: {e}", exc_info=True)
         success = False
 
-    try:
-        # Initialize Image Search
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Image.value) and files[
-            "image"
-        ]:
-            logger.info("🖼️ Setting up search for images")
-            # Extract Entries, Generate Image Embeddings
-            text_search.setup(
-                ImageToEntries,
-                files.get("image"),
-                regenerate=regenerate,
-                user=user,
+    if should_setup(state.SearchType.Image) and files.get("image"):
+        logger.info("🖼️ Setting up search for images")
+        content_types_to_setup.append(("images", ImageToEntries, files.get("image"), None))
+
+    if should_setup(state.SearchType.Docx) and files.get("docx"):
+        logger.info("📄 Setting up search for docx")
+        content_types_to_setup.append(("docx", DocxToEntries, files.get("docx"), None))
+
+    if len(content_types_to_setup) == 1:
+        content_type, text_to_entries, content_files, config = content_types_to_setup[0]
+        success = setup_content_type(content_type, text_to_entries, content_files, regenerate, user, config) and success
+    elif content_types_to_setup:
+        # Index content types concurrently, each in the worker pool of its content type
+        futures = [
+            get_content_type_executor(content_type).submit(
+                setup_content_type_in_worker, content_type, text_to_entries, content_files, regenerate, user, config
             )
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup images: {e}", exc_info=True)
-        success = False
-    try:
-        if (search_type == state.SearchType.All.value or search_type == state.SearchType.Docx.value) and files["docx"]:
-            logger.info("📄 Setting up search for docx")
-            text_search.setup(
-                DocxToEntries,
-                files.get("docx"),
-                regenerate=regenerate,
-                user=user,
-            )
-    except Exception as e:
-        logger.error(f"🚨 Failed to setup docx: {e}", exc_info=True)
-        success = False
+            for content_type, text_to_entries, content_files, config in content_types_to_setup
+        ]
+        success = all([future.result() for future in futures]) and success
 
     # Invalidate Query Cache
     if user:
-        state.query_cache[user.uuid] = LRU()
+        state.search_cache.invalidate(user.uuid)
 
     return success
 
@@ -2993,48 +3085,47 @@ async def view_file_content(
         query += f" (lines {start_line}-{end_line})"
 
     try:
-        # Get the file object from the database by name
-        file_objects = await FileObjectAdapters.aget_file_objects_by_name(user, path)
+        max_lines = 50
+        start_line = start_line or 1
 
-        if not file_objects:
-            error_msg = f"File '{path}' not found in user documents"
+        # Validate line range
+        if start_line < 1 or (end_line and (end_line < 1 or start_line > end_line)):
+            error_msg = f"Invalid line range: {start_line}-{end_line}"
             logger.warning(error_msg)
             yield [{"query": query, "file": path, "compiled": error_msg}]
             return
 
-        # Use the first file object if multiple exist
-        file_object = file_objects[0]
-        raw_text = file_object.raw_text
+        # Read only the requested lines of the file from the database, up to the max lines to show
+        last_line = min(end_line or start_line + max_lines - 1, start_line + max_lines - 1)
+        file_lines = await FileObjectAdapters.aget_file_object_lines(user, path, start_line, last_line)
 
-        # Apply line range filtering if specified
-        lines = raw_text.split("\n")
-        start_line = start_line or 1
-        end_line = end_line or len(lines)
+        if file_lines is None:
+            error_msg = f"File '{path}' not found in user documents"
+            logger.warning(error_msg)
+            yield [{"query": query, "file": path, "compiled": error_msg}]
+            return
 
-        # Validate line range
-        if start_line < 1 or end_line < 1 or start_line > end_line:
+        selected_text, line_count = file_lines
+        end_line = end_line or line_count
+
+        # Validate line range against the number of lines in the file
+        if start_line > end_line:
             error_msg = f"Invalid line range: {start_line}-{end_line}"
             logger.warning(error_msg)
             yield [{"query": query, "file": path, "compiled": error_msg}]
             return
-        if start_line > len(lines):
-            error_msg = f"Start line {start_line} exceeds total number of lines {len(lines)}"
+        if start_line > line_count:
+            error_msg = f"Start line {start_line} exceeds total number of lines {line_count}"
             logger.warning(error_msg)
             yield [{"query": query, "file": path, "compiled": error_msg}]
             return
 
-        # Convert from 1-based to 0-based indexing and ensure bounds
-        start_idx = max(0, start_line - 1)
-        end_idx = min(len(lines), end_line)
-
         # Limit to first 50 lines if more than 50 lines are requested
         truncation_message = ""
-        if end_idx - start_idx > 50:
+        if min(line_count, end_line) - start_line + 1 > max_lines:
             truncation_message = "\n\n[Truncated after 50 lines! Use narrower line range to view complete section.]"
-            end_idx = start_idx + 50
 
-        selected_lines = lines[start_idx:end_idx]
-        filtered_text = "\n".join(selected_lines) + truncation_message
+        filtered_text = selected_text + truncation_message
 
         # Format the result as a document reference
         document_results = [
@@ -3056,23 +3147,48 @@ async def view_file_content(
         yield [{"query": query, "file": path, "uri": path, "compiled": error_msg}]
 
 
+async def aiter_file_lines(user: KhojUser, file_object_id: int, text_size: int, chunk_size: int = None):
+    """
+    Stream lines of a file from the database in chunks of its UTF-8 encoded text.
+    Avoids loading the full text of large files into memory at once. Each chunk costs the same to read.
+    """
+    chunk_size = chunk_size or int(os.getenv("KHOJ_GREP_CHUNK_SIZE", 1024 * 1024))
+    # Decode characters split across chunks once their remaining bytes are read
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    partial_line = ""
+    for start in range(0, text_size, chunk_size):
+        chunk = await FileObjectAdapters.aget_file_object_text_bytes(user, file_object_id, start, chunk_size)
+        lines = (partial_line + decoder.decode(chunk)).split("\n")
+        # Carry the last, possibly incomplete, line over to the next chunk
+        partial_line = lines.pop()
+        for line in lines:
+            yield line
+    yield partial_line + decoder.decode(b"", final=True)
+
+
 async def grep_files(
     regex_pattern: str,
     path_prefix: Optional[str] = None,
     lines_before: Optional[int] = None,
     lines_after: Optional[int] = None,
     user: KhojUser = None,
+    max_results: int = 1000,
 ):
     """
     Search for a regex pattern in files with an optional path prefix and context lines.
+
+    Files to search are shortlisted in the database using the trigram index on file text.
+    The text of each shortlisted file is then streamed in chunks and matched line by line.
+    Stops searching once more than max_results lines have been found.
     """
 
     # Construct the query string based on provided parameters
-    def _generate_query(line_count, doc_count, path, pattern, lines_before, lines_after, max_results=1000):
-        query = f"**Found {line_count} matches for '{pattern}' in {doc_count} documents**"
+    def _generate_query(line_count, doc_count, path, pattern, lines_before, lines_after, truncated=False):
+        line_count_str = f"{line_count}+" if truncated else f"{line_count}"
+        query = f"**Found {line_count_str} matches for '{pattern}' in {doc_count} documents**"
         if path:
             query += f" in {path}"
-        if lines_before or lines_after or line_count > max_results:
+        if lines_before or lines_after or truncated:
             query += " Showing"
         if lines_before or lines_after:
             context_info = []
@@ -3081,7 +3197,7 @@ async def grep_files(
             if lines_after:
                 context_info.append(f"{lines_after} lines after")
             query += f" {' and '.join(context_info)}"
-        if line_count > max_results:
+        if truncated:
             if lines_before or lines_after:
                 query += " for"
             query += f" first {max_results} results"
@@ -3110,52 +3226,58 @@ async def grep_files(
         db_pattern = re.sub(r"^\^", "", db_pattern)  # Remove ^ at regex pattern start
         db_pattern = re.sub(r"\$$", "", db_pattern)  # Remove $ at regex pattern end
 
-        file_matches = await FileObjectAdapters.aget_file_objects_by_regex(user, db_pattern, path_prefix)
+        # Only fetch names of matching files. Their text is streamed in chunks below
+        file_matches = await FileObjectAdapters.aget_file_object_names_by_regex(user, db_pattern, path_prefix)
 
-        line_matches = []
+        show_context = lines_before > 0 or lines_after > 0
+        line_matches: List[str] = []
         line_matches_count = 0
-        for file_object in file_matches:
-            lines = file_object.raw_text.split("\n")
-            matched_line_numbers = []
-
-            # Find all matching line numbers first
-            for i, line in enumerate(lines, 1):
-                if regex.search(line):
-                    matched_line_numbers.append(i)
-            line_matches_count += len(matched_line_numbers)
-
-            # Build context for each match
-            for line_num in matched_line_numbers:
-                context_lines = []
-
-                # Calculate start and end indices for context (0-based)
-                start_idx = max(0, line_num - 1 - lines_before)
-                end_idx = min(len(lines), line_num + lines_after)
 
-                # Add context lines with line numbers
-                for idx in range(start_idx, end_idx):
-                    current_line_num = idx + 1
-                    line_content = lines[idx]
+        def add_match_block(block: List[str]):
+            # Add separator between matches if showing context
+            if show_context and line_matches:
+                line_matches.append("--")
+            line_matches.extend(block)
+
+        for file_id, file_name, text_size in file_matches:
+            # Recent lines to show as context before the next match
+            previous_lines: deque = deque(maxlen=lines_before)
+            # Match blocks waiting for context lines after their match, in match order
+            open_blocks: deque = deque()
+
+            line_num = 0
+            async for line in aiter_file_lines(user, file_id, text_size or 0):
+                line_num += 1
+                # Add current line as context to match blocks above it
+                for block in open_blocks:
+                    block[0].append(f"{file_name}-{line_num}-  {line}")
+                    block[1] -= 1
+                while open_blocks and open_blocks[0][1] == 0:
+                    add_match_block(open_blocks.popleft()[0])
 
-                    if current_line_num == line_num:
-                        # This is the matching line, mark it
-                        context_lines.append(f"{file_object.file_name}:{current_line_num}: {line_content}")
+                if regex.search(line):
+                    line_matches_count += 1
+                    block_lines = [f"{file_name}-{num}-  {text}" for num, text in previous_lines]
+                    block_lines.append(f"{file_name}:{line_num}: {line}")
+                    if lines_after > 0:
+                        open_blocks.append([block_lines, lines_after])
                     else:
-                        # This is a context line
-                        context_lines.append(f"{file_object.file_name}-{current_line_num}-  {line_content}")
-
-                # Add separator between matches if showing context
-                if lines_before > 0 or lines_after > 0:
-                    context_lines.append("--")
+                        add_match_block(block_lines)
 
-                line_matches.extend(context_lines)
+                if lines_before > 0:
+                    previous_lines.append((line_num, line))
+                # Stop searching once enough results found
+                if len(line_matches) > max_results:
+                    break
 
-        # Remove the last separator if it exists
-        if line_matches and line_matches[-1] == "--":
-            line_matches.pop()
+            # Add match blocks cut short by the end of the file
+            for block_lines, _ in open_blocks:
+                add_match_block(block_lines)
+            if len(line_matches) > max_results:
+                break
 
-        # Check if no results found
-        max_results = 1000
+        # Truncate matched lines list if too long
+        truncated = len(line_matches) > max_results
         query = _generate_query(
             line_matches_count,
             len(file_matches),
@@ -3163,16 +3285,17 @@ async def grep_files(
             regex_pattern,
             lines_before,
             lines_after,
-            max_results,
+            truncated,
         )
+
+        # Check if no results found
         if not line_matches:
             yield {"query": query, "file": path_prefix, "uri": path_prefix, "compiled": "No matches found."}
             return
 
-        # Truncate matched lines list if too long
-        if len(line_matches) > max_results:
+        if truncated:
             line_matches = line_matches[:max_results] + [
-                f"... {len(line_matches) - max_results} more results found. Use stricter regex or path to narrow down results."
+                "... more results found. Use stricter regex or path to narrow down results."
             ]
 
         yield {"query": query, "file": path_prefix, "uri": path_prefix, "compiled": "\n".join(line_matches)}
@@ -3209,26 +3332,18 @@ async def list_files(
         return query
 
     try:
-        # Get user files by path prefix when specified
+        # Get names of user files by path prefix and glob pattern, when specified
         path = path or ""
-        if path in ["", "/", ".", "./", "~", "~/"]:
-            file_objects = await FileObjectAdapters.aget_all_file_objects(user, limit=10000)
-        else:
-            file_objects = await FileObjectAdapters.aget_file_objects_by_path_prefix(user, path)
+        path_prefix = "" if path in ["", "/", ".", "./", "~", "~/"] else path
+        files = await FileObjectAdapters.aget_file_names_by_path(user, path_prefix, pattern)
 
-        if not file_objects:
+        if not files and not pattern:
             yield {"query": _generate_query(0, path, pattern), "file": path, "uri": path, "compiled": "No files found."}
             return
 
-        # Extract file names from file objects
-        files = [f.file_name for f in file_objects]
         # Convert to relative file path (similar to ls)
-        if path:
-            files = [f[len(path) :] for f in files]
-
-        # Apply glob pattern filtering if specified
-        if pattern:
-            files = [f for f in files if fnmatch.fnmatch(f, pattern)]
+        if path_prefix:
+            files = [f[len(path_prefix) :] for f in files]
 
         query = _generate_query(len(files), path, pattern)
         if not files:
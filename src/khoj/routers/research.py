@@ -3,7 +3,8 @@ import logging
 import os
 from copy import deepcopy
 from datetime import datetime
-from typing import Callable, Dict, List, Optional
+from functools import partial
+from typing import AsyncGenerator, Callable, Dict, List, Optional, Set
 
 import yaml
 
@@ -179,17 +180,14 @@ async def apick_next_tool(
         return
 
     try:
-        # Try parse the response as function call response to infer next tool to use.
-        # TODO: Handle multiple tool calls.
+        # Try parse the response as function call response to infer next tools to use.
         response_text = response.text
-        parsed_response = [ToolCall(**item) for item in load_complex_json(response_text)][0]
+        parsed_responses = [ToolCall(**item) for item in load_complex_json(response_text)]
+        if not parsed_responses:
+            raise ValueError("No tool calls found in response")
     except Exception:
         # Otherwise assume the model has decided to end the research run and respond to the user.
-        parsed_response = ToolCall(name=ConversationCommand.Text, args={"response": response_text}, id=None)
-
-    # If we have a valid response, extract the tool and query.
-    warning = None
-    logger.info(f"Response for determining relevant tools: {parsed_response.name}({parsed_response.args})")
+        parsed_responses = [ToolCall(name=ConversationCommand.Text, args={"response": response_text}, id=None)]
 
     # Detect selection of previously used query, tool combination.
     previous_tool_query_combinations = {
@@ -197,14 +195,116 @@ async def apick_next_tool(
         for i in previous_iterations
         if i.warning is None and isinstance(i.query, ToolCall)
     }
-    if (parsed_response.name, dict_to_tuple(parsed_response.args)) in previous_tool_query_combinations:
-        warning = f"Repeated tool, query combination detected. You've already called {parsed_response.name} with args: {parsed_response.args}. Try something different."
+    warnings: List[Optional[str]] = []
+    for parsed_response in parsed_responses:
+        # If we have a valid response, extract the tool and query.
+        logger.info(f"Response for determining relevant tools: {parsed_response.name}({parsed_response.args})")
+        tool_query_combination = (parsed_response.name, dict_to_tuple(parsed_response.args))
+        if tool_query_combination in previous_tool_query_combinations:
+            warnings.append(
+                f"Repeated tool, query combination detected. You've already called {parsed_response.name} with args: {parsed_response.args}. Try something different."
+            )
+        else:
+            warnings.append(None)
+            previous_tool_query_combinations.add(tool_query_combination)
+
     # Only send client status updates if we'll execute this iteration and model has thoughts to share.
-    elif send_status_func and not is_none_or_empty(response.thought):
+    if send_status_func and not is_none_or_empty(response.thought) and not all(warnings):
         async for event in send_status_func(response.thought):
             yield {ChatEvent.STATUS: event}
 
-    yield ResearchIteration(query=parsed_response, warning=warning, raw_response=response.raw_content)
+    # Each tool call in the batch shares the raw response. It is used to group the batch in the iteration history.
+    for parsed_response, warning in zip(parsed_responses, warnings):
+        yield ResearchIteration(query=parsed_response, warning=warning, raw_response=response.raw_content)
+
+
+# Research tools that only read data and do not depend on each other. These can be run concurrently.
+parallel_research_tools = {
+    ConversationCommand.SemanticSearchFiles,
+    ConversationCommand.SearchWeb,
+    ConversationCommand.ReadWebpage,
+    ConversationCommand.RegexSearchFiles,
+    ConversationCommand.ViewFile,
+    ConversationCommand.ListFiles,
+}
+research_tools = parallel_research_tools | {ConversationCommand.PythonCoder, ConversationCommand.OperateComputer}
+
+
+def is_research_end(iteration: ResearchIteration) -> bool:
+    "Check if research iteration selected no tool or the text tool to end the research run"
+    return not iteration.query or isinstance(iteration.query, str) or iteration.query.name == ConversationCommand.Text
+
+
+def is_parallel_tool(iteration: ResearchIteration) -> bool:
+    "Check if tool selected in research iteration can be run concurrently with other tools"
+    return isinstance(iteration.query, ToolCall) and iteration.query.name in parallel_research_tools
+
+
+async def execute_tools_concurrently(
+    iterations: List[ResearchIteration],
+    execute_tool: Callable[[ResearchIteration], AsyncGenerator],
+    timeout: float,
+):
+    """
+    Run the tools selected in each research iteration concurrently, with a timeout per tool.
+    Yield status updates from the tools as they arrive. Tool errors and timeouts are stored as iteration warnings.
+    """
+    status_queue: asyncio.Queue = asyncio.Queue()
+
+    async def run_tool(iteration: ResearchIteration):
+        async for event in execute_tool(iteration):
+            await status_queue.put(event)
+
+    async def run_tool_with_timeout(iteration: ResearchIteration):
+        try:
+            await asyncio.wait_for(run_tool(iteration), timeout=timeout)
+        except asyncio.TimeoutError:
+            iteration.warning = f"{iteration.query.name} tool timed out after {timeout:.0f} seconds"
+            logger.warning(f"Research mode: {iteration.warning}. Query: {iteration.query.args}")
+        except Exception as e:
+            iteration.warning = f"Error running {iteration.query.name} tool: {e}"
+            logger.error(iteration.warning, exc_info=True)
+
+    with timer(f"Ran {len(iterations)} research tools concurrently", logger):
+        tools_task = asyncio.gather(*[run_tool_with_timeout(iteration) for iteration in iterations])
+        try:
+            while not tools_task.done() or not status_queue.empty():
+                next_status = asyncio.ensure_future(status_queue.get())
+                done, _ = await asyncio.wait({next_status, tools_task}, return_when=asyncio.FIRST_COMPLETED)
+                if next_status in done:
+                    yield next_status.result()
+                else:
+                    next_status.cancel()
+        finally:
+            # Stop running tools if the research run is stopped early
+            if not tools_task.done():
+                tools_task.cancel()
+
+
+def summarize_iteration_results(iteration: ResearchIteration, iteration_index: int) -> str:
+    "Format the results of the tool run in the research iteration for the research agent"
+    document_results = iteration.context
+    online_results = iteration.onlineContext
+    code_results = iteration.codeContext
+    operator_results = iteration.operatorContext
+    if not (document_results or online_results or code_results or operator_results or iteration.warning):
+        return "Failed to get results."
+
+    results_data = f"\n<iteration_{iteration_index}_results>"
+    if document_results:
+        results_data += f"\n<document_references>\n{yaml.dump(document_results, allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</document_references>"
+    if online_results:
+        results_data += f"\n<online_results>\n{yaml.dump(online_results, allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</online_results>"
+    if code_results:
+        results_data += f"\n<code_results>\n{yaml.dump(truncate_code_context(code_results), allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</code_results>"
+    if operator_results:
+        results_data += f"\n<browser_operator_results>\n{operator_results.response}\n</browser_operator_results>"
+    if iteration.warning:
+        results_data += f"\n<warning>\n{iteration.warning}\n</warning>"
+    results_data += f"\n</results>\n</iteration_{iteration_index}_results>"
+
+    # intermediate_result = await extract_relevant_info(iteration.query, results_data, agent)
+    return results_data
 
 
 async def research(
@@ -229,6 +329,7 @@ async def research(
     max_webpages_to_read = 1
     current_iteration = 0
     MAX_ITERATIONS = int(os.getenv("KHOJ_RESEARCH_ITERATIONS", 5))
+    RESEARCH_TOOL_TIMEOUT = float(os.getenv("KHOJ_RESEARCH_TOOL_TIMEOUT", 180))
 
     # Incorporate previous partial research into current research chat history
     research_conversation_history = [chat for chat in deepcopy(conversation_history) if chat.message]
@@ -237,79 +338,14 @@ async def research(
         previous_iterations_history = construct_iteration_history(previous_iterations)
         research_conversation_history += previous_iterations_history
 
-    while current_iteration < MAX_ITERATIONS:
-        # Check for cancellation at the start of each iteration
-        if cancellation_event and cancellation_event.is_set():
-            logger.debug(f"Research cancelled. User {user} disconnected client.")
-            break
-
-        # Update the query for the current research iteration
-        if interrupt_query := get_message_from_queue(interrupt_queue):
-            if interrupt_query == abort_message:
-                cancellation_event.set()
-                logger.debug(f"Research cancelled by user {user} via interrupt queue.")
-                break
-            # Add the interrupt query as a new user message to the research conversation history
-            logger.info(
-                f"Continuing research for user {user} with the previous {len(previous_iterations)} iterations and new instruction: {interrupt_query}"
-            )
-            previous_iterations_history = construct_iteration_history(
-                previous_iterations, query, query_images, query_files
-            )
-            research_conversation_history += previous_iterations_history
-            query = interrupt_query
-            previous_iterations = []
-
-            async for result in send_status_func(f"**Incorporate New Instruction**: {interrupt_query}"):
-                yield result
-
-        online_results: Dict = dict()
-        code_results: Dict = dict()
-        document_results: List[Dict[str, str]] = []
-        operator_results: OperatorRun = None
-        this_iteration = ResearchIteration(query=query)
-
-        async for result in apick_next_tool(
-            query,
-            research_conversation_history,
-            user,
-            location,
-            user_name,
-            agent,
-            previous_iterations,
-            MAX_ITERATIONS,
-            query_images=query_images,
-            query_files=query_files,
-            max_document_searches=max_document_searches,
-            max_online_searches=max_online_searches,
-            max_webpages_to_read=max_webpages_to_read,
-            send_status_func=send_status_func,
-            tracer=tracer,
-        ):
-            if isinstance(result, dict) and ChatEvent.STATUS in result:
-                yield result[ChatEvent.STATUS]
-            elif isinstance(result, ResearchIteration):
-                this_iteration = result
-                yield this_iteration
-
-        # Skip running iteration if warning present in iteration
-        if this_iteration.warning:
-            logger.warning(f"Research mode: {this_iteration.warning}.")
-
-        # Terminate research if selected text tool or query, tool not set for next iteration
-        elif (
-            not this_iteration.query
-            or isinstance(this_iteration.query, str)
-            or this_iteration.query.name == ConversationCommand.Text
-        ):
-            current_iteration = MAX_ITERATIONS
-
-        elif this_iteration.query.name == ConversationCommand.SemanticSearchFiles:
+    async def execute_tool(this_iteration: ResearchIteration, searched_queries: Set[str]):
+        """
+        Run the tool selected in the research iteration. Store its results in the iteration. Yield status updates.
+        Semantic searches skip and add to the searched queries. So concurrent searches in a batch skip each other's queries.
+        """
+        if this_iteration.query.name == ConversationCommand.SemanticSearchFiles:
             this_iteration.context = []
             document_results = []
-            previous_inferred_queries = {
-                c["query"] for iteration in previous_iterations if iteration.context for c in iteration.context
-            }
             async for result in search_documents(
                 **this_iteration.query.args,
                 n=max_document_searches,
@@ -321,7 +357,7 @@ async def research(
                 location_data=location,
                 send_status_func=send_status_func,
                 query_images=query_images,
-                previous_inferred_queries=previous_inferred_queries,
+                previous_inferred_queries=searched_queries,
                 agent=agent,
                 tracer=tracer,
                 query_files=query_files,
@@ -377,13 +413,13 @@ async def research(
                     elif is_none_or_empty(result):
                         this_iteration.warning = "Detected previously run online search queries. Skipping iteration. Try something different."
                     else:
-                        online_results: Dict[str, Dict] = result  # type: ignore
-                        this_iteration.onlineContext = online_results
+                        this_iteration.onlineContext = result  # type: ignore
             except Exception as e:
                 this_iteration.warning = f"Error searching online: {e}"
                 logger.error(this_iteration.warning, exc_info=True)
 
         elif this_iteration.query.name == ConversationCommand.ReadWebpage:
+            online_results: Dict[str, Dict] = {}
             try:
                 async for result in read_webpages_content(
                     **this_iteration.query.args,
@@ -397,16 +433,11 @@ async def research(
                         yield result[ChatEvent.STATUS]
                     else:
                         direct_web_pages: Dict[str, Dict] = result  # type: ignore
-
-                        webpages = []
                         for web_query in direct_web_pages:
                             if online_results.get(web_query):
                                 online_results[web_query]["webpages"] = direct_web_pages[web_query]["webpages"]
                             else:
                                 online_results[web_query] = {"webpages": direct_web_pages[web_query]["webpages"]}
-
-                            for webpage in direct_web_pages[web_query]["webpages"]:
-                                webpages.append(webpage["link"])
                         this_iteration.onlineContext = online_results
             except Exception as e:
                 this_iteration.warning = f"Error reading webpages: {e}"
@@ -431,8 +462,7 @@ async def research(
                     if isinstance(result, dict) and ChatEvent.STATUS in result:
                         yield result[ChatEvent.STATUS]
                     else:
-                        code_results: Dict[str, Dict] = result  # type: ignore
-                        this_iteration.codeContext = code_results
+                        this_iteration.codeContext = result  # type: ignore
                 async for result in send_status_func(f"**Ran code snippets**: {len(this_iteration.codeContext)}"):
                     yield result
             except (ValueError, TypeError) as e:
@@ -440,6 +470,7 @@ async def research(
                 logger.warning(this_iteration.warning, exc_info=True)
 
         elif this_iteration.query.name == ConversationCommand.OperateComputer:
+            online_results: Dict = {}
             try:
                 async for result in operate_environment(
                     **this_iteration.query.args,
@@ -458,8 +489,7 @@ async def research(
                     if isinstance(result, dict) and ChatEvent.STATUS in result:
                         yield result[ChatEvent.STATUS]
                     elif isinstance(result, OperatorRun):
-                        operator_results = result
-                        this_iteration.operatorContext = operator_results
+                        this_iteration.operatorContext = result
                         # Add webpages visited while operating browser to references
                         if result.webpages:
                             if not online_results.get(this_iteration.query):
@@ -484,8 +514,7 @@ async def research(
                     else:
                         if this_iteration.context is None:
                             this_iteration.context = []
-                        document_results: List[Dict[str, str]] = result  # type: ignore
-                        this_iteration.context += document_results
+                        this_iteration.context += result  # type: ignore
                 async for result in send_status_func(f"**Viewed file**: {this_iteration.query.args['path']}"):
                     yield result
             except Exception as e:
@@ -503,8 +532,7 @@ async def research(
                     else:
                         if this_iteration.context is None:
                             this_iteration.context = []
-                        document_results: List[Dict[str, str]] = [result]  # type: ignore
-                        this_iteration.context += document_results
+                        this_iteration.context += [result]
                 async for result in send_status_func(result["query"]):
                     yield result
             except Exception as e:
@@ -522,39 +550,117 @@ async def research(
                     else:
                         if this_iteration.context is None:
                             this_iteration.context = []
-                        document_results: List[Dict[str, str]] = [result]  # type: ignore
-                        this_iteration.context += document_results
+                        this_iteration.context += [result]
                 async for result in send_status_func(result["query"]):
                     yield result
             except Exception as e:
                 this_iteration.warning = f"Error searching with regex: {e}"
                 logger.error(this_iteration.warning, exc_info=True)
 
-        else:
-            # No valid tools. This is our exit condition.
-            current_iteration = MAX_ITERATIONS
-
-        current_iteration += 1
-
-        if document_results or online_results or code_results or operator_results or this_iteration.warning:
-            results_data = f"\n<iteration_{current_iteration}_results>"
-            if document_results:
-                results_data += f"\n<document_references>\n{yaml.dump(document_results, allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</document_references>"
-            if online_results:
-                results_data += f"\n<online_results>\n{yaml.dump(online_results, allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</online_results>"
-            if code_results:
-                results_data += f"\n<code_results>\n{yaml.dump(truncate_code_context(code_results), allow_unicode=True, sort_keys=False, default_flow_style=False)}\n</code_results>"
-            if operator_results:
-                results_data += (
-                    f"\n<browser_operator_results>\n{operator_results.response}\n</browser_operator_results>"
-                )
-            if this_iteration.warning:
-                results_data += f"\n<warning>\n{this_iteration.warning}\n</warning>"
-            results_data += f"\n</results>\n</iteration_{current_iteration}_results>"
+    while current_iteration < MAX_ITERATIONS:
+        # Check for cancellation at the start of each iteration
+        if cancellation_event and cancellation_event.is_set():
+            logger.debug(f"Research cancelled. User {user} disconnected client.")
+            break
+
+        # Update the query for the current research iteration
+        if interrupt_query := get_message_from_queue(interrupt_queue):
+            if interrupt_query == abort_message:
+                cancellation_event.set()
+                logger.debug(f"Research cancelled by user {user} via interrupt queue.")
+                break
+            # Add the interrupt query as a new user message to the research conversation history
+            logger.info(
+                f"Continuing research for user {user} with the previous {len(previous_iterations)} iterations and new instruction: {interrupt_query}"
+            )
+            previous_iterations_history = construct_iteration_history(
+                previous_iterations, query, query_images, query_files
+            )
+            research_conversation_history += previous_iterations_history
+            query = interrupt_query
+            previous_iterations = []
+
+            async for result in send_status_func(f"**Incorporate New Instruction**: {interrupt_query}"):
+                yield result
+
+        iteration_batch: List[ResearchIteration] = []
+
+        async for result in apick_next_tool(
+            query,
+            research_conversation_history,
+            user,
+            location,
+            user_name,
+            agent,
+            previous_iterations,
+            MAX_ITERATIONS,
+            query_images=query_images,
+            query_files=query_files,
+            max_document_searches=max_document_searches,
+            max_online_searches=max_online_searches,
+            max_webpages_to_read=max_webpages_to_read,
+            send_status_func=send_status_func,
+            tracer=tracer,
+        ):
+            if isinstance(result, dict) and ChatEvent.STATUS in result:
+                yield result[ChatEvent.STATUS]
+            elif isinstance(result, ResearchIteration):
+                iteration_batch.append(result)
+        # Order tools in batch by execution order. So multi-step tool runs, like the operator, are always last.
+        iteration_batch = sorted(
+            iteration_batch or [ResearchIteration(query=query)], key=lambda i: not is_parallel_tool(i)
+        )
+        # Selecting the text tool ends research. Drop it from a batch with other tools and end research after them
+        research_ended = any(is_research_end(iteration) for iteration in iteration_batch)
+        if research_ended and len(iteration_batch) > 1:
+            iteration_batch = [iteration for iteration in iteration_batch if not is_research_end(iteration)]
+        # Each tool call counts as a research iteration. Drop tool calls beyond the research iteration limit
+        remaining_iterations = MAX_ITERATIONS - current_iteration
+        if len(iteration_batch) > remaining_iterations:
+            logger.warning(
+                f"Research mode: Dropped {len(iteration_batch) - remaining_iterations} tool calls beyond research iteration limit."
+            )
+            iteration_batch = iteration_batch[:remaining_iterations]
+        for iteration in iteration_batch:
+            yield iteration
+
+        # Skip running tools for iterations with warnings
+        for iteration in iteration_batch:
+            if iteration.warning:
+                logger.warning(f"Research mode: {iteration.warning}.")
+        runnable_iterations = [
+            iteration
+            for iteration in iteration_batch
+            if not iteration.warning and not is_research_end(iteration) and iteration.query.name in research_tools
+        ]
+
+        # Terminate research if selected text tool or no valid tool set for next iteration. This is our exit condition.
+        if not runnable_iterations and not any(iteration.warning for iteration in iteration_batch):
+            research_ended = True
+
+        # Queries searched so far. Semantic searches check and add their queries to it without awaiting in between.
+        # So concurrent searches in the batch on the event loop cannot both search the same query
+        searched_queries = {
+            c["query"] for iteration in previous_iterations if iteration.context for c in iteration.context
+        }
+
+        # Run independent, read-only tools concurrently. Run the other tools one after the other.
+        parallel_iterations = [i for i in runnable_iterations if is_parallel_tool(i)]
+        sequential_iterations = [i for i in runnable_iterations if not is_parallel_tool(i)]
+        if parallel_iterations:
+            async for result in execute_tools_concurrently(
+                parallel_iterations, partial(execute_tool, searched_queries=searched_queries), RESEARCH_TOOL_TIMEOUT
+            ):
+                yield result
+        for iteration in sequential_iterations:
+            async for result in execute_tool(iteration, searched_queries):
+                yield result
 
-            # intermediate_result = await extract_relevant_info(this_iteration.query, results_data, agent)
-            this_iteration.summarizedResult = results_data
+        for iteration in iteration_batch:
+            current_iteration += 1
+            iteration.summarizedResult = summarize_iteration_results(iteration, current_iteration)
+            previous_iterations.append(iteration)
+            yield iteration
 
-        this_iteration.summarizedResult = this_iteration.summarizedResult or "Failed to get results."
-        previous_iterations.append(this_iteration)
-        yield this_iteration
+        if research_ended:
+            break
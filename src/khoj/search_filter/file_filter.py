@@ -28,5 +28,36 @@ class FileFilter(BaseFilter):
         "Convert file filter to regex"
         return file_filter.replace(".", r"\.").replace("*", r".*")
 
+    @staticmethod
+    def has_wildcards(glob: str, char_classes: bool = False) -> bool:
+        return any(char in glob for char in ("*?[" if char_classes else "*?"))
+
+    @staticmethod
+    def glob_to_regex(glob: str, char_classes: bool = False) -> str:
+        """
+        Convert glob pattern to a regex supported by Postgres.
+        * matches any characters, ? matches a single character.
+        [...] matches a character class, like fnmatch, if char_classes is set. Else brackets are matched literally.
+        """
+        regex = ""
+        idx = 0
+        while idx < len(glob):
+            char = glob[idx]
+            class_end = glob.find("]", idx + 2) if char_classes and char == "[" else -1
+            if char == "*":
+                regex += ".*"
+            elif char == "?":
+                regex += "."
+            elif class_end != -1:
+                char_class = glob[idx + 1 : class_end]
+                negate = char_class.startswith("!")
+                char_class = char_class[1:] if negate else char_class
+                regex += f"[{'^' if negate else ''}{char_class.replace(chr(92), chr(92) * 2)}]"
+                idx = class_end
+            else:
+                regex += re.escape(char)
+            idx += 1
+        return regex
+
     def defilter(self, query: str) -> str:
         return re.sub(self.file_filter_regex, "", query).strip()
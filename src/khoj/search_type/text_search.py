@@ -105,10 +105,29 @@ async def query(
     agent: Optional[Agent] = None,
 ) -> Tuple[List[dict], List[Entry]]:
     "Search for entries that answer the query"
+    hits_by_query = await query_batch(
+        [raw_query],
+        user,
+        type,
+        question_embeddings=[question_embedding] if question_embedding is not None else None,
+        max_distance=max_distance,
+        agent=agent,
+    )
+    return hits_by_query[0]
+
+
+async def query_batch(
+    raw_queries: List[str],
+    user: KhojUser,
+    type: SearchType = SearchType.All,
+    question_embeddings: Optional[List[torch.Tensor]] = None,
+    max_distance: float = None,
+    agent: Optional[Agent] = None,
+) -> List[List[DbEntry]]:
+    "Search for entries that answer each query. Encode and search all queries in a single batch"
 
     file_type = search_type_to_embeddings_type[type.value]
 
-    query = raw_query
     search_model = await sync_to_async(get_default_search_model)()
     if not max_distance:
         if search_model.bi_encoder_confidence_threshold:
@@ -116,26 +135,26 @@ async def query(
         else:
             max_distance = math.inf
 
-    # Encode the query using the bi-encoder
-    if question_embedding is None:
+    # Encode the queries using the bi-encoder
+    if question_embeddings is None:
         with timer("Query Encode Time", logger, state.device):
-            question_embedding = state.embeddings_model[search_model.name].embed_query(query)
+            question_embeddings = await state.embeddings_model[search_model.name].aembed_queries(raw_queries)
 
-    # Find relevant entries for the query
+    # Find relevant entries for the queries
     top_k = 10
     with timer("Search Time", logger, state.device):
-        hits = EntryAdapters.search_with_embeddings(
-            raw_query=raw_query,
-            embeddings=question_embedding,
+        hits_by_query = await sync_to_async(EntryAdapters.search_with_multiple_embeddings)(
+            raw_queries=raw_queries,
+            embeddings=question_embeddings,
             max_results=top_k,
             file_type_filter=file_type,
             max_distance=max_distance,
             user=user,
             agent=agent,
-        ).all()
-        hits = await sync_to_async(list)(hits)  # type: ignore[call-arg]
+            search_model=search_model,
+        )
 
-    return hits
+    return hits_by_query
 
 
 def collate_results(hits, dedupe=True):
@@ -189,21 +208,21 @@ def deduplicated_search_responses(hits: List[SearchResponse]):
             )
 
 
-def rerank_and_sort_results(hits, query, rank_results, search_model_name):
+async def rerank_and_sort_results_batch(hits_by_query, queries, rank_results, search_model_name):
+    "Rerank results of multiple queries using a single cross-encoder pass. Then sort results of each query"
     # Rerank results if explicitly requested, if can use inference server
-    # AND if we have more than one result
-    rank_results = (rank_results or state.cross_encoder_model[search_model_name].inference_server_enabled()) and len(
-        list(hits)
-    ) > 1
+    # AND if query has more than one result
+    rank_results = rank_results or state.cross_encoder_model[search_model_name].inference_server_enabled()
+    queries_to_rank = [idx for idx, hits in enumerate(hits_by_query) if rank_results and len(hits) > 1]
 
-    # Score all retrieved entries using the cross-encoder
-    if rank_results:
-        hits = cross_encoder_score(query, hits, search_model_name)
+    # Score all retrieved entries of all queries using the cross-encoder
+    if queries_to_rank:
+        hits_to_rank = [hit for idx in queries_to_rank for hit in hits_by_query[idx]]
+        hit_queries = [queries[idx] for idx in queries_to_rank for _ in hits_by_query[idx]]
+        await cross_encoder_score(hit_queries, hits_to_rank, search_model_name)
 
-    # Sort results by cross-encoder score followed by bi-encoder score
-    hits = sort_results(rank_results=rank_results, hits=hits)
-
-    return hits
+    # Sort results of each query by cross-encoder score followed by bi-encoder score
+    return [sort_results(rank_results=idx in queries_to_rank, hits=hits) for idx, hits in enumerate(hits_by_query)]
 
 
 def setup(
@@ -232,11 +251,13 @@ def setup(
     return num_new_embeddings, num_deleted_embeddings
 
 
-def cross_encoder_score(query: str, hits: List[SearchResponse], search_model_name: str) -> List[SearchResponse]:
+async def cross_encoder_score(
+    query: str | List[str], hits: List[SearchResponse], search_model_name: str
+) -> List[SearchResponse]:
     """Score all retrieved entries using the cross-encoder"""
     try:
         with timer("Cross-Encoder Predict Time", logger, state.device):
-            cross_scores = state.cross_encoder_model[search_model_name].predict(query, hits)
+            cross_scores = await state.cross_encoder_model[search_model_name].apredict(query, hits)
     except requests.exceptions.HTTPError as e:
         logger.error(f"Failed to rerank documents using the inference endpoint. Error: {e}.", exc_info=True)
         cross_scores = [0.0] * len(hits)
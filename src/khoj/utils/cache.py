@@ -0,0 +1,248 @@
+import atexit
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import unicodedata
+from pathlib import Path
+from typing import TYPE_CHECKING, Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from django.core.cache import caches
+
+from khoj.utils.helpers import LRU
+
+if TYPE_CHECKING:
+    from khoj.database.models import ChatModel
+
+logger = logging.getLogger(__name__)
+
+
+class SearchCache:
+    """
+    Cache search results of each user across server workers.
+
+    Cached results are keyed by the user's knowledge base version.
+    Bump the version whenever the user's knowledge base changes to invalidate their cached results on all workers.
+    The cache backend, its time to live and size is configured via the "search" cache in Django settings.
+    """
+
+    def __init__(self, alias: str = "search"):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def _version_key(user_uuid) -> str:
+        return f"search-version:{user_uuid}"
+
+    def get_version(self, user_uuid) -> int:
+        version_key = self._version_key(user_uuid)
+        version = self.cache.get(version_key)
+        if version is None:
+            # Seed version with current time to never reuse versions of results still in cache, if version evicted
+            self.cache.add(version_key, time.time_ns(), timeout=None)
+            version = self.cache.get(version_key)
+        return version
+
+    def invalidate(self, user_uuid):
+        "Invalidate all cached search results of user by bumping their knowledge base version"
+        try:
+            self.cache.set(self._version_key(user_uuid), time.time_ns(), timeout=None)
+        except Exception as e:
+            logger.error(f"Failed to invalidate search cache of user {user_uuid}: {e}", exc_info=True)
+
+    def _result_key(self, user_uuid, version: int, query_key: str) -> str:
+        query_hash = hashlib.md5(query_key.encode("utf-8")).hexdigest()
+        return f"search:{user_uuid}:{version}:{query_hash}"
+
+    def get_many(self, user_uuid, query_keys: List[str]) -> Tuple[Optional[int], Dict[str, Any]]:
+        """
+        Get cached results of user's search queries, if available.
+        Returns the user's knowledge base version to cache the results of the uncached queries with.
+        """
+        try:
+            version = self.get_version(user_uuid)
+            result_keys = {self._result_key(user_uuid, version, query_key): query_key for query_key in query_keys}
+            cached_results = self.cache.get_many(list(result_keys.keys()))
+        except Exception as e:
+            logger.error(f"Failed to read search cache of user {user_uuid}: {e}", exc_info=True)
+            return None, {}
+        return version, {result_keys[result_key]: results for result_key, results in cached_results.items()}
+
+    def set_many(self, user_uuid, version: Optional[int], results_by_query_key: Dict[str, Any]):
+        """
+        Cache results of user's search queries.
+        Use the knowledge base version read before searching. So results do not outlive a concurrent reindex.
+        """
+        if version is None:
+            return
+        try:
+            self.cache.set_many(
+                {
+                    self._result_key(user_uuid, version, query_key): results
+                    for query_key, results in results_by_query_key.items()
+                }
+            )
+        except Exception as e:
+            logger.error(f"Failed to write search cache of user {user_uuid}: {e}", exc_info=True)
+
+
+class LLMResponseCache:
+    """
+    Cache responses of chat model calls with deterministic prompts, like search query inference, for each user.
+
+    Cached responses are keyed by the hash of the chat model and its provider, prompt messages and response schema.
+    So any change to the prompt, like the current date or chat history in it, is a cache miss.
+    The cache backend, its time to live and size is configured via the "llm" cache in Django settings.
+    """
+
+    def __init__(self, alias: str = "llm"):
+        self.alias = alias
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    @staticmethod
+    def make_key(
+        user_uuid,
+        chat_model: "ChatModel",
+        messages: List[Any],
+        response_type: str = "text",
+        response_schema: Any = None,
+        deepthought: bool = False,
+    ) -> str:
+        schema = response_schema.model_json_schema() if hasattr(response_schema, "model_json_schema") else None
+        prompt = json.dumps(
+            {
+                # Same model name can be served by different providers. Key by the model config and its provider
+                "model": [chat_model.id, chat_model.name, chat_model.model_type],
+                "provider": [chat_model.ai_model_api_id, getattr(chat_model.ai_model_api, "api_base_url", None)],
+                "messages": [[message.role, message.content] for message in messages],
+                "response_type": response_type,
+                "response_schema": schema,
+                "deepthought": deepthought,
+            },
+            sort_keys=True,
+            default=str,
+        )
+        prompt_hash = hashlib.sha256(prompt.encode("utf-8", "surrogatepass")).hexdigest()
+        return f"llm:{user_uuid}:{prompt_hash}"
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        "Get cached chat model response, if available"
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            logger.error(f"Failed to read chat model response cache: {e}", exc_info=True)
+            return None
+
+    def set(self, key: str, response: Dict[str, Any]):
+        "Cache chat model response"
+        try:
+            self.cache.set(key, response)
+        except Exception as e:
+            logger.error(f"Failed to write chat model response cache: {e}", exc_info=True)
+
+
+class QueryEmbeddingsCache:
+    """
+    Cache embeddings of search queries encoded by an embeddings model.
+
+    Repeated queries are served from an in-memory LRU cache instead of running model inference or calling the inference endpoint.
+    Set the cache file to persist cached query embeddings across server restarts. They are stored on disk as float16 arrays.
+    """
+
+    def __init__(self, capacity: int = 10000, cache_file: Optional[Path] = None, persist_every: int = 100):
+        self.capacity = capacity
+        self.cache_file = cache_file
+        self.persist_every = persist_every
+        self.embeddings: LRU = LRU(capacity=capacity)
+        self.hits = 0
+        self.misses = 0
+        self._unsaved_count = 0
+        self._lock = threading.Lock()
+        if self.cache_file:
+            self.load()
+            atexit.register(self.save)
+
+    @staticmethod
+    def normalize(query: str) -> str:
+        "Normalize unicode and whitespace in query, as they do not change its meaning"
+        return " ".join(unicodedata.normalize("NFC", query).split())
+
+    @property
+    def enabled(self) -> bool:
+        return self.capacity > 0
+
+    def get_many(self, queries: List[str]) -> Dict[str, np.ndarray]:
+        "Get cached embeddings of the queries, if available"
+        cached_embeddings = {}
+        with self._lock:
+            for query in queries:
+                key = self.normalize(query)
+                if key in self.embeddings:
+                    cached_embeddings[query] = self.embeddings[key]
+                    self.hits += 1
+                else:
+                    self.misses += 1
+        return cached_embeddings
+
+    def set_many(self, embeddings_by_query: Dict[str, Any]):
+        "Cache embeddings of the queries"
+        with self._lock:
+            for query, embedding in embeddings_by_query.items():
+                self.embeddings[self.normalize(query)] = np.asarray(embedding, dtype=np.float32)
+            self._unsaved_count += len(embeddings_by_query)
+            should_save = self.cache_file and self._unsaved_count >= self.persist_every
+        if should_save:
+            self.save()
+
+    def stats(self) -> Dict[str, Any]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self.embeddings),
+            "capacity": self.capacity,
+        }
+
+    def load(self):
+        "Load query embeddings persisted on disk into cache"
+        if not self.cache_file or not self.cache_file.exists():
+            return
+        try:
+            with np.load(self.cache_file, allow_pickle=False) as persisted:
+                queries, embeddings = persisted["queries"], persisted["embeddings"]
+            with self._lock:
+                # Load most recently used queries last, so they are the last to be evicted
+                for query, embedding in zip(queries[-self.capacity :], embeddings[-self.capacity :]):
+                    self.embeddings[str(query)] = embedding.astype(np.float32)
+            logger.debug(f"Loaded {len(self.embeddings)} cached query embeddings from {self.cache_file}")
+        except Exception as e:
+            logger.error(f"Failed to load cached query embeddings from {self.cache_file}: {e}", exc_info=True)
+
+    def save(self):
+        "Persist cached query embeddings to disk as float16 arrays"
+        if not self.cache_file:
+            return
+        with self._lock:
+            if self._unsaved_count == 0 or len(self.embeddings) == 0:
+                return
+            queries = np.array(list(self.embeddings.keys()), dtype=str)
+            embeddings = np.stack(list(self.embeddings.values())).astype(np.float16)
+            self._unsaved_count = 0
+        try:
+            self.cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Write to temporary file first to not corrupt persisted cache on interrupted writes
+            temp_file = self.cache_file.with_suffix(f".{os.getpid()}.tmp.npz")
+            np.savez(temp_file, queries=queries, embeddings=embeddings)
+            os.replace(temp_file, self.cache_file)
+        except Exception as e:
+            logger.error(f"Failed to persist cached query embeddings to {self.cache_file}: {e}", exc_info=True)
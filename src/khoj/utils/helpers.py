@@ -10,6 +10,7 @@ import os
 import platform
 import random
 import re
+import struct
 import urllib.parse
 import uuid
 from collections import OrderedDict
@@ -23,7 +24,7 @@ from os import path
 from pathlib import Path
 from textwrap import dedent
 from time import perf_counter
-from typing import TYPE_CHECKING, Any, NamedTuple, Optional, Tuple, Type, Union
+from typing import TYPE_CHECKING, Any, List, NamedTuple, Optional, Tuple, Type, Union
 from urllib.parse import ParseResult, urlparse
 
 import anthropic
@@ -224,6 +225,38 @@ class LRU(OrderedDict):
             del self[oldest]
 
 
+class SizedLRU(LRU):
+    """LRU cache bounded by the total size of its items, besides their count"""
+
+    def __init__(self, *args, max_size: int, **kwargs):
+        self.max_size = max_size
+        self.size = 0
+        self.item_sizes: dict = {}
+        super().__init__(*args, **kwargs)
+
+    def __delitem__(self, key):
+        super().__delitem__(key)
+        self.size -= self.item_sizes.pop(key, 0)
+
+    def clear(self):
+        super().clear()
+        self.item_sizes.clear()
+        self.size = 0
+
+    def set(self, key, value, size: int):
+        "Cache value of given size. Skip caching values larger than the whole cache"
+        if key in self:
+            del self[key]
+        if size > self.max_size:
+            return
+        self.item_sizes[key] = size
+        self.size += size
+        self[key] = value
+        while self.size > self.max_size:
+            oldest = next(iter(self))
+            del self[oldest]
+
+
 def get_server_id():
     """Get, Generate Persistent, Random ID per server install.
     Helps count distinct khoj servers deployed.
@@ -1139,6 +1172,27 @@ def clean_text_for_db(text):
     return text.replace("\x00", "")
 
 
+# Size in bytes of each packed line offset
+LINE_OFFSET_SIZE = 4
+
+
+def get_line_offsets(text_bytes: bytes) -> bytes:
+    """Get byte offset of the start of each line in the UTF-8 encoded text, packed as big-endian unsigned integers"""
+    offsets = [0] + [match.end() for match in re.finditer(b"\n", text_bytes)]
+    return struct.pack(f">{len(offsets)}I", *offsets)
+
+
+def unpack_line_offsets(line_offsets: bytes) -> List[int]:
+    """Get byte offsets of lines from their packed line offsets"""
+    return list(struct.unpack(f">{len(line_offsets) // LINE_OFFSET_SIZE}I", line_offsets))
+
+
+def binary_quantize(embeddings) -> str:
+    """Quantize embeddings to a bit string of their signs. Hamming distance between bit strings approximates cosine distance"""
+    values = embeddings.tolist() if hasattr(embeddings, "tolist") else embeddings
+    return "".join("1" if value > 0 else "0" for value in values)
+
+
 def clean_object_for_db(data):
     """Recursively clean PostgreSQL-incompatible characters from nested data structures."""
     if isinstance(data, str):
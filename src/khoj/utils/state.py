@@ -1,6 +1,5 @@
 import os
 import threading
-from collections import defaultdict
 from pathlib import Path
 from typing import Dict, List
 
@@ -12,7 +11,8 @@ from whisper import Whisper
 from khoj.database.models import ProcessLock
 from khoj.processor.embeddings import CrossEncoderModel, EmbeddingsModel
 from khoj.utils import config as utils_config
-from khoj.utils.helpers import LRU, get_device, is_env_var_true
+from khoj.utils.cache import LLMResponseCache, SearchCache
+from khoj.utils.helpers import get_device, is_env_var_true
 
 # Application Global State
 embeddings_model: Dict[str, EmbeddingsModel] = None
@@ -25,7 +25,8 @@ host: str = None
 port: int = None
 ssl_config: Dict[str, str] = None
 cli_args: List[str] = None
-query_cache: Dict[str, LRU] = defaultdict(LRU)
+search_cache: SearchCache = SearchCache()
+llm_response_cache: LLMResponseCache = LLMResponseCache()
 chat_lock = threading.Lock()
 SearchType = utils_config.SearchType
 scheduler: BackgroundScheduler = None
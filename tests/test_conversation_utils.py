@@ -1,8 +1,11 @@
 from copy import deepcopy
 
+import pytest
 import tiktoken
 from langchain_core.messages.chat import ChatMessage
 
+from khoj.database.adapters import ConversationAdapters
+from khoj.database.models import Conversation
 from khoj.processor.conversation import utils
 
 
@@ -173,6 +176,30 @@ class TestTruncateMessage:
         )
         assert truncated_chat_history[0] != copy_big_chat_message, "Original message should be modified"
 
+    def test_truncate_long_history_tokenizes_each_message_few_times(self, monkeypatch):
+        # Arrange
+        chat_history = generate_chat_history(1000)
+        encode_calls = []
+
+        class CountingEncoder:
+            def encode(self, text):
+                encode_calls.append(text)
+                return TestTruncateMessage.encoder.encode(text)
+
+            def decode(self, tokens):
+                return TestTruncateMessage.encoder.decode(tokens)
+
+        monkeypatch.setattr(utils, "get_encoder", lambda *args, **kwargs: CountingEncoder())
+
+        # Act
+        truncated_chat_history = utils.truncate_messages(chat_history, self.max_prompt_size, self.model_name)
+
+        # Assert
+        # Token counts are updated incrementally instead of recounting all messages after each dropped message
+        assert len(encode_calls) < 3 * 1000
+        assert 5 < len(truncated_chat_history) < 1000
+        assert truncated_chat_history[-1].content[0]["text"] == "999"
+
 
 class TestLoadComplexJson:
     def test_load_complex_raw_json_string(self):
@@ -216,6 +243,167 @@ class TestLoadComplexJson:
         assert parsed_json == expected_json
 
 
+def test_count_tokens_reuses_token_counts_of_seen_content():
+    # Arrange
+    encoded_texts = []
+
+    class WordEncoder:
+        name = "test-word-encoder"
+
+        def encode(self, text):
+            encoded_texts.append(text)
+            return text.split()
+
+    content = [{"type": "text", "text": "previously seen chat message"}, {"type": "image_url", "image_url": "x"}]
+
+    # Act
+    first_count = utils.count_tokens(content, WordEncoder())
+    second_count = utils.count_tokens(deepcopy(content), WordEncoder())
+    other_count = utils.count_tokens("new chat message", WordEncoder())
+
+    # Assert
+    assert first_count == second_count == 4 + 500
+    assert other_count == 3
+    assert encoded_texts == ["previously seen chat message", "new chat message"]
+
+
+def test_count_tokens_skips_token_count_cache_for_unnamed_encoders():
+    # Arrange
+    class CharEncoder:
+        def encode(self, text):
+            return list(text)
+
+    class WordEncoder:
+        def encode(self, text):
+            return text.split()
+
+    # Act
+    char_count = utils.count_tokens("unnamed encoder message", CharEncoder())
+    word_count = utils.count_tokens("unnamed encoder message", WordEncoder())
+
+    # Assert
+    assert char_count == 23
+    assert word_count == 3
+
+
+@pytest.mark.django_db(transaction=True)
+@pytest.mark.asyncio
+async def test_save_conversation_appends_messages_to_conversation_log(default_user):
+    # Arrange
+    first_turn = utils.message_to_log("Hello", "Hi there", chat_history=[])
+    conversation = await Conversation.objects.acreate(
+        user=default_user, conversation_log={"chat": [msg.model_dump() for msg in first_turn]}
+    )
+    second_turn = utils.message_to_log("What's up?", "", chat_history=[])
+
+    # Act
+    await ConversationAdapters.save_conversation(
+        default_user, second_turn, conversation_id=str(conversation.id), user_message="What's up?"
+    )
+    conversation = await Conversation.objects.aget(id=conversation.id)
+    popped_message = await conversation.pop_message(interrupted=True)
+    conversation = await Conversation.objects.aget(id=conversation.id)
+
+    # Assert
+    assert popped_message.by == "khoj" and popped_message.message == ""
+    assert [msg.message for msg in conversation.messages] == ["Hello", "Hi there", "What's up?"]
+    assert conversation.slug == "What's up?"
+
+
+@pytest.mark.django_db
+def test_get_conversation_messages_window(default_user):
+    # Arrange
+    chat_log = []
+    for turn in range(1, 6):
+        turn_messages = utils.message_to_log(
+            f"Question {turn}",
+            f"Answer {turn}",
+            user_message_metadata={"turnId": f"turn-{turn}"},
+            khoj_message_metadata={"turnId": f"turn-{turn}", "context": [{"compiled": "notes", "file": "notes.md"}]},
+            chat_history=[],
+        )
+        chat_log += [msg.model_dump() for msg in turn_messages]
+    conversation = Conversation.objects.create(user=default_user, conversation_log={"chat": chat_log})
+
+    # Act
+    latest, latest_has_more = ConversationAdapters.get_conversation_messages(conversation, limit=4)
+    older, older_has_more = ConversationAdapters.get_conversation_messages(
+        conversation, before="turn-4", limit=4, exclude_fields=["context"]
+    )
+    newer, newer_has_more = ConversationAdapters.get_conversation_messages(conversation, after="turn-3")
+    all_but_latest, _ = ConversationAdapters.get_conversation_messages(conversation, n=-2)
+
+    # Assert
+    assert [msg["message"] for msg in latest] == ["Question 4", "Answer 4", "Question 5", "Answer 5"]
+    assert latest_has_more
+    assert [msg["message"] for msg in older] == ["Question 2", "Answer 2", "Question 3", "Answer 3"]
+    assert older_has_more
+    assert all("context" not in msg for msg in older)
+    assert latest[1]["context"][0]["file"] == "notes.md"
+    assert [msg["turnId"] for msg in newer] == ["turn-4", "turn-4", "turn-5", "turn-5"]
+    assert not newer_has_more
+    assert all_but_latest[-1]["message"] == "Answer 4"
+    assert len(all_but_latest) == 8
+
+
+@pytest.mark.django_db
+def test_conversation_messages_decoded_once_per_update(default_user):
+    # Arrange
+    chat_log = [msg.model_dump() for msg in utils.message_to_log("Hello", "Hi there", chat_history=[])]
+    conversation = Conversation.objects.create(user=default_user, conversation_log={"chat": chat_log})
+
+    # Act
+    first_load = Conversation.objects.get(id=conversation.id).messages
+    second_load = Conversation.objects.get(id=conversation.id).messages
+    latest_message = Conversation.objects.get(id=conversation.id).get_latest_messages(1)
+    new_turn = utils.message_to_log("Q", "A", chat_history=[])
+    conversation.conversation_log["chat"] += [msg.model_dump() for msg in new_turn]
+    conversation.save()
+    updated_load = Conversation.objects.get(id=conversation.id).messages
+
+    # Assert
+    # Reloaded conversation reuses decoded messages until it is updated
+    assert first_load[0] is second_load[0]
+    assert latest_message[0] is first_load[-1]
+    assert [msg.message for msg in updated_load] == ["Hello", "Hi there", "Q", "A"]
+    assert updated_load[0] is not first_load[0]
+
+
+def test_construct_iteration_history_groups_tool_calls_from_same_response():
+    # Arrange
+    raw_response = [
+        {"type": "tool_use", "id": "call_1", "name": "search_web", "input": {"query": "weather"}},
+        {"type": "tool_use", "id": "call_2", "name": "semantic_search_files", "input": {"q": "trip"}},
+    ]
+    previous_iterations = [
+        utils.ResearchIteration(
+            query=utils.ToolCall(name="search_web", args={"query": "weather"}, id="call_1"),
+            raw_response=raw_response,
+            summarizedResult="sunny",
+        ),
+        utils.ResearchIteration(
+            query=utils.ToolCall(name="semantic_search_files", args={"q": "trip"}, id="call_2"),
+            raw_response=deepcopy(raw_response),
+            summarizedResult="itinerary",
+        ),
+        utils.ResearchIteration(
+            query=utils.ToolCall(name="view_file", args={"path": "trip.md"}, id="call_3"),
+            raw_response=[{"type": "tool_use", "id": "call_3", "name": "view_file", "input": {"path": "trip.md"}}],
+            summarizedResult="packing list",
+        ),
+    ]
+
+    # Act
+    iteration_history = utils.construct_iteration_history(previous_iterations)
+
+    # Assert
+    assert [msg.intent.type for msg in iteration_history] == ["tool_call", "tool_result", "tool_call", "tool_result"]
+    assert iteration_history[0].message == raw_response
+    assert [part["id"] for part in iteration_history[1].message] == ["call_1", "call_2"]
+    assert [part["content"] for part in iteration_history[1].message] == ["sunny", "itinerary"]
+    assert [part["id"] for part in iteration_history[3].message] == ["call_3"]
+
+
 def generate_content(count, suffix=""):
     return [{"type": "text", "text": " ".join([f"{index}" for index, _ in enumerate(range(count))]) + "\n" + suffix}]
 
@@ -0,0 +1,72 @@
+import os
+import time
+
+from khoj.processor.content.document_parsers import parse_files
+
+# Parse functions run in worker processes, which import this module. So it should not import Django models.
+
+
+def parse_text_or_hang(file_name: str, file: bytes) -> str:
+    "Parse file as text. Hang on files named hang, like a parser stuck on a malformed document"
+    if file_name == "hang":
+        time.sleep(600)
+    return file.decode()
+
+
+def parse_text_or_crash(file_name: str, file: bytes) -> str:
+    "Parse file as text. Exit worker process on files named crash, like a parser crashing on a malformed document"
+    if file_name == "crash":
+        os._exit(1)
+    return file.decode()
+
+
+def test_hung_parse_only_skips_its_own_file(monkeypatch):
+    "Skip file that overruns the parse timeout. Parse the rest."
+    # Arrange
+    monkeypatch.setenv("KHOJ_PARSER_TIMEOUT", "5")
+    data = {"hang": b"", "first": b"first text", "second": b"second text"}
+
+    # Act
+    start = time.monotonic()
+    parsed_files = parse_files(parse_text_or_hang, data)
+
+    # Assert
+    assert parsed_files == {"first": "first text", "second": "second text"}
+    assert time.monotonic() - start < 60, "Expected hung worker to be stopped at its parse timeout"
+
+
+def test_crashed_parse_only_skips_its_own_file():
+    "Skip file that crashes its worker process. Parse the rest."
+    # Arrange
+    data = {"first": b"first text", "crash": b"", "second": b"second text"}
+
+    # Act
+    parsed_files = parse_files(parse_text_or_crash, data)
+
+    # Assert
+    assert parsed_files == {"first": "first text", "second": "second text"}
+
+
+def parse_process_id(file_name: str, file: bytes) -> int:
+    "Get id of worker process parsing the file"
+    return os.getpid()
+
+
+def test_parser_workers_reused_across_files_and_requests(monkeypatch):
+    "Reuse parser workers across files. So document loaders and models are only loaded once per worker."
+    # Arrange
+    monkeypatch.setenv("KHOJ_PARSER_WORKERS", "1")
+    data = {"first": b"", "second": b"", "third": b""}
+
+    # Act
+    first_request_workers = set(parse_files(parse_process_id, data).values())
+    second_request_workers = set(parse_files(parse_process_id, data).values())
+    monkeypatch.setenv("KHOJ_PARSER_WORKERS", "2")
+    resized_pool_workers = set(parse_files(parse_process_id, data).values())
+
+    # Assert
+    assert len(first_request_workers) == 1
+    assert second_request_workers == first_request_workers
+    assert os.getpid() not in first_request_workers
+    assert len(resized_pool_workers) == 2, "Expected pool resized on change to configured number of workers"
+    assert resized_pool_workers.isdisjoint(first_request_workers)
@@ -1,3 +1,6 @@
+# Standard Packages
+import re
+
 # Application Packages
 from khoj.search_filter.file_filter import FileFilter
 
@@ -132,6 +135,25 @@ def test_get_multiple_include_exclude_file_filter_terms():
     assert filter_terms == ["file 1.org", "/path/to/dir/.*.org", "-file 1.org", "-/path/to/dir/*.org"]
 
 
+def test_glob_to_regex():
+    # Arrange
+    file_filter = FileFilter()
+
+    # Act
+    file_glob_regex = file_filter.glob_to_regex("notes/*.md")
+    single_char_glob_regex = file_filter.glob_to_regex("file ?.org")
+    char_class_glob_regex = file_filter.glob_to_regex("notes/[!a]*.md", char_classes=True)
+    literal_bracket_glob_regex = file_filter.glob_to_regex("notes/[a].md")
+
+    # Assert
+    assert re.fullmatch(file_glob_regex, "notes/daily/2024.md")
+    assert not re.fullmatch(file_glob_regex, "notes/2024.mdx")
+    assert re.fullmatch(single_char_glob_regex, "file 1.org")
+    assert re.fullmatch(char_class_glob_regex, "notes/b.md")
+    assert not re.fullmatch(char_class_glob_regex, "notes/a.md")
+    assert re.fullmatch(literal_bracket_glob_regex, "notes/[a].md")
+
+
 def arrange_content():
     entries = [
         Entry(compiled="", raw="First Entry", file="file 1.org"),
@@ -2,9 +2,13 @@
 import pytest
 import logging
 
+from asgiref.sync import async_to_sync, sync_to_async
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
 from khoj.database.adapters import FileObjectAdapters
 from khoj.database.models import KhojUser
-from khoj.routers.helpers import grep_files
+from khoj.routers.helpers import grep_files, view_file_content
 
 logger = logging.getLogger(__name__)
 
@@ -203,6 +207,112 @@ async def test_grep_files_multiple_files(default_user: KhojUser):
     assert "file2.txt:1: hello from file2" in result["compiled"]
 
 
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_grep_files_streams_large_files_and_stops_at_max_results(default_user: KhojUser, monkeypatch):
+    user = await default_user
+    await FileObjectAdapters.adelete_all_file_objects(user=user)
+    # Stream file text in small chunks to split lines and multi-byte characters across chunks
+    monkeypatch.setenv("KHOJ_GREP_CHUNK_SIZE", "7")
+    # Arrange
+    await FileObjectAdapters.acreate_file_object(
+        user=user,
+        file_name="a.txt",
+        raw_text="\n".join(f"hello line {i} 🌍 café" for i in range(1, 6)),
+    )
+    await FileObjectAdapters.acreate_file_object(
+        user=user,
+        file_name="b.txt",
+        raw_text="hello from file b",
+    )
+
+    # Act
+    results = [
+        result
+        async for result in grep_files(
+            regex_pattern="hello",
+            user=user,
+            max_results=3,
+        )
+    ]
+
+    # Assert
+    assert len(results) == 1
+    result = results[0]
+    assert "Found 4+ matches for 'hello' in 2 documents" in result["query"]
+    assert "Showing first 3 results" in result["query"]
+    assert "a.txt:1: hello line 1 🌍 café\n" in result["compiled"]
+    assert "a.txt:3: hello line 3 🌍 café\n" in result["compiled"]
+    assert "a.txt:4: hello line 4" not in result["compiled"]
+    assert "b.txt" not in result["compiled"]
+    assert result["compiled"].endswith("... more results found. Use stricter regex or path to narrow down results.")
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_view_file_content_reads_line_range(default_user: KhojUser):
+    user = await default_user
+    await FileObjectAdapters.adelete_all_file_objects(user=user)
+    # Arrange
+    file_object = await FileObjectAdapters.acreate_file_object(
+        user=user,
+        file_name="book.txt",
+        raw_text="\n".join(f"line {i}" for i in range(1, 201)) + "\n",
+    )
+    await FileObjectAdapters.aupdate_raw_text(file_object, "\n".join(f"line {i}" for i in range(1, 101)))
+
+    # Act
+    middle = [result async for result in view_file_content("book.txt", start_line=10, end_line=12, user=user)]
+    last = [result async for result in view_file_content("book.txt", start_line=99, user=user)]
+    truncated = [result async for result in view_file_content("book.txt", start_line=1, end_line=80, user=user)]
+    beyond = [result async for result in view_file_content("book.txt", start_line=101, end_line=105, user=user)]
+
+    # Assert
+    assert middle[0][0]["compiled"] == "line 10\nline 11\nline 12"
+    assert last[0][0]["compiled"] == "line 99\nline 100"
+    assert truncated[0][0]["compiled"].startswith("line 1\n")
+    assert "line 50\n\n[Truncated after 50 lines!" in truncated[0][0]["compiled"]
+    assert "line 51" not in truncated[0][0]["compiled"]
+    assert beyond[0][0]["compiled"] == "Start line 101 exceeds total number of lines 100"
+
+
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_file_lines_deep_in_large_file_read_by_byte_range(default_user: KhojUser):
+    user = await default_user
+    await FileObjectAdapters.adelete_all_file_objects(user=user)
+    # Arrange
+    line_count = 30_000
+    line_text = "line {} of a large file 🌍 with multi-byte characters"
+    large_file = await FileObjectAdapters.acreate_file_object(
+        user=user,
+        file_name="large.txt",
+        raw_text="\n".join(line_text.format(i) for i in range(1, line_count + 1)),
+    )
+    small_file = await FileObjectAdapters.acreate_file_object(user=user, file_name="small.txt", raw_text="small file")
+    deep_line_start = len("\n".join(line_text.format(i) for i in range(1, line_count - 1)).encode("utf-8")) + 1
+
+    def read_lines_capturing_queries(start_line: int):
+        with CaptureQueriesContext(connection) as context:
+            lines = async_to_sync(FileObjectAdapters.aget_file_object_lines)(
+                user, "large.txt", start_line, start_line + 1
+            )
+        return lines, [query["sql"] for query in context.captured_queries]
+
+    # Act
+    deep_lines, queries = await sync_to_async(read_lines_capturing_queries)(line_count - 1)
+
+    # Assert
+    assert deep_lines == (f"{line_text.format(line_count - 1)}\n{line_text.format(line_count)}", line_count)
+    # Only the offsets of the requested lines and then only the bytes of those lines are read
+    assert f'substring("database_fileobject"."line_offsets", {(line_count - 2) * 4 + 1}, 12)' in queries[0]
+    assert f'substring("database_fileobject"."raw_text_bytes", {deep_line_start + 1}, ' in queries[1]
+    # Only large files store their text bytes separately
+    assert large_file.raw_text_bytes is not None
+    assert small_file.raw_text_bytes is None
+    assert await FileObjectAdapters.aget_file_object_lines(user, "small.txt", 1, 1) == ("small file", 1)
+
+
 @pytest.mark.parametrize(
     "regex_pattern,expected_matches,test_description",
     [
@@ -1,17 +1,36 @@
+import asyncio
+import logging
 import os
 import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
+from unittest.mock import MagicMock
 
 import numpy as np
 import psutil
 import pytest
+from asgiref.sync import sync_to_async
 from scipy.stats import linregress
 
-from khoj.processor.embeddings import EmbeddingsModel
+from khoj.configure import log_inference_stats
+from khoj.database.models import SearchModelConfig
+from khoj.processor.conversation.utils import ResponseWithThought
+from khoj.processor.embeddings import (
+    CrossEncoderModel,
+    EmbeddingsModel,
+    MicroBatcher,
+    get_inference_device,
+)
 from khoj.processor.tools.online_search import (
     read_webpage_at_url,
     read_webpage_with_olostep,
 )
-from khoj.utils import helpers
+from khoj.routers import helpers as router_helpers
+from khoj.routers.api_chat import cancel_background_tasks_on_exit
+from khoj.utils import helpers, state
+from khoj.utils.cache import LLMResponseCache, QueryEmbeddingsCache, SearchCache
+from khoj.utils.rawconfig import SearchResponse
+from tests.helpers import AiModelApiFactory, ChatModelFactory
 
 
 def test_get_from_null_dict():
@@ -59,6 +78,199 @@ def test_lru_cache():
     assert cache == {"b": 2, "d": 4}
 
 
+def test_sized_lru_cache():
+    # Arrange
+    cache = helpers.SizedLRU(capacity=10, max_size=10)
+
+    # Act
+    cache.set("a", "small", 4)
+    cache.set("b", "medium", 5)
+    cache["a"]  # accessing 'a' makes it the most recently used item
+    cache.set("c", "large", 6)  # so 'b' is deleted from the cache to fit 'c' instead of 'a'
+    cache.set("d", "too large", 11)  # items larger than the whole cache are not cached
+
+    # Assert
+    assert cache == {"a": "small", "c": "large"}
+    assert cache.size == 10
+
+
+def test_search_cache_invalidated_per_user(settings):
+    # Arrange
+    settings.CACHES = {
+        **settings.CACHES,
+        "test-search": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-search"},
+    }
+    cache = SearchCache(alias="test-search")
+    version_a, _ = cache.get_many("user-a", [])
+    version_b, _ = cache.get_many("user-b", [])
+    cache.set_many("user-a", version_a, {"query": ["result a"]})
+    cache.set_many("user-b", version_b, {"query": ["result b"]})
+
+    # Act
+    cache.invalidate("user-a")
+
+    # Assert
+    assert cache.get_many("user-a", ["query"])[1] == {}
+    assert cache.get_many("user-b", ["query"])[1] == {"query": ["result b"]}
+
+
+@pytest.mark.asyncio
+@pytest.mark.django_db(transaction=True)
+async def test_llm_response_cache_skips_repeat_chat_model_calls(settings, monkeypatch, default_user, default_user2):
+    # Arrange
+    settings.CACHES = {
+        **settings.CACHES,
+        "test-llm": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "test-llm"},
+    }
+    monkeypatch.setattr(state, "llm_response_cache", LLMResponseCache(alias="test-llm"))
+    ai_model_api = await sync_to_async(AiModelApiFactory)(api_key="test-key")
+    await sync_to_async(ChatModelFactory)(name="gpt-4o-mini", model_type="openai", ai_model_api=ai_model_api)
+    # Same model name served by another provider
+    other_ai_model_api = await sync_to_async(AiModelApiFactory)(api_key="other-key", api_base_url="https://other.ai/v1")
+    other_chat_model = await sync_to_async(ChatModelFactory)(
+        name="gpt-4o-mini", model_type="openai", ai_model_api=other_ai_model_api
+    )
+    chat_model_calls = []
+
+    async def fake_send_message_to_model(messages, **kwargs):
+        chat_model_calls.append(messages)
+        return ResponseWithThought(text='{"queries": ["emacs load path"]}')
+
+    monkeypatch.setattr(router_helpers, "asend_message_to_model", fake_send_message_to_model)
+
+    async def infer_queries(query, user, chat_model=None):
+        return await router_helpers.send_message_to_model_wrapper(
+            query, response_type="json_object", agent_chat_model=chat_model, cache_response=True, user=user
+        )
+
+    # Act
+    first_response = await infer_queries("How to configure emacs?", default_user)
+    repeat_response = await infer_queries("How to configure emacs?", default_user)
+    await infer_queries("How to configure emacs?", default_user2)
+    await infer_queries("How to configure vim?", default_user)
+    await infer_queries("How to configure emacs?", default_user, chat_model=other_chat_model)
+
+    # Assert
+    assert repeat_response.text == first_response.text
+    assert len(chat_model_calls) == 4
+
+
+def test_query_embeddings_cache_persisted_to_disk(tmp_path):
+    # Arrange
+    cache_file = tmp_path / "query_embeddings.npz"
+    cache = QueryEmbeddingsCache(capacity=2, cache_file=cache_file, persist_every=1)
+    cache.get_many(["emacs load path"])
+    cache.set_many({"emacs load path": [0.1, 0.2, 0.3]})
+
+    # Act
+    restored_cache = QueryEmbeddingsCache(capacity=2, cache_file=cache_file)
+    cached_embeddings = restored_cache.get_many(["  emacs   load path ", "unseen query"])
+
+    # Assert
+    assert cache.stats()["misses"] == 1
+    assert list(cached_embeddings.keys()) == ["  emacs   load path "]
+    assert np.allclose(cached_embeddings["  emacs   load path "], [0.1, 0.2, 0.3], atol=1e-3)
+    assert restored_cache.stats()["hits"] == 1 and restored_cache.stats()["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_micro_batcher_coalesces_concurrent_requests():
+    # Arrange
+    processed_batches = []
+
+    def double(items):
+        processed_batches.append(items)
+        return [item * 2 for item in items]
+
+    batcher = MicroBatcher(double, name="test", max_batch_size=10, batch_window=0.05)
+
+    # Act
+    results = await asyncio.gather(batcher.submit([1, 2]), batcher.submit([3]), batcher.submit([4, 5, 6]))
+
+    # Assert
+    assert results == [[2, 4], [6], [8, 10, 12]]
+    assert processed_batches == [[1, 2, 3, 4, 5, 6]]
+    assert batcher.stats()["batches"] == 1 and batcher.stats()["requests"] == 3
+
+
+@pytest.mark.asyncio
+async def test_inference_stats_logged_periodically(monkeypatch, caplog):
+    # Arrange
+    embeddings_model = EmbeddingsModel(embeddings_inference_endpoint_type=SearchModelConfig.ApiType.HUGGINGFACE)
+    monkeypatch.setattr(embeddings_model, "encode_queries", lambda queries: [[0.1, 0.2] for _ in queries])
+    monkeypatch.setattr(state, "embeddings_model", {"default": embeddings_model})
+    monkeypatch.setattr(state, "cross_encoder_model", {})
+    await asyncio.gather(embeddings_model.aembed_queries(["emacs"]), embeddings_model.aembed_queries(["vim"]))
+    await embeddings_model.aembed_queries(["emacs"])
+
+    # Act
+    with caplog.at_level(logging.INFO):
+        log_inference_stats()
+
+    # Assert
+    stats_logs = [
+        record.message for record in caplog.records if "Inference stats of embeddings model" in record.message
+    ]
+    assert stats_logs == [f"📊 Inference stats of embeddings model default: {embeddings_model.stats()}"]
+    assert embeddings_model.stats()["query_batching"]["requests"] == 3
+    assert embeddings_model.stats()["query_cache"]["hit_rate"] == pytest.approx(1 / 3)
+
+
+def test_local_embeddings_inference_serialized_across_threads():
+    # Arrange
+    embeddings_model = EmbeddingsModel(embeddings_inference_endpoint_type=SearchModelConfig.ApiType.HUGGINGFACE)
+    embeddings_model.inference_endpoint_type = SearchModelConfig.ApiType.LOCAL
+    running_inferences = []
+    max_running_inferences = 0
+
+    def encode(texts, **kwargs):
+        nonlocal max_running_inferences
+        running_inferences.append(texts)
+        max_running_inferences = max(max_running_inferences, len(running_inferences))
+        time.sleep(0.01)
+        running_inferences.remove(texts)
+        return np.zeros((len(texts), 2))
+
+    embeddings_model.embeddings_model = MagicMock(encode=encode)
+    docs = [f"doc {i}" for i in range(100)]
+
+    # Act
+    # Index content types and search queries concurrently
+    with ThreadPoolExecutor(max_workers=3) as executor:
+        docs_embeddings = list(executor.map(embeddings_model.embed_documents, [docs, docs]))
+        query_embeddings = executor.submit(embeddings_model.embed_queries, ["query"]).result()
+
+    # Assert
+    assert max_running_inferences == 1, "Expected model to run one inference at a time"
+    assert [len(embeddings) for embeddings in docs_embeddings] == [100, 100]
+    assert len(query_embeddings) == 1
+
+
+@pytest.mark.asyncio
+async def test_background_tasks_cancelled_when_event_stream_closed_early():
+    # Arrange
+    started_tasks = []
+
+    @cancel_background_tasks_on_exit
+    async def event_stream(background_tasks=None):
+        task = asyncio.create_task(asyncio.sleep(60))
+        background_tasks.append(task)
+        started_tasks.append(task)
+        yield "first event"
+        yield "second event"
+
+    # Act
+    stream = event_stream()
+    first_event = await stream.__anext__()
+    await stream.aclose()
+    await asyncio.sleep(0)
+
+    # Assert
+    assert first_event == "first event"
+    assert len(started_tasks) == 1
+    assert started_tasks[0].cancelled()
+
+
 @pytest.mark.skip(reason="Memory leak exists on GPU, MPS devices")
 def test_encode_docs_memory_leak():
     # Arrange
@@ -87,6 +299,52 @@ def test_encode_docs_memory_leak():
     assert slope < 2, f"Memory leak suspected on {device}. Memory usage increased at ~{slope:.2f} MB per iteration"
 
 
+def test_int8_inference_backend_matches_torch_output():
+    # Arrange
+    query = "How to load Khoj on Emacs?"
+    passages = [
+        "Add the khoj.el package to your Emacs load path",
+        "Khoj can be self-hosted with Docker",
+        "Bake the cake at 180 degrees for 40 minutes",
+    ]
+    hits = [
+        SearchResponse(entry=passage, score=0.0, corpus_id="0", additional={"compiled": passage})
+        for passage in passages
+    ]
+    torch_backend = SearchModelConfig.InferenceBackend.TORCH
+    int8_backend = SearchModelConfig.InferenceBackend.INT8
+
+    # Act
+    torch_embeddings = np.array(EmbeddingsModel(inference_backend=torch_backend).embed_documents(passages))
+    int8_embeddings = np.array(EmbeddingsModel(inference_backend=int8_backend).embed_documents(passages))
+    torch_scores = np.array(CrossEncoderModel(inference_backend=torch_backend).predict(query, hits))
+    int8_scores = np.array(CrossEncoderModel(inference_backend=int8_backend).predict(query, hits))
+
+    # Assert
+    # Embeddings are normalized, so their dot product is their cosine similarity
+    assert np.all(np.sum(torch_embeddings * int8_embeddings, axis=1) > 0.98)
+    assert np.allclose(torch_scores, int8_scores, atol=0.1)
+    assert np.argmax(torch_scores) == np.argmax(int8_scores) == 0
+
+
+def test_int8_inference_backend_only_warns_when_other_device_requested(caplog):
+    # Arrange
+    int8_backend = SearchModelConfig.InferenceBackend.INT8
+
+    # Act
+    with caplog.at_level(logging.WARNING):
+        devices_without_warning = [get_inference_device(int8_backend, device) for device in [None, "cpu"]]
+    warnings_without_device_request = caplog.text
+    with caplog.at_level(logging.WARNING):
+        device_with_warning = get_inference_device(int8_backend, "cuda:0")
+
+    # Assert
+    assert devices_without_warning == ["cpu", "cpu"]
+    assert "Int8 inference backend only runs on CPU" not in warnings_without_device_request
+    assert device_with_warning == "cpu"
+    assert "instead of cuda:0" in caplog.text
+
+
 @pytest.mark.asyncio
 async def test_reading_webpage():
     # Arrange
@@ -1,9 +1,12 @@
+import asyncio
+import json
 import os
 from datetime import datetime
 
 import freezegun
 import pytest
 from freezegun import freeze_time
+from langchain_core.messages.chat import ChatMessage
 
 from khoj.database.models import ChatMessageModel
 from khoj.processor.conversation.openai.gpt import converse_openai
@@ -756,3 +759,70 @@ def populate_chat_history(message_list):
             chat_history=[],
         )
     return chat_history
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_async_completion_assembles_streamed_tool_calls(monkeypatch):
+    # Arrange
+    from openai.types.chat.chat_completion_chunk import ChatCompletionChunk
+
+    from khoj.processor.conversation.openai import utils as openai_utils
+
+    def make_chunk(delta: dict = None, usage: dict = None):
+        choices = [{"index": 0, "delta": delta}] if delta else []
+        return ChatCompletionChunk.model_validate(
+            {
+                "id": "1",
+                "object": "chat.completion.chunk",
+                "created": 0,
+                "model": "gpt-4o",
+                "choices": choices,
+                "usage": usage,
+            }
+        )
+
+    def tool_call_delta(index, id=None, name=None, args=""):
+        return {"index": index, "id": id, "type": "function", "function": {"name": name, "arguments": args}}
+
+    chunks = [
+        make_chunk({"role": "assistant", "content": "Looking up"}),
+        make_chunk({"tool_calls": [tool_call_delta(0, "call_1", "search_web", '{"query": ')]}),
+        make_chunk({"tool_calls": [tool_call_delta(0, args='"weather"}')]}),
+        make_chunk({"tool_calls": [tool_call_delta(1, "call_2", "list_files", "{}")]}),
+        make_chunk(usage={"prompt_tokens": 10, "completion_tokens": 5, "total_tokens": 15}),
+    ]
+
+    class FakeAsyncCompletions:
+        async def create(self, **kwargs):
+            assert kwargs["stream"] is True
+
+            async def stream():
+                for chunk in chunks:
+                    await asyncio.sleep(0)
+                    yield chunk
+
+            return stream()
+
+    class FakeAsyncClient:
+        chat = type("Chat", (), {"completions": FakeAsyncCompletions()})()
+
+    monkeypatch.setitem(openai_utils.openai_async_clients, "test-key--None", FakeAsyncClient())
+    tracer: dict = {}
+
+    # Act
+    response = await openai_utils.acompletion_with_backoff(
+        messages=[ChatMessage(role="user", content="What should I wear today?")],
+        model_name="gpt-4o",
+        openai_api_key="test-key",
+        tracer=tracer,
+    )
+
+    # Assert
+    assert json.loads(response.text) == [
+        {"name": "search_web", "args": {"query": "weather"}, "id": "call_1"},
+        {"name": "list_files", "args": {}, "id": "call_2"},
+    ]
+    assert response.thought == "Looking up"
+    assert tracer["usage"]["input_tokens"] == 10
+    assert tracer["usage"]["output_tokens"] == 5
@@ -1,3 +1,4 @@
+import asyncio
 import os
 import urllib.parse
 
@@ -6,6 +7,10 @@ from freezegun import freeze_time
 
 from khoj.database.models import Agent, Entry, KhojUser
 from khoj.processor.conversation import prompts
+from khoj.processor.conversation.utils import ResearchIteration, ToolCall
+from khoj.routers import research
+from khoj.routers.research import execute_tools_concurrently
+from khoj.utils.helpers import ConversationCommand
 from tests.helpers import ConversationFactory, generate_chat_history, get_chat_api_key
 
 # Initialize variables for tests
@@ -693,3 +698,117 @@ def test_answer_using_file_filter(chat_client):
     assert only_full_name_check or comparative_statement_check, (
         "Expected Xi is older than Namita, but got: " + response_message
     )
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_execute_research_tools_concurrently_with_timeout():
+    # Arrange
+    cancelled_tools = []
+
+    async def execute_tool(iteration):
+        yield f"start {iteration.query.args['query']}"
+        try:
+            await asyncio.sleep(iteration.query.args["delay"])
+        except asyncio.CancelledError:
+            cancelled_tools.append(iteration.query.name)
+            raise
+        iteration.context = [{"query": iteration.query.args["query"]}]
+        yield f"end {iteration.query.args['query']}"
+
+    iterations = [
+        ResearchIteration(query=ToolCall(name="search_web", args={"query": "a", "delay": 0}, id="1")),
+        ResearchIteration(query=ToolCall(name="list_files", args={"query": "b", "delay": 0}, id="2")),
+        ResearchIteration(query=ToolCall(name="view_file", args={"query": "c", "delay": 600}, id="3")),
+    ]
+
+    # Act
+    status_updates = [update async for update in execute_tools_concurrently(iterations, execute_tool, timeout=0.5)]
+
+    # Assert
+    assert status_updates[:3] == ["start a", "start b", "start c"]
+    assert set(status_updates[3:]) == {"end a", "end b"}
+    assert [iteration.context for iteration in iterations[:2]] == [[{"query": "a"}], [{"query": "b"}]]
+    assert cancelled_tools == ["view_file"], "Expected slow tool cancelled at its timeout"
+    assert iterations[2].context is None
+    assert "timed out" in iterations[2].warning
+
+
+async def send_status(message):
+    yield message
+
+
+async def run_research(previous_iterations: list):
+    async for _ in research.research(
+        user=None,
+        query="plan my trip",
+        conversation_id=None,
+        conversation_history=[],
+        previous_iterations=previous_iterations,
+        query_images=[],
+        send_status_func=send_status,
+    ):
+        pass
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_research_counts_each_tool_call_against_iteration_limit(monkeypatch):
+    # Arrange
+    monkeypatch.setenv("KHOJ_RESEARCH_ITERATIONS", "5")
+    searched_query_sets = []
+
+    async def pick_three_searches(*args, **kwargs):
+        for i in range(3):
+            yield ResearchIteration(query=ToolCall(name="semantic_search_files", args={"q": f"query {i}"}, id=f"{i}"))
+
+    async def search_documents(q, previous_inferred_queries=None, **kwargs):
+        searched_query_sets.append(previous_inferred_queries)
+        yield [{"query": q, "file": "notes.md", "compiled": q}], [q], q
+
+    monkeypatch.setattr(research, "apick_next_tool", pick_three_searches)
+    monkeypatch.setattr(research, "search_documents", search_documents)
+    previous_iterations = []
+
+    # Act
+    await run_research(previous_iterations)
+
+    # Assert
+    # Second batch of three tool calls is capped at the two iterations left
+    assert len(searched_query_sets) == 5
+    assert len(previous_iterations) == 5
+    assert all(iteration.context and not iteration.warning for iteration in previous_iterations)
+    # Each tool call result is rendered with its own iteration index
+    assert all(
+        f"<iteration_{i}_results>" in iteration.summarizedResult for i, iteration in enumerate(previous_iterations, 1)
+    )
+    # Semantic searches in a batch share the searched queries. So they skip queries searched by each other
+    assert searched_query_sets[0] is searched_query_sets[1] is searched_query_sets[2]
+    assert searched_query_sets[3] is not searched_query_sets[0]
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.asyncio
+async def test_research_ends_when_text_tool_selected_with_other_tools(monkeypatch):
+    # Arrange
+    num_tool_picks = 0
+
+    async def pick_search_and_text(*args, **kwargs):
+        nonlocal num_tool_picks
+        num_tool_picks += 1
+        yield ResearchIteration(query=ToolCall(name="semantic_search_files", args={"q": "itinerary"}, id="1"))
+        yield ResearchIteration(query=ToolCall(name=ConversationCommand.Text, args={}, id="2"))
+
+    async def search_documents(q, **kwargs):
+        yield [{"query": q, "file": "notes.md", "compiled": q}], [q], q
+
+    monkeypatch.setattr(research, "apick_next_tool", pick_search_and_text)
+    monkeypatch.setattr(research, "search_documents", search_documents)
+    previous_iterations = []
+
+    # Act
+    await run_research(previous_iterations)
+
+    # Assert
+    assert num_tool_picks == 1, "Expected research to end after running tools selected with the text tool"
+    assert [iteration.query.name for iteration in previous_iterations] == ["semantic_search_files"]
@@ -37,6 +37,21 @@ def test_multi_page_pdf_to_jsonl():
     assert len(entries[1]) == 6
 
 
+def test_unparseable_pdf_does_not_stop_other_pdfs_from_being_parsed():
+    "Skip PDF files that cannot be parsed. Extract entries from the rest."
+    # Arrange
+    with open("tests/data/pdf/multipage.pdf", "rb") as f:
+        pdf_bytes = f.read()
+    data = {"tests/data/pdf/corrupt.pdf": b"not a pdf", "tests/data/pdf/multipage.pdf": pdf_bytes}
+
+    # Act
+    file_to_text_map, entries = PdfToEntries.extract_pdf_entries(pdf_files=data)
+
+    # Assert
+    assert list(file_to_text_map.keys()) == ["tests/data/pdf/multipage.pdf"]
+    assert len(entries) == 6
+
+
 @pytest.mark.skip(reason="Temporarily disabled OCR due to performance issues")
 def test_ocr_page_pdf_to_jsonl():
     "Convert multiple pages from single PDF file to jsonl."
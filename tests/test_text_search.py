@@ -2,15 +2,26 @@
 import asyncio
 import logging
 import os
+import threading
+from unittest.mock import MagicMock, patch
 
 import pytest
-
-from khoj.database.adapters import EntryAdapters
-from khoj.database.models import Entry, GithubConfig, KhojUser
+import torch
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from khoj.database.adapters import (
+    ConversationAdapters,
+    EntryAdapters,
+    get_default_search_model,
+)
+from khoj.database.models import ContentEmbeddings, Entry, GithubConfig, KhojUser, SearchModelConfig
 from khoj.processor.content.github.github_to_entries import GithubToEntries
 from khoj.processor.content.org_mode.org_to_entries import OrgToEntries
 from khoj.processor.content.text_to_entries import TextToEntries
+from khoj.routers.helpers import configure_content, speculative_search_documents
 from khoj.search_type import text_search
+from khoj.utils import state
 from tests.helpers import get_index_files, get_sample_data
 
 logger = logging.getLogger(__name__)
@@ -127,6 +138,405 @@ async def test_text_search(search_config):
     assert "Emacs load path" in search_result, 'Expected "Emacs load path" in entry'
 
 
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_text_search_batch_matches_individual_searches(search_config):
+    # Arrange
+    default_user, _ = await KhojUser.objects.aget_or_create(
+        username="test_user", password="test_password", email="test@example.com"
+    )
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, text_search.setup, OrgToEntries, get_sample_data("org"), True, default_user)
+    queries = ["Load Khoj on Emacs?", "How to install Khoj?"]
+
+    # Act
+    hits_by_query = await text_search.query_batch(queries, default_user)
+    hits_of_each_query = [await text_search.query(query, default_user) for query in queries]
+
+    # Assert
+    assert len(hits_by_query) == len(queries)
+    for batch_hits, hits in zip(hits_by_query, hits_of_each_query):
+        assert len(batch_hits) > 0
+        assert [hit.id for hit in batch_hits] == [hit.id for hit in hits]
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+@pytest.mark.asyncio
+async def test_speculative_search_documents_with_user_query(search_config):
+    # Arrange
+    default_user, _ = await KhojUser.objects.aget_or_create(
+        username="test_user", password="test_password", email="test@example.com"
+    )
+    loop = asyncio.get_event_loop()
+    await loop.run_in_executor(None, text_search.setup, OrgToEntries, get_sample_data("org"), True, default_user)
+    conversation = await ConversationAdapters.acreate_conversation_session(default_user)
+
+    # Act
+    references = await speculative_search_documents("Load Khoj on Emacs?", 7, None, default_user, str(conversation.id))
+
+    # Assert
+    assert len(references) > 0
+    assert all(reference["query"] == "Load Khoj on Emacs?" for reference in references)
+    assert any("Emacs load path" in reference["compiled"] for reference in references)
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_search_with_vector_index(search_config, default_user: KhojUser):
+    # Arrange
+    search_model = get_default_search_model()
+    search_model.vector_index_min_entries = 1
+    search_model.save()
+    query = "Load Khoj on Emacs?"
+
+    # Act
+    text_search.setup(OrgToEntries, get_sample_data("org"), regenerate=True, user=default_user)
+    search_model = get_default_search_model()
+    query_embedding = state.embeddings_model[search_model.name].embed_query(query)
+    hits = EntryAdapters.search_with_embeddings(query, query_embedding, default_user, search_model=search_model)
+
+    # Assert
+    assert search_model.embeddings_dimensions == len(query_embedding)
+    assert EntryAdapters.has_vector_index(default_user, search_model), "Expected vector index on user entries"
+    assert "Emacs load path" in hits[0].raw, 'Expected "Emacs load path" in top entry'
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_invalid_vector_index_rebuilt(default_user: KhojUser):
+    # Arrange
+    search_model = SearchModelConfig.objects.create(name="small", embeddings_dimensions=4, vector_index_min_entries=1)
+    Entry.objects.bulk_create(
+        [
+            Entry(user=default_user, embeddings=[i, 1, 0, 1], raw=f"{i}", compiled=f"{i}", search_model=search_model)
+            for i in range(10)
+        ]
+    )
+    EntryAdapters.update_vector_index(default_user, search_model)
+    # Mark index invalid, like an interrupted concurrent index build does
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "UPDATE pg_index SET indisvalid = false WHERE indexrelid = %s::regclass",
+            [EntryAdapters.get_vector_index_name(default_user, search_model)],
+        )
+
+    # Act
+    has_index_before_rebuild = EntryAdapters.has_vector_index(default_user, search_model)
+    EntryAdapters.update_vector_index(default_user, search_model)
+
+    # Assert
+    assert not has_index_before_rebuild, "Expected invalid vector index to not be used"
+    assert EntryAdapters.has_vector_index(default_user, search_model), "Expected invalid vector index to be rebuilt"
+
+    # Act
+    EntryAdapters.set_embeddings_dimensions(search_model, 8)
+
+    # Assert
+    assert search_model.embeddings_dimensions == 8
+    assert EntryAdapters.get_vector_index_validity(default_user, search_model) is None
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_search_with_binary_quantized_embeddings(search_config, default_user: KhojUser):
+    # Arrange
+    search_model = get_default_search_model()
+    search_model.embeddings_quantization = SearchModelConfig.EmbeddingsQuantization.BINARY
+    search_model.quantized_search_candidates = 5
+    search_model.save()
+    query = "Load Khoj on Emacs?"
+
+    # Act
+    text_search.setup(OrgToEntries, get_sample_data("org"), regenerate=True, user=default_user)
+    search_model = get_default_search_model()
+    query_embedding = state.embeddings_model[search_model.name].embed_query(query)
+    hits = EntryAdapters.search_with_embeddings(query, query_embedding, default_user, search_model=search_model)
+    search_model.embeddings_quantization = SearchModelConfig.EmbeddingsQuantization.NONE
+    exact_hits = EntryAdapters.search_with_embeddings(query, query_embedding, default_user, search_model=search_model)
+
+    # Assert
+    assert not Entry.objects.filter(user=default_user, binary_embeddings__isnull=True).exists()
+    assert len(hits) <= 5
+    assert hits[0].id == exact_hits[0].id, "Expected same top entry as exact search"
+    assert "Emacs load path" in hits[0].raw, 'Expected "Emacs load path" in top entry'
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_binary_quantized_search_rescores_entries_without_binary_embeddings(default_user: KhojUser):
+    # Arrange
+    search_model = SearchModelConfig.objects.create(
+        name="small",
+        embeddings_quantization=SearchModelConfig.EmbeddingsQuantization.BINARY,
+        quantized_search_candidates=1,
+    )
+    other_search_model = SearchModelConfig.objects.create(name="large")
+
+    def entry(raw, embeddings, binary_embeddings, model=search_model):
+        return Entry(
+            user=default_user,
+            raw=raw,
+            compiled=raw,
+            hashed_value=raw,
+            embeddings=embeddings,
+            binary_embeddings=binary_embeddings,
+            search_model=model,
+        )
+
+    Entry.objects.bulk_create(
+        [
+            entry("quantized", [1.0, 0.5, 0.2], "111"),
+            entry("quantized far", [-1.0, -0.5, 0.2], "001"),
+            # Indexed before the search model quantized embeddings
+            entry("unquantized", [0.2, 1.0, -0.5], None),
+            entry("unquantized far", [-0.2, -1.0, 0.5], None),
+            # Binary embeddings of another search model have another length
+            entry("other model", [0.8, 0.6, 0.2, 0.1], "1111", model=other_search_model),
+        ]
+    )
+
+    def search(query_embedding):
+        hits = EntryAdapters.search_with_embeddings(
+            "query", torch.tensor(query_embedding), default_user, max_results=1, search_model=search_model
+        )
+        return [hit.raw for hit in hits]
+
+    # Act
+    hits_of_quantized_entry = search([1.0, 0.5, 0.2])
+    hits_of_unquantized_entry = search([0.2, 1.0, -0.5])
+
+    # Assert
+    assert hits_of_quantized_entry == ["quantized"], "Expected shortlist of quantized entries rescored"
+    assert hits_of_unquantized_entry == ["unquantized"], "Expected entries without binary embeddings rescored"
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_entries_re_embedded_when_inference_backend_changes(default_user: KhojUser, monkeypatch):
+    # Arrange
+    search_model = SearchModelConfig.objects.create(
+        name="small", embeddings_quantization=SearchModelConfig.EmbeddingsQuantization.BINARY
+    )
+    Entry.objects.bulk_create(
+        [
+            Entry(
+                user=default_user,
+                raw=raw,
+                compiled=raw,
+                hashed_value=raw,
+                embeddings=[1.0, 0.5, 0.2],
+                binary_embeddings="111",
+                search_model=search_model,
+            )
+            for raw in ["first entry", "second entry"]
+        ]
+    )
+    re_embedded = [-1.0, 0.5, -0.2]
+    embeddings_model = MagicMock()
+    embeddings_model.embed_documents.side_effect = lambda docs: [re_embedded for _ in docs]
+    monkeypatch.setattr(state, "embeddings_model", {search_model.name: embeddings_model})
+
+    # Act
+    num_re_embedded_on_first_start = EntryAdapters.regenerate_stale_embeddings(search_model)
+    search_model.inference_backend = SearchModelConfig.InferenceBackend.INT8
+    search_model.save()
+    num_re_embedded_on_backend_change = EntryAdapters.regenerate_stale_embeddings(search_model)
+    num_re_embedded_on_restart = EntryAdapters.regenerate_stale_embeddings(search_model)
+
+    # Assert
+    assert num_re_embedded_on_first_start == 0, "Expected entries of unfingerprinted model assumed current"
+    assert num_re_embedded_on_backend_change == 2
+    assert num_re_embedded_on_restart == 0
+    search_model.refresh_from_db()
+    assert search_model.embeddings_fingerprint == search_model.get_embeddings_fingerprint()
+    for entry in Entry.objects.filter(search_model=search_model):
+        assert list(entry.embeddings) == pytest.approx(re_embedded)
+        assert entry.binary_embeddings is None, "Expected stale binary embeddings cleared to re-quantize"
+    stored_embeddings = EntryAdapters.get_stored_embeddings(search_model, ["first entry", "second entry"])
+    assert len(stored_embeddings) == 2, "Expected re-embedded content stored under new model settings"
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_index_streamed_in_chunks_matches_single_chunk(search_config, default_user: KhojUser, monkeypatch):
+    # Arrange
+    data = get_sample_data("org")
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    entries = set(Entry.objects.filter(user=default_user).values_list("hashed_value", "compiled"))
+    monkeypatch.setenv("KHOJ_INDEXING_CHUNK_SIZE", "2")
+    monkeypatch.setenv("KHOJ_INDEXING_QUEUE_DEPTH", "1")
+
+    # Act
+    num_added, _ = text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+
+    # Assert
+    streamed_entries = set(Entry.objects.filter(user=default_user).values_list("hashed_value", "compiled"))
+    assert num_added == len(entries) > 2
+    assert streamed_entries == entries
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_unchanged_index_sync_queries_do_not_grow_with_files(search_config, default_user: KhojUser):
+    # Arrange
+    def sync_query_count(num_files: int) -> int:
+        data = {f"notes/{idx}.org": f"* Heading {idx}\nContent of note {idx}" for idx in range(num_files)}
+        text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+        with CaptureQueriesContext(connection) as context:
+            num_added, num_deleted = text_search.setup(OrgToEntries, data, regenerate=False, user=default_user)
+        assert num_added == num_deleted == 0
+        return len(context.captured_queries)
+
+    # Act
+    few_files_query_count = sync_query_count(2)
+    many_files_query_count = sync_query_count(20)
+
+    # Assert
+    assert many_files_query_count == few_files_query_count
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_index_reuses_embeddings_of_identical_content(
+    search_config, default_user: KhojUser, default_user2: KhojUser, monkeypatch
+):
+    # Arrange
+    data = get_sample_data("org")
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    embeddings_model = state.embeddings_model[get_default_search_model().name]
+    embedded_docs = []
+    embed_documents = embeddings_model.embed_documents
+    monkeypatch.setattr(
+        embeddings_model, "embed_documents", lambda docs: embedded_docs.extend(docs) or embed_documents(docs)
+    )
+
+    # Act
+    num_added, _ = text_search.setup(OrgToEntries, data, regenerate=False, user=default_user2)
+
+    # Assert
+    user_entries = set(Entry.objects.filter(user=default_user).values_list("hashed_value", flat=True))
+    user2_entries = set(Entry.objects.filter(user=default_user2).values_list("hashed_value", flat=True))
+    assert num_added > 0
+    assert user2_entries == user_entries
+    assert embedded_docs == [], "Expected stored embeddings to be reused instead of re-encoding identical content"
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db(transaction=True)
+def test_configure_content_indexes_content_types_concurrently(search_config, default_user: KhojUser):
+    # Arrange
+    files = {
+        "org": get_sample_data("org"),
+        "markdown": get_sample_data("markdown"),
+        "pdf": {},
+        "plaintext": {},
+        "image": {},
+        "docx": {},
+    }
+    # Each content type waits for the other to start indexing. So serial indexing breaks the barrier
+    both_indexing = threading.Barrier(2, timeout=30)
+    indexing_threads = set()
+    original_setup = text_search.setup
+
+    def setup_when_both_indexing(*args, **kwargs):
+        indexing_threads.add(threading.current_thread().name)
+        both_indexing.wait()
+        return original_setup(*args, **kwargs)
+
+    # Act
+    with patch.object(text_search, "setup", side_effect=setup_when_both_indexing):
+        success = configure_content(default_user, files, regenerate=True)
+
+    # Assert
+    assert success, "Expected content types to be indexed concurrently"
+    assert len(indexing_threads) == 2
+    assert Entry.objects.filter(user=default_user, file_type="org").exists()
+    assert Entry.objects.filter(user=default_user, file_type="markdown").exists()
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_text_index_embeds_content_with_stored_embeddings_pruned_while_indexing(
+    search_config, default_user: KhojUser, default_user2: KhojUser, monkeypatch
+):
+    # Arrange
+    data = get_sample_data("org")
+    text_search.setup(OrgToEntries, data, regenerate=True, user=default_user)
+    get_stored_embeddings = EntryAdapters.get_stored_embeddings
+
+    def prune_then_get_stored_embeddings(search_model, hashed_values):
+        # Stored embeddings get pruned after they were identified for reuse
+        ContentEmbeddings.objects.filter(search_model=search_model).delete()
+        return get_stored_embeddings(search_model, hashed_values)
+
+    monkeypatch.setattr(EntryAdapters, "get_stored_embeddings", prune_then_get_stored_embeddings)
+
+    # Act
+    num_added, _ = text_search.setup(OrgToEntries, data, regenerate=False, user=default_user2)
+
+    # Assert
+    user_entries = set(Entry.objects.filter(user=default_user).values_list("hashed_value", flat=True))
+    user2_entries = set(Entry.objects.filter(user=default_user2).values_list("hashed_value", flat=True))
+    assert num_added == len(user_entries) > 0
+    assert user2_entries == user_entries
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_stored_embeddings_keyed_by_model_settings_and_pruned(default_user: KhojUser):
+    # Arrange
+    search_model = SearchModelConfig.objects.create(name="small")
+    EntryAdapters.store_embeddings(search_model, ["indexed", "unindexed"], [[1, 0, 0], [0, 1, 0]])
+    Entry.objects.bulk_create(
+        [
+            Entry(
+                user=default_user,
+                embeddings=[1, 0, 0],
+                raw="",
+                compiled="",
+                hashed_value="indexed",
+                search_model=search_model,
+            )
+        ]
+    )
+
+    # Act
+    num_pruned = EntryAdapters.prune_stored_embeddings()
+
+    # Assert
+    assert num_pruned == 1, "Expected stored embeddings of content no longer indexed to be pruned"
+    assert EntryAdapters.get_stored_embedding_hashes(search_model, ["indexed", "unindexed"]) == {"indexed"}
+
+    # Act
+    search_model.bi_encoder_docs_encode_config = {"normalize_embeddings": False}
+    search_model.save()
+
+    # Assert
+    assert EntryAdapters.get_stored_embedding_hashes(search_model, ["indexed"]) == set()
+    assert EntryAdapters.prune_stored_embeddings() == 1, "Expected stored embeddings of previous settings pruned"
+
+
+# ----------------------------------------------------------------------------------------------------
+@pytest.mark.django_db
+def test_word_filter_uses_trigram_index(search_config, default_user: KhojUser):
+    # Arrange
+    text_search.setup(OrgToEntries, get_sample_data("org"), regenerate=True, user=default_user)
+    with connection.cursor() as cursor:
+        cursor.execute("SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm'")
+        if cursor.fetchone() is None:
+            pytest.skip("pg_trgm extension is not available on this database server")
+        # Force planner to use index even on the tiny test table
+        cursor.execute("SET LOCAL enable_seqscan = off")
+
+    # Act
+    query_plan = EntryAdapters.apply_filters(default_user, 'Load Khoj +"emacs"').explain()
+
+    # Assert
+    assert "entry_raw_upper_trgm_idx" in query_plan
+
+
 # ----------------------------------------------------------------------------------------------------
 @pytest.mark.django_db
 def test_entry_chunking_by_max_tokens(tmp_path, search_config, default_user: KhojUser, caplog):